@@ -4,16 +4,36 @@
 
 import os
 import re
+import asyncio
+import heapq
+import bisect
+import hashlib
+import hmac
+import secrets
+import signal
+import fcntl
+import sys
 import logging
+import functools
+import itertools
 import html
-from datetime import datetime
-from typing import Optional, Dict, Any, List
-
-try:
-    from zoneinfo import ZoneInfo
-except Exception:
-    ZoneInfo = None
-
+import string
+import unicodedata
+import csv
+import glob
+import tempfile
+import json
+import time
+import sqlite3
+from array import array
+from functools import lru_cache
+from collections import deque, OrderedDict
+from datetime import date, datetime, timedelta
+from types import MappingProxyType
+from urllib.parse import urlsplit
+from typing import Optional, Dict, Any, List, Deque, Tuple, NamedTuple, Callable, Awaitable, Mapping, Iterator
+
+import httpx
 from telegram import (
     Update,
     InlineKeyboardButton,
@@ -22,508 +42,2563 @@ from telegram import (
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
     Contact,
+    CallbackQuery,
 )
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
+    AIORateLimiter,
+    BaseUpdateProcessor,
     ContextTypes,
+    BasePersistence,
+    PersistenceInput,
     filters,
 )
-from telegram.constants import ParseMode
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+from telegram.constants import ParseMode, MessageLimit
+from telegram.error import TelegramError, RetryAfter, BadRequest, Forbidden
 
 # ----------------------- Config -----------------------
 # You can keep these hardcoded for local testing, or set BOT_TOKEN / ADMIN_ID env variables.
 BOT_TOKEN = os.getenv("BOT_TOKEN", "7832412035:AAFVc6186iqlNE_HS60u11tdCzC8pvCQ02c")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "6427405038"))
 
+# Serving mode: long polling by default; set WEBHOOK_URL (public https base URL) to serve a webhook instead.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+# Bot API server base URL (a self-hosted telegram-bot-api, or a local stub in benchmarks); default is Telegram's.
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+# Telegram echoes this in the X-Telegram-Bot-Api-Secret-Token header; requests without it are rejected.
+# Replicas behind a load balancer must share one value, otherwise the last one to start wins.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Bounded update queue: when handlers fall behind, the webhook server blocks instead of buffering forever.
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+# Updates are handled concurrently, up to CONCURRENT_UPDATES at once; each user's still run one at a time, in order.
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "256"))
+
+# Local state (registration flow, queues, logs) lives under DATA_DIR.
+DATA_DIR = os.getenv("DATA_DIR", "data")
+# Registration flow state is persisted to STATE_SHARDS SQLite files so a restart keeps half-finished flows.
+STATE_SHARDS = int(os.getenv("STATE_SHARDS", "4"))
+STATE_TTL = int(os.getenv("STATE_TTL", str(7 * 24 * 3600)))  # seconds; older sessions are dropped on load
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "10"))  # seconds between write-behind flushes
+# Idle registration sessions are reaped from memory every REAPER_INTERVAL seconds.
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(24 * 3600)))  # idle seconds before a session is dropped
+SESSION_REMIND_AFTER = float(os.getenv("SESSION_REMIND_AFTER", "3600"))  # nudge unfinished flows once (0 = off)
+SESSION_MAX = int(os.getenv("SESSION_MAX", "200000"))  # hard cap; least recently active sessions go first
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "60"))
+# Confirmed registrations are sent to every sink in NOTIFY_SINKS (comma separated):
+#   telegram:<chat id>   an admin chat or group      webhook:<url>   POST the registration as JSON
+#   file:<path>          append JSON lines (relative to DATA_DIR)
+# Append #<course_key> (repeatable) to limit a sink to those courses, e.g. telegram:-1001234567#python.
+NOTIFY_SINKS = os.getenv("NOTIFY_SINKS", f"telegram:{ADMIN_ID}")
+NOTIFY_WEBHOOK_TIMEOUT = float(os.getenv("NOTIFY_WEBHOOK_TIMEOUT", "10"))
+NOTIFY_WEBHOOK_SECRET = os.getenv("NOTIFY_WEBHOOK_SECRET", "")  # signs webhook bodies when set
+# Each sink has its own on-disk outbox, so a failed send never loses a registration.
+OUTBOX_CHAT_INTERVAL = float(os.getenv("OUTBOX_CHAT_INTERVAL", "1.0"))  # min seconds between sends to one chat
+OUTBOX_RETRY_DELAY = float(os.getenv("OUTBOX_RETRY_DELAY", "1"))  # first retry; doubles per failure
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+OUTBOX_DIGEST_MAX = int(os.getenv("OUTBOX_DIGEST_MAX", "10"))  # registrations merged into one digest message
+OUTBOX_MAX_PENDING = int(os.getenv("OUTBOX_MAX_PENDING", "10000"))  # per sink; the oldest is dropped beyond
+# After OUTBOX_BREAKER_FAILURES failed deliveries in a row a sink is left alone for OUTBOX_BREAKER_COOLDOWN s.
+OUTBOX_BREAKER_FAILURES = int(os.getenv("OUTBOX_BREAKER_FAILURES", "5"))
+OUTBOX_BREAKER_COOLDOWN = float(os.getenv("OUTBOX_BREAKER_COOLDOWN", "60"))
+
+# Flood control: per-user token bucket on incoming updates, global limiter on outgoing API calls.
+USER_RATE = float(os.getenv("USER_RATE", "1"))  # updates per second refilled per user
+USER_BURST = float(os.getenv("USER_BURST", "5"))
+USER_IDLE_TTL = float(os.getenv("USER_IDLE_TTL", "600"))  # seconds before an idle user's bucket is forgotten
+GLOBAL_RATE = float(os.getenv("GLOBAL_RATE", "30"))  # outgoing messages per second (Telegram's bot-wide limit)
+
+# /broadcast sends pages of BROADCAST_PAGE recipients, at most BROADCAST_CONCURRENCY sends in flight.
+BROADCAST_PAGE = int(os.getenv("BROADCAST_PAGE", "100"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+# An answer edits the bot's prompt in place when the prompt is at most PROMPT_EDIT_DISTANCE messages up.
+PROMPT_EDIT_DISTANCE = int(os.getenv("PROMPT_EDIT_DISTANCE", "4"))
+# /find lists registrants CRM_PAGE at a time; the last CRM_SEARCHES searches stay pageable.
+CRM_PAGE = int(os.getenv("CRM_PAGE", "10"))
+CRM_SEARCHES = int(os.getenv("CRM_SEARCHES", "100"))
+# Bots may upload files up to 50 MB (2000 MB through a self-hosted Bot API server); /export sends
+# larger exports as several files of at most EXPORT_PART_MB each.
+EXPORT_PART_MB = float(os.getenv("EXPORT_PART_MB", "1900" if BOT_API_URL else "48"))
+
+# Course catalog (JSON, or YAML with PyYAML installed); edits are picked up without a restart.
+CATALOG_PATH = os.getenv("CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json"))
+CATALOG_RELOAD_INTERVAL = float(os.getenv("CATALOG_RELOAD_INTERVAL", "5"))  # seconds between file checks
+
+LOCALES_DIR = os.getenv("LOCALES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales"))
+DEFAULT_LANGUAGE = os.getenv("DEFAULT_LANGUAGE", "uz")  # also the language of everything sent to the admin
+
+# Prometheus-style metrics are served on http://METRICS_HOST:METRICS_PORT/metrics (0 disables; +worker index in a pool).
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# What to do when a phone number or Telegram account confirms again: reject | flag
+DUPLICATE_POLICY = os.getenv("DUPLICATE_POLICY", "flag")
+
+# WORKERS > 1 runs one ingress process that routes each user's updates to a fixed worker process.
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_CHECK_INTERVAL = float(os.getenv("WORKER_CHECK_INTERVAL", "1"))  # seconds between liveness checks
+WORKER_MAX_BACKOFF = float(os.getenv("WORKER_MAX_BACKOFF", "60"))  # longest wait to restart a crash-looping worker
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", "30"))  # seconds a worker gets to drain on exit
+
+# On SIGTERM/SIGINT intake stops first; queued and running updates then get SHUTDOWN_TIMEOUT seconds. Those
+# not started by then are spilled for the next start, running handlers get SHUTDOWN_GRACE more before they are
+# cancelled, and the notification outboxes OUTBOX_DRAIN_TIMEOUT more. Keep the sum below WORKER_STOP_TIMEOUT.
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+SHUTDOWN_GRACE = float(os.getenv("SHUTDOWN_GRACE", "3"))
+OUTBOX_DRAIN_TIMEOUT = float(os.getenv("OUTBOX_DRAIN_TIMEOUT", "5"))
+
 # ----------------------- Logging & Timezone -----------------------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
 logger = logging.getLogger("iteach_bot")
 
-try:
-    TASHKENT_TZ = ZoneInfo("Asia/Tashkent") if ZoneInfo else None
-except Exception:
-    TASHKENT_TZ = None
-
-# ----------------------- Constants & Labels -----------------------
-COURSES = {
-    "english": "🇬🇧 Ingliz tili",
-    "german": "🇩🇪 Nemis tili",
-    "math": "🧮 Matematika",
-    "uzbek": "🇺🇿 Ona tili",
-    "history": "📜 Tarix",
-    "biology": "🧬 Biologiya",
-    "chemistry": "⚗️ Kimyo",
-}
-COURSES_WITH_LEVEL = {"english", "german"}
-
-LEVELS = {
-    "A1": "A1 • Beginner",
-    "A2": "A2 • Elementary",
-    "B1": "B1 • Intermediate",
-    "B2": "B2 • Upper-Intermediate",
-    "C1": "C1 • Advanced",
-    "C2": "C2 • Proficient",
-}
+@lru_cache(maxsize=None)
+def tashkent_tz():
+    # Looked up on first use, so importing zoneinfo and reading tzdata stay off the cold-start path.
+    try:
+        from zoneinfo import ZoneInfo
+
+        return ZoneInfo("Asia/Tashkent")
+    except Exception:
+        return None
+
+# ----------------------- Localization -----------------------
+class Template:
+    """A message template from a locale file, compiled once into a %-format string.
+
+    Fields are ``{name}`` placeholders; rendering is a single C-level ``%`` with no parsing or escaping.
+    Values must already be safe HTML.
+    """
+
+    __slots__ = ("text", "fields", "_fmt")
+
+    def __init__(self, source: str):
+        parts: List[str] = []
+        fields: List[str] = []
+        for literal, name, spec, conversion in string.Formatter().parse(source):
+            parts.append(literal.replace("%", "%%"))
+            if name is None:
+                continue
+            if spec or conversion or not name.isidentifier():
+                raise ValueError(f"Unsupported placeholder {{{name}}} in template {source!r}")
+            parts.append(f"%({name})s")
+            fields.append(name)
+        self.text = source if not fields else None
+        self.fields = frozenset(fields)
+        self._fmt = "".join(parts)
+
+    def render(self, values: Mapping[str, str]) -> str:
+        return self._fmt % values if self.fields else self.text
+
+def load_locales(directory: str) -> Dict[str, Dict[str, Template]]:
+    """Loads ``<lang>.json`` catalogs; keys missing from a translation fall back to DEFAULT_LANGUAGE."""
+    sources: Dict[str, Dict[str, str]] = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            sources[os.path.splitext(os.path.basename(path))[0]] = json.load(f)
+    base = {key: Template(text) for key, text in sources[DEFAULT_LANGUAGE].items()}
+    locales = {DEFAULT_LANGUAGE: base}
+    for lang, source in sources.items():
+        if lang == DEFAULT_LANGUAGE:
+            continue
+        templates = dict(base)
+        for key, text in source.items():
+            template = Template(text)
+            if key not in base or template.fields != base[key].fields:
+                raise ValueError(f"Locale {lang!r}: key {key!r} does not match {DEFAULT_LANGUAGE!r}")
+            templates[key] = template
+        locales[lang] = templates
+    return locales
+
+LOCALES = load_locales(LOCALES_DIR)
+LANGUAGES = tuple(LOCALES)
+
+def tr(lang: str, key: str, **values: str) -> str:
+    return (LOCALES.get(lang) or LOCALES[DEFAULT_LANGUAGE])[key].render(values)
+
+def user_language(user) -> str:
+    """Maps Telegram's ``language_code`` (IETF tag, e.g. "ru" or "en-US") onto a loaded locale."""
+    code = (getattr(user, "language_code", None) or "").partition("-")[0].lower()
+    return code if code in LOCALES else DEFAULT_LANGUAGE
+
+# ----------------------- Course catalog -----------------------
+class Catalog:
+    """Read-only snapshot of the course catalog; every keyboard derived from it is built here, once.
+
+    ``version`` is a hash of the source file, so it is stable across restarts and worker processes.
+    """
+
+    def __init__(self, version: str, data: Dict[str, Any]):
+        courses = data["courses"]
+        self.version = version
+        self.courses: Mapping[str, str] = MappingProxyType({c["key"]: c["label"] for c in courses})
+        self.courses_with_level = frozenset(c["key"] for c in courses if c.get("levels"))
+        self.levels: Mapping[str, str] = MappingProxyType(dict(data["levels"]))
+        self.sections: Mapping[str, Mapping[str, str]] = MappingProxyType(
+            {c["key"]: MappingProxyType(dict(c["sections"])) for c in courses}
+        )
+        for course_key, sections in self.sections.items():
+            keys = [course_key, *sections, *self.levels]
+            # callback_data is limited to 64 bytes
+            if not sections or any(len(f"reg:section:{k}".encode()) > 64 or ":" in k for k in keys):
+                raise ValueError(f"Invalid catalog entry for course {course_key!r}")
+
+        # Course labels may be translated ("labels": {"ru": ...}); levels and sections are shared.
+        self.course_labels: Mapping[str, Mapping[str, str]] = MappingProxyType(
+            {
+                lang: MappingProxyType({c["key"]: c.get("labels", {}).get(lang, c["label"]) for c in courses})
+                for lang in LANGUAGES
+            }
+        )
+        # Static labels are HTML-escaped here, once; rendering only escapes what users typed.
+        self.course_html = MappingProxyType(
+            {lang: MappingProxyType({k: html.escape(v) for k, v in labels.items()})
+             for lang, labels in self.course_labels.items()}
+        )
+        self.level_html = MappingProxyType({k: html.escape(v) for k, v in self.levels.items()})
+        self.section_html = MappingProxyType(
+            {course_key: MappingProxyType({k: html.escape(v) for k, v in sections.items()})
+             for course_key, sections in self.sections.items()}
+        )
 
-SECTIONS_ENGLISH = {
-    "kids": "👶 Kids",
-    "general": "📘 General",
-    "cefr": "🧭 CEFR",
-    "ielts": "🎓 IELTS",
-}
-SECTIONS_GERMAN = {
-    "kids": "👶 Kids",
-    "general": "📘 General",
-    "certificate": "🏅 Certificate",
-}
-SECTIONS_OTHERS = {
-    "kids": "👶 Kids",
-    "general": "📘 General",
-    "certificate": "🏅 Certificate",
-}
+        # Keyboards, per language: kb_courses[lang], kb_sections[lang][course_key], ...
+        self.kb_courses = MappingProxyType({lang: kb_courses(self, lang) for lang in LANGUAGES})
+        self.kb_levels = MappingProxyType({lang: kb_levels(self, lang) for lang in LANGUAGES})
+        self.kb_sections: Mapping[str, Mapping[str, InlineKeyboardMarkup]] = MappingProxyType(
+            {lang: MappingProxyType({k: kb_sections(self, lang, k) for k in self.courses}) for lang in LANGUAGES}
+        )
+        self.kb_edit_menu: Mapping[str, Mapping[str, InlineKeyboardMarkup]] = MappingProxyType(
+            {lang: MappingProxyType({k: kb_edit_menu(self, lang, k) for k in self.courses}) for lang in LANGUAGES}
+        )
+        self.kb_edit_menu_default = MappingProxyType({lang: kb_edit_menu(self, lang, "") for lang in LANGUAGES})
+
+def load_catalog(path: str) -> Catalog:
+    with open(path, "rb") as f:
+        raw = f.read()
+    if path.endswith((".yaml", ".yml")):
+        import yaml  # optional dependency, only needed for YAML catalogs
+
+        data = yaml.safe_load(raw)
+    else:
+        data = json.loads(raw)
+    return Catalog(hashlib.blake2b(raw, digest_size=6).hexdigest(), data)
+
+class CatalogStore:
+    """Holds the current catalog snapshot and hot-reloads it when the file changes.
+
+    A reload builds a complete new snapshot and swaps the reference, so readers never see a
+    half-built catalog. Recent versions are kept so users mid-flow finish on the one they started with.
+    """
+
+    def __init__(self, path: str, keep: int = 16):
+        self.path = path
+        self.keep = keep
+        self._mtime = os.stat(path).st_mtime_ns
+        self.current = load_catalog(path)
+        self._versions: "OrderedDict[str, Catalog]" = OrderedDict({self.current.version: self.current})
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, version: Optional[str]) -> Catalog:
+        return self._versions.get(version) or self.current if version else self.current
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+            catalog = load_catalog(self.path)
+        except Exception as e:
+            logger.error("Catalog reload failed, keeping version %s: %s", self.current.version, e)
+            return False
+        if catalog.version == self.current.version:
+            return False
+        self._versions[catalog.version] = catalog
+        while len(self._versions) > self.keep:
+            self._versions.popitem(last=False)
+        self.current = catalog
+        logger.info("Catalog reloaded: version %s, %d courses", catalog.version, len(catalog.courses))
+        return True
+
+    async def _watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.reload_if_changed()
+
+    def start(self, interval: float) -> None:
+        self._task = asyncio.create_task(self._watch(interval))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
 
 # ----------------------- Helpers: Keyboards -----------------------
-def kb_register() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([[InlineKeyboardButton("🚀 Ro'yxatdan o'tish", callback_data="reg:start")]])
+# Static markups are built once and reused (PTB's TelegramObjects are immutable); catalog-dependent
+# ones are built by Catalog when a snapshot is loaded.
+@lru_cache(maxsize=None)
+def kb_register(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(tr(lang, "btn_register"), callback_data="reg:start")]])
 
-def kb_courses() -> InlineKeyboardMarkup:
+def kb_grid(items: List[Tuple[str, str]], prefix: str) -> List[List[InlineKeyboardButton]]:
     rows: List[List[InlineKeyboardButton]] = []
-    items = list(COURSES.items())
     for i in range(0, len(items), 2):
         row = []
         for key, label in items[i : i + 2]:
-            row.append(InlineKeyboardButton(label, callback_data=f"reg:course:{key}"))
+            row.append(InlineKeyboardButton(label, callback_data=f"{prefix}{key}"))
         rows.append(row)
-    rows.append([InlineKeyboardButton("❌ Bekor qilish", callback_data="reg:cancel")])
-    return InlineKeyboardMarkup(rows)
+    return rows
 
-def kb_levels() -> InlineKeyboardMarkup:
-    rows = [
-        [
-            InlineKeyboardButton(LEVELS["A1"], callback_data="reg:level:A1"),
-            InlineKeyboardButton(LEVELS["A2"], callback_data="reg:level:A2"),
-        ],
-        [
-            InlineKeyboardButton(LEVELS["B1"], callback_data="reg:level:B1"),
-            InlineKeyboardButton(LEVELS["B2"], callback_data="reg:level:B2"),
-        ],
-        [
-            InlineKeyboardButton(LEVELS["C1"], callback_data="reg:level:C1"),
-            InlineKeyboardButton(LEVELS["C2"], callback_data="reg:level:C2"),
-        ],
-        [InlineKeyboardButton("⬅️ Ortga (Kurslar)", callback_data="reg:back:courses")],
-    ]
+def kb_courses(catalog: Catalog, lang: str) -> InlineKeyboardMarkup:
+    rows = kb_grid(list(catalog.course_labels[lang].items()), "reg:course:")
+    rows.append([InlineKeyboardButton(tr(lang, "btn_cancel"), callback_data="reg:cancel")])
     return InlineKeyboardMarkup(rows)
 
-def kb_sections(course_key: str) -> InlineKeyboardMarkup:
-    if course_key == "english":
-        sections = SECTIONS_ENGLISH
-        back = "reg:back:levels"
-    elif course_key == "german":
-        sections = SECTIONS_GERMAN
-        back = "reg:back:levels"
-    else:
-        sections = SECTIONS_OTHERS
-        back = "reg:back:courses"
+def kb_levels(catalog: Catalog, lang: str) -> InlineKeyboardMarkup:
+    rows = kb_grid(list(catalog.levels.items()), "reg:level:")
+    rows.append([InlineKeyboardButton(tr(lang, "btn_back_courses"), callback_data="reg:back:courses")])
+    return InlineKeyboardMarkup(rows)
 
-    rows: List[List[InlineKeyboardButton]] = []
-    items = list(sections.items())
-    for i in range(0, len(items), 2):
-        row = []
-        for key, label in items[i : i + 2]:
-            row.append(InlineKeyboardButton(label, callback_data=f"reg:section:{key}"))
-        rows.append(row)
-    rows.append([InlineKeyboardButton("⬅️ Ortga", callback_data=back)])
-    rows.append([InlineKeyboardButton("❌ Bekor qilish", callback_data="reg:cancel")])
+def kb_sections(catalog: Catalog, lang: str, course_key: str) -> InlineKeyboardMarkup:
+    back = "reg:back:levels" if course_key in catalog.courses_with_level else "reg:back:courses"
+    rows = kb_grid(list(catalog.sections[course_key].items()), "reg:section:")
+    rows.append([InlineKeyboardButton(tr(lang, "btn_back"), callback_data=back)])
+    rows.append([InlineKeyboardButton(tr(lang, "btn_cancel"), callback_data="reg:cancel")])
     return InlineKeyboardMarkup(rows)
 
-def kb_review() -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def kb_review(lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
             [
-                InlineKeyboardButton("✅ Tasdiqlash", callback_data="reg:confirm"),
-                InlineKeyboardButton("✏️ O‘zgartirish", callback_data="reg:edit"),
+                InlineKeyboardButton(tr(lang, "btn_confirm"), callback_data="reg:confirm"),
+                InlineKeyboardButton(tr(lang, "btn_edit"), callback_data="reg:edit"),
             ],
-            [InlineKeyboardButton("❌ Bekor qilish", callback_data="reg:cancel")],
+            [InlineKeyboardButton(tr(lang, "btn_cancel"), callback_data="reg:cancel")],
         ]
     )
 
-def kb_edit_menu(course_key: str) -> InlineKeyboardMarkup:
+def kb_edit_menu(catalog: Catalog, lang: str, course_key: str) -> InlineKeyboardMarkup:
     row1 = [
-        InlineKeyboardButton("📚 Kurs", callback_data="reg:edit:course"),
-        InlineKeyboardButton("🗂 Bo‘lim", callback_data="reg:edit:section"),
+        InlineKeyboardButton(tr(lang, "btn_edit_course"), callback_data="reg:edit:course"),
+        InlineKeyboardButton(tr(lang, "btn_edit_section"), callback_data="reg:edit:section"),
     ]
     row2 = [
-        InlineKeyboardButton("👤 Ism familiya", callback_data="reg:edit:name"),
-        InlineKeyboardButton("🎂 Yosh", callback_data="reg:edit:age"),
+        InlineKeyboardButton(tr(lang, "btn_edit_name"), callback_data="reg:edit:name"),
+        InlineKeyboardButton(tr(lang, "btn_edit_age"), callback_data="reg:edit:age"),
     ]
-    row3 = [InlineKeyboardButton("📱 Telefon", callback_data="reg:edit:phone")]
+    row3 = [InlineKeyboardButton(tr(lang, "btn_edit_phone"), callback_data="reg:edit:phone")]
     rows = [row1, row2, row3]
-    if course_key in COURSES_WITH_LEVEL:
-        rows.insert(1, [InlineKeyboardButton("📊 Daraja", callback_data="reg:edit:level")])
-    rows.append([InlineKeyboardButton("⬅️ Ortga (Ko‘rib chiqish)", callback_data="reg:back:review")])
+    if course_key in catalog.courses_with_level:
+        rows.insert(1, [InlineKeyboardButton(tr(lang, "btn_edit_level"), callback_data="reg:edit:level")])
+    rows.append([InlineKeyboardButton(tr(lang, "btn_back_review"), callback_data="reg:back:review")])
     return InlineKeyboardMarkup(rows)
 
-# ----------------------- Validation -----------------------
-def valid_full_name(s: str) -> bool:
-    s = s.strip()
-    parts = s.split()
-    if not (2 <= len(parts) <= 5):
-        return False
-    for p in parts:
-        letters = [ch for ch in p if ch.isalpha()]
-        if len(letters) < 2:
-            return False
-    return True
+@lru_cache(maxsize=None)
+def kb_share_phone(lang: str) -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(
+        [[KeyboardButton(tr(lang, "btn_share_phone"), request_contact=True)]],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    )
 
-def valid_age(s: str) -> bool:
-    if not s.isdigit():
-        return False
+# ----------------------- Validation -----------------------
+# Each check scans the input with C-level primitives (one compiled regex, str.isdigit, str.replace)
+# and returns (normalized value, None) or (None, reason); reasons map to the "err_<reason>" locale keys.
+Check = Tuple[Any, Optional[str]]
+
+# Any Unicode letter (Jürgen, Әлихан, Gʻayrat); ʻ and ʼ are modifier letters, so they are taken out and
+# treated as apostrophes.
+_NAME_LETTER = r"[^\W\d_ʻʼ]"
+_NAME_APOSTROPHE = "['ʻʼ’‘`]"  # oʻ/gʻ and tutuq belgisi as people actually type them
+# At least two letters; apostrophes and hyphens only between letters (Gʻayrat, Sa'dulla, Abdul-Aziz).
+_NAME_WORD = f"{_NAME_LETTER}{_NAME_APOSTROPHE}?{_NAME_LETTER}+(?:(?:{_NAME_APOSTROPHE}|-){_NAME_LETTER}+)*"
+NAME_REGEX = re.compile(rf"{_NAME_WORD}(?:\s+{_NAME_WORD}){{1,4}}")
+NAME_MAX_LENGTH = 100  # keeps a registration's admin notice well inside one Telegram message
+
+def check_full_name(text: str) -> Check:
+    s = text.strip()
+    if len(s) > NAME_MAX_LENGTH:
+        return None, "name_length"
+    if not s.isascii() and not unicodedata.is_normalized("NFC", s):
+        s = unicodedata.normalize("NFC", s)  # u + combining diaeresis -> ü, which \w matches
+    if NAME_REGEX.fullmatch(s):
+        return (s if "  " not in s and s.isprintable() else " ".join(s.split())), None
+    # Slow path only to explain the rejection.
+    return None, "name_words" if not 2 <= len(s.split()) <= 5 else "name_chars"
+
+def check_age(text: str) -> Check:
+    s = text.strip()
+    if not (s.isascii() and s.isdigit()) or len(s) > 3:
+        return None, "age_format"
     n = int(s)
-    return 3 <= n <= 100
-
-PHONE_REGEX = re.compile(r"^\+998\d{9}$")
+    return (n, None) if 3 <= n <= 100 else (None, "age_range")
 
-def normalize_phone(text: str) -> Optional[str]:
+def check_phone(text: str) -> Check:
+    """Accepts +998 XX XXX-XX-XX, 998XXXXXXXXX, a local 9-digit number or the old 8-XX-... form."""
     t = text.strip()
-    if t.startswith("+"):
-        t = "+" + re.sub(r"[^\d]", "", t[1:])
-    else:
-        t = re.sub(r"[^\d]", "", t)
-    if t.startswith("998") and len(t) == 12:
-        t = "+" + t
-    if PHONE_REGEX.match(t):
-        return t
-    return None
+    plus = t.startswith("+")
+    digits = t[1:] if plus else t
+    if not digits.isdigit():
+        digits = digits.replace(" ", "").replace("-", "").replace("(", "").replace(")", "").replace(".", "")
+    if not (digits.isascii() and digits.isdigit()):
+        return None, "phone_chars"
+    n = len(digits)
+    if n == 12 and digits.startswith("998"):
+        return "+" + digits, None
+    if plus:
+        return None, "phone_country" if not digits.startswith("998") else "phone_length"
+    if n == 9:
+        return "+998" + digits, None
+    if n == 10 and digits.startswith("8"):
+        return "+998" + digits[1:], None
+    return None, "phone_length"
 
 # ----------------------- Content builders (HTML escaped) -----------------------
 def esc(s: Any) -> str:
     return html.escape("" if s is None else str(s))
 
-def build_review_text(d: Dict[str, Any]) -> str:
-    course_label = esc(COURSES.get(d.get("course_key", ""), d.get("course_label", "")))
-    level_label = esc(d.get("level_label", "") or "")
-    section_label = esc(d.get("section_label", ""))
-    full_name = esc(d.get("full_name", ""))
-    age = esc(d.get("age", ""))
-    phone = esc(d.get("phone", ""))
-
-    lines = [
-        "🧾 <b>Ma’lumotlarni ko‘rib chiqing:</b>",
-        f"• 📚 <b>Kurs:</b> {course_label}",
-    ]
-    if d.get("course_key") in COURSES_WITH_LEVEL and level_label:
-        lines.append(f"• 📊 <b>Daraja:</b> {level_label}")
-    lines += [
-        f"• 🗂 <b>Bo‘lim:</b> {section_label}",
-        f"• 👤 <b>Ism familiya:</b> {full_name}",
-        f"• 🎂 <b>Yosh:</b> {age}",
-        f"• 📱 <b>Telefon:</b> {phone}",
-    ]
-    return "\n".join(lines)
-
-def build_admin_text(d: Dict[str, Any], u) -> str:
-    course_label = esc(COURSES.get(d.get("course_key", ""), d.get("course_label", "")))
-    level_label = esc(d.get("level_label", "") or "")
-    section_label = esc(d.get("section_label", ""))
-    full_name = esc(d.get("full_name", ""))
-    age = esc(d.get("age", ""))
-    phone = esc(d.get("phone", ""))
+def labels_html(d: Dict[str, Any], catalog: Catalog, lang: str) -> Tuple[str, str, str]:
+    """(course, section, level) for a session, HTML-safe; level is "" for courses without levels.
+
+    Labels come pre-escaped from the catalog; the label stored in the session is the fallback for
+    keys a catalog reload removed.
+    """
+    course_key = d.get("course_key", "")
+    course = catalog.course_html[lang].get(course_key) or esc(d.get("course_label", ""))
+    section = catalog.section_html.get(course_key, {}).get(d.get("section_key")) or esc(d.get("section_label", ""))
+    level = ""
+    if course_key in catalog.courses_with_level and d.get("level_label"):
+        level = catalog.level_html.get(d.get("level_key")) or esc(d["level_label"])
+    return course, section, level
+
+# age and phone only ever hold check_age/check_phone output, so the name is the only field escaped.
+def build_review_text(d: Dict[str, Any], catalog: Catalog, lang: str) -> str:
+    course, section, level = labels_html(d, catalog, lang)
+    return tr(
+        lang,
+        "review",
+        course=course,
+        level_line=tr(lang, "review_level", level=level) if level else "",
+        section=section,
+        name=esc(d.get("full_name", "")),
+        age=str(d.get("age", "")),
+        phone=d.get("phone", ""),
+    )
 
-    username = esc(f"@{u.username}") if getattr(u, "username", None) else esc("@None")
+def build_admin_text(d: Dict[str, Any], u, catalog: Catalog) -> str:
+    lang = DEFAULT_LANGUAGE
+    course, section, level = labels_html(d, catalog, lang)
+    tz = tashkent_tz()
     tnow = (
-        datetime.now(TASHKENT_TZ).strftime("%Y-%m-%d %H:%M:%S")
-        if TASHKENT_TZ
+        datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S")
+        if tz
         else datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
     )
+    return tr(
+        lang,
+        "admin_new",
+        name=esc(d.get("full_name", "")),
+        age=str(d.get("age", "")),
+        phone=d.get("phone", ""),
+        course=course,
+        section=section,
+        level_line=tr(lang, "admin_level", level=level) if level else "",
+        user_id=str(getattr(u, "id", "")),
+        username=f"@{u.username}" if getattr(u, "username", None) else "@None",  # [A-Za-z0-9_] only
+        date=tnow,
+    )
 
-    lines = [
-        "🔔 <b>Yangi o‘quvchi ro‘yxatdan o‘tdi</b>",
-        f"👤 <b>Ism:</b> {full_name}",
-        f"🎂 <b>Yosh:</b> {age}",
-        f"📱 <b>Telefon:</b> {phone}",
-        f"📚 <b>Kurs:</b> {course_label}",
-        f"🗂 <b>Bo‘lim:</b> {section_label}",
-    ]
-    if d.get("course_key") in COURSES_WITH_LEVEL and level_label:
-        lines.append(f"📊 <b>Daraja:</b> {level_label}")
+# ----------------------- Metrics -----------------------
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    "iteach_handler_seconds": ("histogram", "Handler latency by route."),
+    "iteach_handler_errors_total": ("counter", "Handler exceptions by route."),
+    "iteach_telegram_api_seconds": ("histogram", "Bot API call latency by method."),
+    "iteach_telegram_api_errors_total": ("counter", "Failed Bot API calls by method and status."),
+    "iteach_funnel_step_total": ("counter", "Users entering each registration step."),
+    "iteach_throttled_updates_total": ("counter", "Updates dropped by the per-user flood guard."),
+    "iteach_update_wait_seconds": ("histogram", "Time updates waited behind the same user's earlier updates."),
+    "iteach_notify_seconds": ("histogram", "Admin notification delivery latency by sink."),
+    "iteach_notify_sent_total": ("counter", "Admin notifications delivered, by sink."),
+    "iteach_notify_failures_total": ("counter", "Failed notification deliveries (retried later), by sink."),
+    "iteach_notify_dropped_total": ("counter", "Admin notifications given up on, by sink and reason."),
+}
 
-    lines += [
-        f"🆔 <b>Telegram ID:</b> {esc(getattr(u, 'id', ''))}",
-        f"👤 <b>Username:</b> {username}",
-        f"📅 <b>Sana:</b> {tnow} (Asia/Tashkent)",
-    ]
+class Metrics:
+    """Labelled counters and fixed-bucket histograms rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        # (name, labels) -> per-bucket counts (+Inf last), then sum and count
+        self.histograms: Dict[Tuple[str, Tuple], List[float]] = {}
+
+    def inc(self, name: str, labels: Tuple = (), value: float = 1) -> None:
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, labels: Tuple = ()) -> None:
+        h = self.histograms.get((name, labels))
+        if h is None:
+            h = self.histograms[(name, labels)] = [0] * (len(LATENCY_BUCKETS) + 3)
+        h[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+    @staticmethod
+    def _labels(labels: Tuple, extra: str = "") -> str:
+        parts = [f'{k}="{v}"' for k, v in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        lines: List[str] = []
+        seen = set()
+
+        def header(name: str) -> None:
+            if name not in seen and name in METRIC_HELP:
+                seen.add(name)
+                kind, text = METRIC_HELP[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            header(name)
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), h in sorted(self.histograms.items()):
+            header(name)
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), h):
+                cumulative += n
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{self._labels(labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {h[-2]}")
+            lines.append(f"{name}_count{self._labels(labels)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def route_label(update: Update, name: str) -> str:
+    # Callbacks are labelled by the matched route key, never by raw callback data (unbounded).
+    if update.callback_query and name == "callback":
+        cb = parse_callback(update.callback_query.data or "")
+        if cb is None:
+            return "callback:unknown"
+        if cb.key in CALLBACK_ROUTES:
+            return f"callback:{cb.key}"
+        return f"callback:{cb.action}" if cb.action in CALLBACK_ROUTES else "callback:unknown"
+    return name
+
+def instrumented(name: str, fn):
+    """Wraps a handler callback to record latency, errors and funnel step changes."""
+
+    @functools.wraps(fn)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        labels = (("route", route_label(update, name)),)
+        user_data = context.user_data
+        step = user_data.get("step") if user_data is not None else None
+        t0 = time.perf_counter()
+        try:
+            return await fn(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            metrics.inc("iteach_handler_errors_total", labels)
+            raise
+        finally:
+            metrics.observe("iteach_handler_seconds", time.perf_counter() - t0, labels)
+            new_step = user_data.get("step") if user_data is not None else None
+            if new_step and new_step != step:
+                metrics.inc("iteach_funnel_step_total", (("step", new_step),))
+
+    return wrapper
+
+class InstrumentedRequest(BaseRequest):
+    """Delegates to another BaseRequest and records per-method Bot API latency and failures."""
+
+    def __init__(self, inner: BaseRequest):
+        self.inner = inner
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.inner.read_timeout
+
+    async def initialize(self) -> None:
+        await self.inner.initialize()
+
+    async def shutdown(self) -> None:
+        await self.inner.shutdown()
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        labels = (("method", url.rsplit("/", 1)[-1]),)
+        t0 = time.perf_counter()
+        try:
+            code, payload = await self.inner.do_request(
+                url,
+                method,
+                request_data=request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout,
+            )
+        except Exception:
+            metrics.inc("iteach_telegram_api_errors_total", labels + (("code", "network"),))
+            raise
+        finally:
+            metrics.observe("iteach_telegram_api_seconds", time.perf_counter() - t0, labels)
+        if code >= 400:
+            metrics.inc("iteach_telegram_api_errors_total", labels + (("code", str(code)),))
+        return code, payload
+
+async def serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        if request_line.split()[1:2] == [b"/metrics"]:
+            status, body = "200 OK", metrics.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+# ----------------------- Flood control -----------------------
+class UserRateLimiter:
+    """Token bucket per user id. Buckets are kept in last-seen order so idle ones are evicted in O(1)."""
+
+    def __init__(self, rate: float, burst: float, idle_ttl: float):
+        self.rate = rate
+        self.burst = burst
+        self.idle_ttl = idle_ttl
+        self._buckets: "OrderedDict[int, Tuple[float, float]]" = OrderedDict()  # user_id -> (tokens, last seen)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, user_id: int) -> bool:
+        now = time.monotonic()
+        bucket = self._buckets.pop(user_id, None)
+        tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[user_id] = (tokens, now)
+
+        while self._buckets:
+            oldest, (_, seen) = next(iter(self._buckets.items()))
+            if now - seen < self.idle_ttl:
+                break
+            del self._buckets[oldest]
+        return allowed
+
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user is None:
+        return
+    if context.bot_data["user_limiter"].allow(user.id):
+        context.user_data.touch()
+        return
+    logger.debug("Throttled update from %s", user.id)
+    metrics.inc("iteach_throttled_updates_total")
+    if update.callback_query:
+        # Stop the button spinner; the tap itself is ignored.
+        await update.callback_query.answer(tr(user_language(user), "throttled"))
+    raise ApplicationHandlerStop
+
+# ----------------------- Update ordering -----------------------
+def update_owner(update: object) -> Optional[int]:
+    # Same key as WorkerPool.route, so a user's updates are serialized in whichever process owns them.
+    if not isinstance(update, Update):
+        return None
+    user = update.effective_user
+    chat = update.effective_chat
+    return user.id if user else chat.id if chat else None
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes different users' updates concurrently and each user's updates one at a time, in order.
+
+    PTB starts every update as its own task, in queue order. Each user's updates line up in a FIFO of
+    their own, and only the one at its head competes for one of the ``max_concurrent_updates`` slots,
+    so a user with a backlog holds at most one slot and cannot starve everyone else. A FIFO exists only
+    while one of its user's updates is running or waiting, so idle users cost nothing.
+
+    For shutdown, hold() stops updates from starting: each one that would start is set aside in ``held``
+    instead, to be spilled. cancel_running() then cancels the handlers still running and records their
+    updates in ``cancelled``. Either way the task returns normally, so PTB still marks the update done.
+    """
+
+    __slots__ = ("_slots", "_queues", "_running", "_holding", "held", "cancelled")
+
+    def __init__(self, max_concurrent_updates: int):
+        # The base class takes one of its slots before do_process_update() is even called, which would
+        # let a user's queued updates hold slots while they wait. Its limit is lifted, and the real one
+        # applied after the per-user FIFO instead.
+        super().__init__(sys.maxsize)
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates must be a positive integer")
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._queues: Dict[int, Deque[asyncio.Future]] = {}  # owner -> updates waiting behind the running one
+        self._running: Dict[asyncio.Task, object] = {}
+        self._holding = False
+        self.held: List[object] = []
+        self.cancelled: List[object] = []
+
+    def __len__(self) -> int:
+        return len(self._queues)
+
+    def hold(self) -> None:
+        """Sets aside every update that has not started yet, now or later, instead of handling it."""
+        self._holding = True
+
+    def cancel_running(self) -> int:
+        """Cancels the handlers still running; returns how many there were."""
+        for task in self._running:
+            task.cancel()
+        return len(self._running)
+
+    async def _wait_turn(self, owner: int) -> None:
+        waiting = self._queues.get(owner)
+        if waiting is None:
+            self._queues[owner] = deque()
+            return
+        turn = asyncio.get_running_loop().create_future()
+        waiting.append(turn)
+        t0 = time.perf_counter()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            if turn.done() and not turn.cancelled():
+                self._pass_turn(owner)  # cancelled just after being handed the turn
+            raise
+        metrics.observe("iteach_update_wait_seconds", time.perf_counter() - t0)
+
+    def _pass_turn(self, owner: int) -> None:
+        waiting = self._queues[owner]
+        while waiting:
+            turn = waiting.popleft()
+            if not turn.done():  # skips waiters that were cancelled
+                turn.set_result(None)
+                return
+        del self._queues[owner]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        owner = update_owner(update)
+        if owner is not None:
+            try:
+                await self._wait_turn(owner)
+            except asyncio.CancelledError:
+                coroutine.close()
+                raise
+        try:
+            if not self._holding:
+                await self._slots.acquire()
+                try:
+                    if not self._holding:
+                        await self._run(update, coroutine)
+                        return
+                finally:
+                    self._slots.release()
+            self.held.append(update)
+            coroutine.close()
+        finally:
+            if owner is not None:
+                self._pass_turn(owner)
+
+    async def _run(self, update: object, coroutine: Awaitable[Any]) -> None:
+        task = asyncio.current_task()
+        self._running[task] = update
+        try:
+            await coroutine
+        except asyncio.CancelledError:
+            if not self._holding:
+                raise
+            self.cancelled.append(update)  # by cancel_running(); swallowed so the update is marked done
+        finally:
+            del self._running[task]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+# ----------------------- Sessions -----------------------
+class Session:
+    """Per-user registration state (``context.user_data``) with a fixed set of slots.
+
+    Implements the small dict-like surface the handlers use (get/pop/setdefault/clear/[]),
+    at a fraction of a dict's size. ``last_seen``/``reminded`` are bookkeeping for the reaper.
+    """
+
+    FIELDS = (
+        "step", "lang", "catalog_version", "course_key", "course_label", "level_key", "level_label",
+        "section_key", "section_label", "full_name", "age", "phone", "edit_field",
+        "prompt_id", "prompt_key", "reply_keyboard",
+    )
+    __slots__ = FIELDS + ("last_seen", "reminded")
+
+    def __init__(self):
+        for name in self.FIELDS:
+            setattr(self, name, None)
+        self.last_seen = time.time()
+        self.reminded = False
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None) if key in self.FIELDS else None
+        return default if value is None else value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return sum(1 for name in self.FIELDS if getattr(self, name) is not None)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        value = self.get(key, default)
+        if key in self.FIELDS:
+            setattr(self, key, None)
+        return value
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if self.get(key) is None:
+            self[key] = default
+        return self.get(key)
+
+    def clear(self) -> None:
+        for name in self.FIELDS:
+            setattr(self, name, None)
+        self.reminded = False
+
+    def touch(self) -> None:
+        self.last_seen = time.time()
+        self.reminded = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {name: getattr(self, name) for name in self.FIELDS if getattr(self, name) is not None}
+        d["last_seen"] = self.last_seen
+        return d
+
+    def load(self, d: Dict[str, Any]) -> None:
+        """Replaces the state with ``d`` (a to_dict() result)."""
+        self.clear()
+        for key, value in d.items():
+            if key in self.FIELDS:
+                setattr(self, key, value)
+        self.last_seen = d.get("last_seen", self.last_seen)
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Session":
+        session = cls()
+        session.load(d)
+        return session
+
+async def reap_sessions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """JobQueue callback: reminds, then drops, idle sessions and enforces SESSION_MAX."""
+    app = context.application
+    now = time.time()
+    expired: List[int] = []
+    remind: List[int] = []
+    for user_id, session in app.user_data.items():
+        idle = now - session.last_seen
+        if idle > SESSION_TTL:
+            expired.append(user_id)
+        elif SESSION_REMIND_AFTER and idle > SESSION_REMIND_AFTER and not session.reminded and session.step:
+            session.reminded = True
+            remind.append(user_id)
+    for user_id in expired:
+        app.drop_user_data(user_id)
+
+    excess = len(app.user_data) - SESSION_MAX
+    if excess > 0:
+        oldest = heapq.nsmallest(excess, app.user_data.items(), key=lambda item: item[1].last_seen)
+        for user_id, _ in oldest:
+            app.drop_user_data(user_id)
+    if expired or excess > 0:
+        logger.info("Reaper: dropped %d idle sessions, %d over cap", len(expired), max(excess, 0))
+
+    for user_id in remind:
+        session = app.user_data.get(user_id)
+        if session is None:
+            continue  # evicted by the cap above
+        try:
+            await context.bot.send_message(
+                chat_id=user_id, text=tr(session.get("lang", DEFAULT_LANGUAGE), "reminder")
+            )
+        except TelegramError as e:
+            logger.debug("Reminder to %s failed: %s", user_id, e)
+
+# ----------------------- Persistence (SQLite) -----------------------
+class SQLiteUserDataPersistence(BasePersistence):
+    """Stores ``context.user_data`` sessions in hash-sharded SQLite (WAL) files keyed by user id.
+
+    Only user data is persisted. PTB keeps the live dicts in memory and hands changed ones
+    over every ``update_interval`` seconds; each batch is committed in one transaction per shard.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        shards: int = 4,
+        ttl: int = 0,
+        update_interval: float = 10,
+        owns: Optional[Callable[[int], bool]] = None,
+        lazy: bool = False,
+    ):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        # In a worker pool each worker only loads the sessions of the users routed to it.
+        self.owns = owns
+        # Lazy: nothing is loaded up front; each update re-reads its user's row (refresh_user_data).
+        # For short-lived processes that handle one update and may share the files with others.
+        self.lazy = lazy
+        self._shards: List[sqlite3.Connection] = []
+        for i in range(max(1, shards)):
+            conn = sqlite3.connect(os.path.join(directory, f"state-{i}.sqlite3"))
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_data ("
+                "user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._shards.append(conn)
+        self._pending: Dict[int, Optional[str]] = {}
+        self._commit_scheduled = False
+
+    def _shard(self, user_id: int) -> sqlite3.Connection:
+        return self._shards[user_id % len(self._shards)]
+
+    def _schedule_commit(self) -> None:
+        # PTB gathers all update_user_data calls of one flush; commit once after they have all run.
+        if not self._commit_scheduled:
+            self._commit_scheduled = True
+            asyncio.get_running_loop().call_soon(self._commit)
+
+    def _commit(self) -> None:
+        self._commit_scheduled = False
+        pending, self._pending = self._pending, {}
+        now = time.time()
+        by_shard: Dict[int, List] = {}
+        for user_id, data in pending.items():
+            by_shard.setdefault(user_id % len(self._shards), []).append((user_id, data))
+        for idx, rows in by_shard.items():
+            conn = self._shards[idx]
+            with conn:
+                conn.executemany(
+                    "DELETE FROM user_data WHERE user_id = ?", [(u,) for u, d in rows if d is None]
+                )
+                conn.executemany(
+                    "INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    [(u, d, now) for u, d in rows if d is not None],
+                )
+
+    async def get_user_data(self) -> Dict[int, Session]:
+        result: Dict[int, Session] = {}
+        if self.lazy:
+            return result
+        cutoff = time.time() - self.ttl if self.ttl else 0
+        for conn in self._shards:
+            with conn:
+                if cutoff:
+                    conn.execute("DELETE FROM user_data WHERE updated_at < ?", (cutoff,))
+                for user_id, data in conn.execute("SELECT user_id, data FROM user_data"):
+                    if self.owns is None or self.owns(user_id):
+                        result[user_id] = Session.from_dict(json.loads(data))
+        logger.info("Restored %d registration sessions", len(result))
+        return result
+
+    async def update_user_data(self, user_id: int, data: Session) -> None:
+        self._pending[user_id] = json.dumps(data.to_dict(), ensure_ascii=False) if data else None
+        self._schedule_commit()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending[user_id] = None
+        self._schedule_commit()
+
+    async def refresh_user_data(self, user_id: int, user_data: Session) -> None:
+        if not self.lazy:
+            return
+        cutoff = time.time() - self.ttl if self.ttl else 0
+        row = self._shard(user_id).execute(
+            "SELECT data FROM user_data WHERE user_id = ? AND updated_at >= ?", (user_id, cutoff)
+        ).fetchone()
+        user_data.load(json.loads(row[0]) if row else {})
+
+    def commit(self) -> None:
+        """Writes what update_user_data() has queued now instead of on the next loop iteration."""
+        self._commit()
+
+    async def flush(self) -> None:
+        self._commit()
+        for conn in self._shards:
+            conn.close()
+
+    # Chat/bot/callback data and conversations are not stored.
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[str, Any]:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+# ----------------------- Admin notifications -----------------------
+class CircuitBreaker:
+    """Stops calling a failing sink: ``threshold`` consecutive failures open the circuit for
+    ``cooldown`` seconds, after which one trial call either closes it or opens it again."""
+
+    __slots__ = ("threshold", "cooldown", "failures", "opened_at")
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def wait(self) -> float:
+        """Seconds until the next call is allowed (0 when closed or due for a trial call)."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self) -> bool:
+        """Records a failed call; True when that (re)opened the circuit."""
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+class Sink:
+    """A destination for admin notifications. ``deliver`` sends a batch or raises; queueing,
+    retries and the circuit breaker are the job of the Outbox in front of each sink.
+
+    A notification is ``{"text": admin HTML, "record": registration fields}``.
+    """
+
+    kind = ""
+    batch_max = 1  # notifications per deliver() call
+    interval = 0.0  # min seconds between deliveries
+
+    def __init__(self, target: str, courses: Tuple[str, ...] = ()):
+        self.target = target
+        self.courses = courses  # course keys this sink is limited to; empty = all
+
+    @property
+    def spec(self) -> str:
+        return f"{self.kind}:{self.target}" + "".join(f"#{c}" for c in self.courses)
+
+    @property
+    def name(self) -> str:
+        """Label for logs and metrics."""
+        return self.spec
+
+    def accepts(self, note: Dict[str, Any]) -> bool:
+        return not self.courses or note.get("record", {}).get("course_key") in self.courses
+
+    def batch_size(self, notes: List[Dict[str, Any]]) -> int:
+        return min(len(notes), self.batch_max)
+
+    def start(self, bot) -> None:
+        pass
+
+    async def deliver(self, notes: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    def retry_after(self, exc: Exception) -> Optional[float]:
+        """Seconds to wait when ``exc`` is rate limiting (not counted as a failure), else None."""
+        return None
+
+    def permanent(self, exc: Exception) -> bool:
+        """True when retrying cannot help; a rejected batch is retried a note at a time, a rejected note dropped."""
+        return False
+
+    async def close(self) -> None:
+        pass
+
+class TelegramSink(Sink):
+    """An admin chat or group; notifications backed up for it are merged into one digest message."""
+
+    kind = "telegram"
+    batch_max = OUTBOX_DIGEST_MAX
+    interval = OUTBOX_CHAT_INTERVAL
+
+    def __init__(self, target: str, courses: Tuple[str, ...] = ()):
+        super().__init__(target, courses)
+        self.chat_id: Any = int(target) if target.lstrip("-").isdigit() else target  # id or @channel
+        self.bot = None
+
+    def start(self, bot) -> None:
+        self.bot = bot
+
+    def batch_size(self, notes: List[Dict[str, Any]]) -> int:
+        count, size = 1, len(notes[0]["text"])
+        for note in notes[1:self.batch_max]:
+            size += len(note["text"]) + 2
+            if size > MessageLimit.MAX_TEXT_LENGTH - 100:
+                break
+            count += 1
+        return count
+
+    async def deliver(self, notes: List[Dict[str, Any]]) -> None:
+        text = notes[0]["text"]
+        if len(notes) > 1:
+            header = tr(DEFAULT_LANGUAGE, "admin_digest", count=str(len(notes)))
+            text = header + "\n\n" + "\n\n".join(n["text"] for n in notes)
+        await self.bot.send_message(chat_id=self.chat_id, text=text, parse_mode=ParseMode.HTML)
+
+    def retry_after(self, exc: Exception) -> Optional[float]:
+        return float(exc.retry_after) if isinstance(exc, RetryAfter) else None
+
+    def permanent(self, exc: Exception) -> bool:
+        return isinstance(exc, BadRequest)
+
+class WebhookSink(Sink):
+    """POSTs each registration as a JSON object. With NOTIFY_WEBHOOK_SECRET set the body is signed:
+    ``X-ITeach-Signature`` is its hex HMAC-SHA256."""
+
+    kind = "webhook"
+
+    def __init__(self, target: str, courses: Tuple[str, ...] = ()):
+        super().__init__(target, courses)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def name(self) -> str:
+        # Credentials and query strings stay out of logs and metric labels.
+        parts = urlsplit(self.target)
+        host = parts.netloc.rpartition("@")[2]
+        return f"{self.kind}:{parts.scheme}://{host}{parts.path}" + "".join(f"#{c}" for c in self.courses)
+
+    async def deliver(self, notes: List[Dict[str, Any]]) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=NOTIFY_WEBHOOK_TIMEOUT)
+        body = json.dumps(notes[0]["record"], ensure_ascii=False).encode()
+        headers = {"Content-Type": "application/json"}
+        if NOTIFY_WEBHOOK_SECRET:
+            headers["X-ITeach-Signature"] = hmac.new(NOTIFY_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        response = await self._client.post(self.target, content=body, headers=headers)
+        if response.is_error:
+            raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=response.request, response=response)
+
+    def retry_after(self, exc: Exception) -> Optional[float]:
+        if isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 429:
+            try:
+                return float(exc.response.headers.get("Retry-After", "1"))
+            except ValueError:
+                return 1.0
+        return None
+
+    def permanent(self, exc: Exception) -> bool:
+        if not isinstance(exc, httpx.HTTPStatusError):
+            return False
+        status = exc.response.status_code
+        return 400 <= status < 500 and status not in (408, 429)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class FileSink(Sink):
+    """Appends each registration as a JSON line; relative paths are under DATA_DIR."""
+
+    kind = "file"
+    batch_max = 100
+
+    def __init__(self, target: str, courses: Tuple[str, ...] = ()):
+        super().__init__(target, courses)
+        self.path = target if os.path.isabs(target) else os.path.join(DATA_DIR, target)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    async def deliver(self, notes: List[Dict[str, Any]]) -> None:
+        # One write per batch, so worker processes sharing the file do not interleave lines.
+        lines = "".join(json.dumps(n["record"], ensure_ascii=False) + "\n" for n in notes)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+SINK_TYPES = {"telegram": TelegramSink, "webhook": WebhookSink, "file": FileSink}
+
+def parse_sinks(spec: str) -> List[Sink]:
+    """Sinks for a NOTIFY_SINKS value: ``kind:target[#course_key...]`` entries, comma separated."""
+    sinks: List[Sink] = []
+    for entry in spec.replace(",", " ").split():
+        kind, _, rest = entry.partition(":")
+        target, *courses = rest.split("#")
+        if kind not in SINK_TYPES or not target:
+            raise ValueError(
+                f"NOTIFY_SINKS: bad entry {entry!r} (expected telegram:<chat>, webhook:<url> or file:<path>)"
+            )
+        sinks.append(SINK_TYPES[kind](target, tuple(c for c in courses if c)))
+    if not sinks:
+        raise ValueError("NOTIFY_SINKS: no sinks configured")
+    return sinks
+
+class Outbox:
+    """Append-only JSONL queue of notifications for one sink, drained by a background dispatcher.
+
+    ``<path>.offset`` records how far the file has been delivered, so pending notifications survive
+    restarts. At most ``max_pending`` are kept; beyond that the oldest is dropped. Transient failures
+    are retried with exponential backoff until the circuit breaker opens; rejected batches are dropped.
+    """
+
+    def __init__(self, path: str, sink: Sink, max_pending: int = OUTBOX_MAX_PENDING):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.sink = sink
+        self.max_pending = max(1, max_pending)
+        self.offset_path = path + ".offset"
+        self._offset = 0
+        if os.path.exists(self.offset_path):
+            with open(self.offset_path) as f:
+                self._offset = int(f.read().strip() or 0)
+        # (end offset in file, notification) for every undelivered entry
+        self._pending: Deque[Tuple[int, Dict[str, Any]]] = deque()
+        if os.path.exists(path):
+            if self._offset > os.path.getsize(path):
+                self._offset = 0  # a crash between compacting the log and saving the offset
+            with open(path, "rb") as f:
+                f.seek(self._offset)
+                pos = self._offset
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    pos += len(line)
+                    try:
+                        self._pending.append((pos, json.loads(line)))
+                    except ValueError:
+                        logger.error("Notifications to %s: skipping a corrupt entry in %s", sink.name, path)
+            if os.path.getsize(path) > pos:
+                # A torn write from a crash: cut it off, or the next append would extend it.
+                logger.warning("Notifications to %s: dropping a partly written entry in %s", sink.name, path)
+                os.truncate(path, pos)
+        self._file = open(path, "ab")
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()  # set while nothing is pending
+        if not self._pending:
+            self._idle.set()
+        self._task: Optional[asyncio.Task] = None
+        self._last_sent = 0.0
+        self._breaker = CircuitBreaker(OUTBOX_BREAKER_FAILURES, OUTBOX_BREAKER_COOLDOWN)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def append(self, note: Dict[str, Any]) -> None:
+        line = (json.dumps(note, ensure_ascii=False) + "\n").encode()
+        self._file.write(line)
+        self._file.flush()
+        self._pending.append((self._file.tell(), note))
+        if len(self._pending) > self.max_pending:
+            # The registration itself is still in the CSV log; this sink just misses the oldest one.
+            self._commit(self._pending[0][0])
+            metrics.inc("iteach_notify_dropped_total", (("sink", self.sink.name), ("reason", "overflow")))
+            logger.warning("Notifications to %s: queue full, dropped the oldest", self.sink.name)
+        self._idle.clear()
+        self._wakeup.set()
+
+    def start(self, bot) -> None:
+        self.sink.start(bot)
+        if self._pending:
+            logger.info("Notifications to %s: %d pending", self.sink.name, len(self._pending))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 0) -> None:
+        """Stops the dispatcher, first giving it up to ``timeout`` seconds to deliver what is queued.
+
+        Whatever is still pending after that stays on disk for the next start.
+        """
+        if self._task:
+            if timeout > 0 and self._pending and not self._breaker.is_open:
+                try:
+                    await asyncio.wait_for(self._idle.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if self._pending:
+                logger.warning("Notifications to %s: %d left for the next start", self.sink.name, len(self._pending))
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._file.close()
+        await self.sink.close()
+
+    async def drain(self, bot, timeout: float) -> None:
+        """Delivers what is queued with a dispatcher that lives only for this call (at most ``timeout`` s).
+
+        For runtimes that give the process no time between updates; the file stays open for reuse.
+        A sink whose circuit is open is not waited for.
+        """
+        if not self._pending or self._task or self._breaker.wait() > 0:
+            return
+        self.sink.start(bot)
+        task = asyncio.create_task(self._run(until_open=True))
+        idle = asyncio.create_task(self._idle.wait())
+        await asyncio.wait((task, idle), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if self._pending:
+            logger.warning("Notifications to %s: %d left for a later update", self.sink.name, len(self._pending))
+        for t in (task, idle):
+            t.cancel()
+            try:
+                await t
+            except asyncio.CancelledError:
+                pass
+
+    def _commit(self, end: int) -> None:
+        while self._pending and self._pending[0][0] <= end:
+            self._pending.popleft()
+        if not self._pending:
+            # Everything delivered: compact the log.
+            self._file.truncate(0)
+            self._file.seek(0)
+            end = 0
+            self._idle.set()
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(end))
+        os.replace(tmp, self.offset_path)
+
+    async def _run(self, until_open: bool = False) -> None:
+        sink = self.sink
+        labels = (("sink", sink.name),)
+        attempt = 0
+        singly = 0  # notes left to send one at a time after a batch of them was rejected
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            wait = max(self._breaker.wait(), self._last_sent + sink.interval - time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue  # more may have queued meanwhile; rebuild the batch
+            notes = [note for _, note in itertools.islice(self._pending, sink.batch_max)]
+            count = 1 if singly else sink.batch_size(notes)
+            end = self._pending[count - 1][0]
+            t0 = time.perf_counter()
+            try:
+                await sink.deliver(notes[:count])
+            except Exception as e:
+                delay = sink.retry_after(e)
+                if delay is not None:
+                    # Not a failure, so the breaker never opens: "Retry-After: 0" must not become a busy loop.
+                    await asyncio.sleep(max(delay, OUTBOX_RETRY_DELAY))
+                    continue
+                if not sink.permanent(e):
+                    attempt += 1
+                    metrics.inc("iteach_notify_failures_total", labels)
+                    if self._breaker.failure():
+                        logger.warning(
+                            "Notifications to %s: %d failures (%s), pausing for %gs",
+                            sink.name, self._breaker.failures, e, self._breaker.cooldown,
+                        )
+                        if until_open:
+                            return
+                        continue
+                    delay = min(OUTBOX_MAX_BACKOFF, OUTBOX_RETRY_DELAY * 2 ** (attempt - 1))
+                    logger.warning("Notifications to %s: delivery failed (%s), retrying in %gs", sink.name, e, delay)
+                    await asyncio.sleep(delay)
+                    continue
+                if count > 1:
+                    # One bad note must not take the rest of its batch down with it.
+                    logger.warning(
+                        "Notifications to %s: batch of %d rejected (%s), sending singly", sink.name, count, e
+                    )
+                    singly = count
+                    continue
+                logger.error("Notifications to %s: dropping %d undeliverable: %s", sink.name, count, e)
+                metrics.inc("iteach_notify_dropped_total", labels + (("reason", "rejected"),), count)
+            else:
+                metrics.observe("iteach_notify_seconds", time.perf_counter() - t0, labels)
+                metrics.inc("iteach_notify_sent_total", labels, count)
+            if self._breaker.is_open:
+                logger.info("Notifications to %s: delivering again", sink.name)
+            attempt = 0
+            singly = max(0, singly - 1)
+            self._breaker.success()
+            self._last_sent = time.monotonic()
+            self._commit(end)
+
+class NotificationRouter:
+    """Fans each admin notification out to every sink that accepts it, through one Outbox per sink.
+
+    Outboxes deliver independently, so a slow or failing sink only backs up its own queue; publish()
+    only appends to local files and never waits on a sink. Each of ``workers`` processes has its own
+    outboxes, so each spaces its deliveries ``workers`` times further apart to keep the total per sink.
+    """
+
+    def __init__(self, directory: str, sinks: List[Sink], suffix: str = "", legacy: str = "", workers: int = 1):
+        self.outboxes: List[Outbox] = []
+        for sink in sinks:
+            sink.interval *= workers
+            key = hashlib.sha1(sink.spec.encode()).hexdigest()[:10]
+            path = os.path.join(directory, f"outbox-{sink.kind}-{key}{suffix}.jsonl")
+            if (
+                legacy and os.path.exists(legacy) and not os.path.exists(path)
+                and isinstance(sink, TelegramSink) and sink.chat_id == ADMIN_ID and not sink.courses
+            ):
+                # Pending messages of the single-chat outbox this replaced ({"chat_id", "text"} lines).
+                for ext in ("", ".offset"):
+                    if os.path.exists(legacy + ext):
+                        os.replace(legacy + ext, path + ext)
+            self.outboxes.append(Outbox(path, sink))
+
+    def __len__(self) -> int:
+        return sum(len(outbox) for outbox in self.outboxes)
+
+    def publish(self, text: str, record: Dict[str, Any]) -> None:
+        note = {"text": text, "record": record}
+        targets = [outbox for outbox in self.outboxes if outbox.sink.accepts(note)]
+        if not targets:
+            logger.warning("No notification sink for course %s", record.get("course_key"))
+        for outbox in targets:
+            outbox.append(note)
+
+    def start(self, bot) -> None:
+        for outbox in self.outboxes:
+            outbox.start(bot)
+
+    async def stop(self, timeout: float = 0) -> None:
+        await asyncio.gather(*(outbox.stop(timeout) for outbox in self.outboxes))
+
+    async def drain(self, bot, timeout: float) -> None:
+        await asyncio.gather(*(outbox.drain(bot, timeout) for outbox in self.outboxes))
+
+# ----------------------- Registration log & stats -----------------------
+REGISTRATION_FIELDS = [
+    "ts", "user_id", "username", "course_key", "level_key", "section_key", "full_name", "age", "phone"
+]
+
+def registration_row(d: Dict[str, Any], u) -> Dict[str, Any]:
+    return {
+        "ts": datetime.now(tashkent_tz()).isoformat(timespec="seconds"),
+        "user_id": getattr(u, "id", ""),
+        "username": getattr(u, "username", None) or "",
+        "course_key": d.get("course_key", ""),
+        "level_key": d.get("level_key", ""),
+        "section_key": d.get("section_key", ""),
+        "full_name": d.get("full_name", ""),
+        "age": d.get("age", ""),
+        "phone": d.get("phone", ""),
+    }
+
+class RegistrationLog:
+    """Append-only CSV of confirmed registrations plus per-course/section/level counters.
+
+    The counters are saved next to the log together with the byte offset they cover, so
+    startup only replays rows appended after the last save instead of rescanning the log.
+    """
+
+    def __init__(self, path: str, stats_path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.stats_path = stats_path
+        self.stats: Dict[str, Any] = {"offset": 0, "total": 0, "course": {}, "section": {}, "level": {}}
+        if os.path.exists(stats_path):
+            with open(stats_path, encoding="utf-8") as f:
+                self.stats = json.load(f)
+
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        if is_new:
+            self._writer.writerow(REGISTRATION_FIELDS)
+            self._file.flush()
+            self.stats = {"offset": self._file.tell(), "total": 0, "course": {}, "section": {}, "level": {}}
+        elif self._file.tell() > self.stats["offset"]:
+            self._catch_up()
+
+    def _catch_up(self) -> None:
+        with open(self.path, "rb") as f:
+            f.seek(self.stats["offset"])
+            reader = csv.reader(line.decode("utf-8") for line in f)
+            if self.stats["offset"] == 0:
+                next(reader, None)  # header
+            for row in reader:
+                self._count(dict(zip(REGISTRATION_FIELDS, row)))
+        self.stats["offset"] = self._file.tell()
+        self._save_stats()
+
+    def _count(self, row: Dict[str, Any]) -> None:
+        stats = self.stats
+        course_key = row["course_key"]
+        stats["total"] += 1
+        stats["course"][course_key] = stats["course"].get(course_key, 0) + 1
+        section = f"{course_key}:{row['section_key']}"
+        stats["section"][section] = stats["section"].get(section, 0) + 1
+        if row.get("level_key"):
+            level = f"{course_key}:{row['level_key']}"
+            stats["level"][level] = stats["level"].get(level, 0) + 1
+
+    def _save_stats(self) -> None:
+        tmp = self.stats_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.stats, f)
+        os.replace(tmp, self.stats_path)
+
+    def append(self, d: Dict[str, Any], u) -> None:
+        row = registration_row(d, u)
+        self._writer.writerow([row[k] for k in REGISTRATION_FIELDS])
+        self._file.flush()
+        self._count(row)
+        self.stats["offset"] = self._file.tell()
+        self._save_stats()
+
+    def close(self) -> None:
+        self._file.close()
+
+def registration_logs() -> List[str]:
+    # One log per worker process when running a worker pool.
+    return sorted(glob.glob(os.path.join(DATA_DIR, "registrations*.csv")))
+
+def merged_stats() -> Dict[str, Any]:
+    merged: Dict[str, Any] = {"total": 0, "course": {}, "section": {}, "level": {}}
+    for path in glob.glob(os.path.join(DATA_DIR, "registration_stats*.json")):
+        with open(path, encoding="utf-8") as f:
+            stats = json.load(f)
+        merged["total"] += stats["total"]
+        for group in ("course", "section", "level"):
+            for key, n in stats[group].items():
+                merged[group][key] = merged[group].get(key, 0) + n
+    return merged
+
+def build_stats_text(stats: Dict[str, Any], catalog: Catalog) -> str:
+    def course_label(course_key: str) -> str:
+        return esc(catalog.courses.get(course_key, course_key))
+
+    lines = [f"📊 <b>Jami ro‘yxatdan o‘tganlar:</b> {stats['total']}", "", "📚 <b>Kurslar:</b>"]
+    for course_key, n in sorted(stats["course"].items(), key=lambda kv: -kv[1]):
+        lines.append(f"• {course_label(course_key)}: {n}")
+    lines += ["", "🗂 <b>Bo‘limlar:</b>"]
+    for key, n in sorted(stats["section"].items(), key=lambda kv: -kv[1]):
+        course_key, _, section_key = key.partition(":")
+        section_label = catalog.sections.get(course_key, {}).get(section_key, section_key)
+        lines.append(f"• {course_label(course_key)} / {esc(section_label)}: {n}")
+    if stats["level"]:
+        lines += ["", "📊 <b>Darajalar:</b>"]
+        for key, n in sorted(stats["level"].items()):
+            course_key, _, level_key = key.partition(":")
+            lines.append(f"• {course_label(course_key)} / {esc(catalog.levels.get(level_key, level_key))}: {n}")
     return "\n".join(lines)
 
+def export_part_path(dest: str, n: int) -> str:
+    # registrations-x.csv.gz -> registrations-x-part2.csv.gz
+    stem, dot, ext = os.path.basename(dest).partition(".")
+    return os.path.join(os.path.dirname(dest), f"{stem}-part{n}{dot}{ext}")
+
+def finish_export_parts(dest: str, parts: List[str]) -> List[str]:
+    if len(parts) == 1:
+        os.replace(parts[0], dest)
+        return [dest]
+    return parts
+
+def export_csv_gz(paths: List[str], dest: str, part_bytes: int) -> List[str]:
+    """Streams the logs through gzip; each part is a complete .csv.gz of at most ``part_bytes``.
+
+    Returns the files written: ``dest`` itself, or ``dest`` with -part1, -part2, ... when it
+    had to be split. Every part starts with the header.
+    """
+    import gzip
+
+    # Rows are written ~1 MB at a time, and the compressor holds back less than that.
+    limit = part_bytes - (2 << 20)
+    parts: List[str] = []
+    header = b""
+    out = raw = None
+    try:
+        for i, path in enumerate(paths):
+            with open(path, "rb") as f:
+                line = f.readline()
+                if i == 0:
+                    header = line
+                while True:
+                    lines = f.readlines(1 << 20)
+                    if not lines:
+                        break
+                    if out is None or raw.tell() >= limit:
+                        if out is not None:
+                            out.close()
+                            raw.close()
+                        parts.append(export_part_path(dest, len(parts) + 1))
+                        raw = open(parts[-1], "wb")
+                        out = gzip.GzipFile(fileobj=raw, mode="wb")
+                        out.write(header)
+                    out.writelines(lines)
+    finally:
+        if out is not None:
+            out.close()
+            raw.close()
+    if not parts:  # logs with no rows yet
+        with gzip.open(dest, "wb") as out:
+            out.write(header)
+        return [dest]
+    return finish_export_parts(dest, parts)
+
+def export_parquet(paths: List[str], dest: str, part_bytes: int) -> List[str]:
+    """Like export_csv_gz(): one Parquet file per part, each with the full schema."""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    column_types = {k: pa.string() for k in REGISTRATION_FIELDS}
+    column_types.update(user_id=pa.int64(), age=pa.int16())
+    schema = pa.schema([(k, column_types[k]) for k in REGISTRATION_FIELDS])
+    # A 4 MB block of CSV is one row group, well under 4 MB once compressed.
+    limit = part_bytes - (4 << 20)
+    parts: List[str] = []
+    writer = sink = None
+    try:
+        for path in paths:
+            reader = pa_csv.open_csv(
+                path,
+                read_options=pa_csv.ReadOptions(block_size=1 << 22),
+                convert_options=pa_csv.ConvertOptions(column_types=column_types),
+            )
+            for batch in reader:
+                if writer is None or sink.tell() >= limit:
+                    if writer is not None:
+                        writer.close()
+                        sink.close()
+                    parts.append(export_part_path(dest, len(parts) + 1))
+                    sink = pa.OSFile(parts[-1], "wb")
+                    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+                writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+            sink.close()
+    if not parts:
+        pq.ParquetWriter(dest, schema, compression="zstd").close()
+        return [dest]
+    return finish_export_parts(dest, parts)
+
+# ----------------------- Broadcasts -----------------------
+BROADCAST_FILTERS = {"course": "course_key", "section": "section_key", "level": "level_key"}
+
+def iter_registrants(filters_: Dict[str, str], ends: Dict[str, int]):
+    """Streams (log name, byte offset after the row, user_id) for every logged registration matching
+    the column filters, reading each log in ``ends`` (names in DATA_DIR) up to its offset there."""
+    for name, end in sorted(ends.items()):
+        with open(os.path.join(DATA_DIR, name), "rb") as f:
+            header = next(csv.reader([f.readline().decode("utf-8")]), None)
+            if not header:
+                continue
+            offset = f.tell()
+
+            def lines():
+                nonlocal offset
+                for line in f:
+                    if offset >= end or not line.endswith(b"\n"):
+                        return
+                    offset += len(line)
+                    yield line.decode("utf-8")
+
+            for row in csv.reader(lines()):
+                record = dict(zip(header, row))
+                if all(record.get(col) == value for col, value in filters_.items()):
+                    yield name, offset, int(record["user_id"])
+
+class Broadcast:
+    """One announcement to all matching past registrants, resumable after a crash.
+
+    Recipients are streamed from the registration logs a page at a time, each log up to the size it
+    had when the broadcast started. After every page the byte offset reached in each log is
+    checkpointed to ``path``, so rows other workers append meanwhile shift nothing. A restart resends
+    at most one page.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state: Optional[Dict[str, Any]] = None
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.state = json.load(f)
+            if "rows" in self.state:
+                self._upgrade()
+        self._task: Optional[asyncio.Task] = None
+
+    def _upgrade(self) -> None:
+        # Checkpoints used to count rows across all logs in name order.
+        rows = self.state.pop("rows")
+        self.state["logs"], self.state["done"] = {}, {}
+        for path in registration_logs():
+            name = os.path.basename(path)
+            self.state["logs"][name] = os.path.getsize(path)
+            with open(path, "rb") as f:
+                f.readline()
+                while rows > 0 and f.readline().endswith(b"\n"):
+                    rows -= 1
+                self.state["done"][name] = f.tell()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def start(self, bot, filters_: Optional[Dict[str, str]] = None, text: str = "", admin_chat: int = 0) -> None:
+        if filters_ is not None:
+            logs = {os.path.basename(path): os.path.getsize(path) for path in registration_logs()}
+            self.state = {
+                "filters": filters_, "text": text, "admin_chat": admin_chat,
+                "logs": logs, "done": {}, "sent": 0, "failed": 0,
+            }
+            self._save()
+        if self.state:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def cancel(self) -> None:
+        if self._task:
+            self._task.cancel()
+        self.state = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def _send(self, bot, chat_id: int, sem: asyncio.Semaphore) -> bool:
+        async with sem:
+            while True:
+                try:
+                    await bot.send_message(chat_id=chat_id, text=self.state["text"])
+                    return True
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except (Forbidden, BadRequest):
+                    return False  # blocked the bot or deleted their account
+                except TelegramError as e:
+                    logger.warning("Broadcast to %s failed: %s", chat_id, e)
+                    return False
+
+    async def _run(self, bot) -> None:
+        state = self.state
+        sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        seen: set = set()  # a person who registered twice gets one message
+        page: List[int] = []
+        done = state["done"]  # log name -> offset up to which the rows were delivered
+        reached: Dict[str, int] = {}
+
+        async def flush() -> None:
+            results = await asyncio.gather(*(self._send(bot, chat_id, sem) for chat_id in page))
+            state["sent"] += sum(results)
+            state["failed"] += len(results) - sum(results)
+            done.update(reached)
+            self._save()
+            page.clear()
+
+        for name, offset, user_id in iter_registrants(state["filters"], state["logs"]):
+            if user_id in seen:
+                continue
+            seen.add(user_id)
+            if offset <= done.get(name, 0):
+                continue  # delivered before the last checkpoint
+            page.append(user_id)
+            reached[name] = offset
+            if len(page) >= BROADCAST_PAGE:
+                await flush()
+        if page:
+            await flush()
+
+        logger.info("Broadcast finished: %d sent, %d failed", state["sent"], state["failed"])
+        try:
+            await bot.send_message(
+                chat_id=state["admin_chat"],
+                text=tr(DEFAULT_LANGUAGE, "broadcast_done", sent=str(state["sent"]), failed=str(state["failed"])),
+            )
+        except TelegramError as e:
+            # The checkpoint stays, so a restart skips every recipient and only sends the report again.
+            logger.warning("Broadcast report to %s failed: %s", state["admin_chat"], e)
+            return
+        self.state = None
+        os.remove(self.path)
+
+# ----------------------- Duplicate detection -----------------------
+class RegistrationIndex:
+    """Set of already registered phones and user ids, stored as 64-bit digests.
+
+    Each registration log has its digests saved next to it in ``<log>.digests``: the byte offset of
+    the log they cover, then a sorted ``array('Q')`` (8 bytes per entry). Startup reads that as is and
+    only digests rows appended after the offset, folding them into the file for the next start.
+    Before a check every log is caught up again, so rows other workers appended meanwhile (kept in a
+    small set) count too, whichever worker a repeat is routed to.
+    """
+
+    def __init__(self, logs: Callable[[], List[str]]):
+        self._logs = logs
+        self._runs: Dict[str, array] = {}  # log -> sorted digests of its rows below _offsets[log]
+        self._offsets: Dict[str, int] = {}
+        self._columns: Dict[str, Tuple[int, int]] = {}  # log -> (user_id, phone) column
+        self._recent: set = set()
+        self._deferred = False
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self._runs.values()) + len(self._recent)
+
+    def defer_load(self) -> None:
+        """load() on the first check/add instead of now; a one-update process rarely needs it."""
+        self._deferred = True
+
+    def _load_deferred(self) -> None:
+        if self._deferred:
+            self.load()
+
+    @staticmethod
+    def _digest(kind: str, value: Any) -> int:
+        return int.from_bytes(hashlib.blake2b(f"{kind}:{value}".encode(), digest_size=8).digest(), "big")
+
+    def _contains(self, h: int) -> bool:
+        if h in self._recent:
+            return True
+        for run in self._runs.values():
+            i = bisect.bisect_left(run, h)
+            if i < len(run) and run[i] == h:
+                return True
+        return False
+
+    def _read(self, path: str) -> Iterator[int]:
+        """Digests of the complete rows appended to ``path`` since it was last read."""
+        offset = self._offsets.get(path, 0)
+        with open(path, "rb") as f:
+            if path not in self._columns:
+                header = next(csv.reader([f.readline().decode("utf-8")]), None)
+                if not header:
+                    return
+                self._columns[path] = (header.index("user_id"), header.index("phone"))
+                offset = max(offset, f.tell())
+            user_col, phone_col = self._columns[path]
+            f.seek(offset)
+
+            def complete_lines():
+                nonlocal offset
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        return  # still being written by another worker
+                    offset += len(line)
+                    yield line.decode("utf-8")
+
+            for row in csv.reader(complete_lines()):
+                if row:
+                    yield self._digest("user", row[user_col])
+                    yield self._digest("phone", row[phone_col])
+        self._offsets[path] = offset
+
+    def _load(self, path: str) -> None:
+        run, offset = array("Q"), 0
+        if os.path.exists(path + ".digests"):
+            with open(path + ".digests", "rb") as f:
+                offset = int.from_bytes(f.read(8), "little")
+                run.frombytes(f.read())
+        if offset > os.path.getsize(path):  # the log was replaced
+            run, offset = array("Q"), 0
+        self._runs[path], self._offsets[path] = run, offset
+        digests = self._read(path)
+        # New rows are sorted a chunk at a time, so at most one chunk of them is ever Python ints.
+        runs = [run]
+        for chunk in iter(lambda: sorted(itertools.islice(digests, 1 << 20)), []):
+            runs.append(array("Q", chunk))
+        if len(runs) == 1:
+            return
+        self._runs[path] = run = array("Q", heapq.merge(*runs))
+        del runs
+        tmp = f"{path}.digests.{os.getpid()}.tmp"  # workers may fold the same log at once
+        with open(tmp, "wb") as f:
+            f.write(self._offsets[path].to_bytes(8, "little"))
+            run.tofile(f)
+        os.replace(tmp, path + ".digests")
+
+    def load(self) -> None:
+        self._deferred = False
+        for path in self._logs():
+            self._load(path)
+        logger.info("Duplicate index: %d entries loaded", len(self))
+
+    def _catch_up(self) -> None:
+        for path in self._logs():
+            if path not in self._offsets:
+                self._load(path)  # a worker that started after this one
+            elif os.path.getsize(path) > self._offsets[path]:
+                self._recent.update(self._read(path))
+
+    def check(self, phone: str, user_id: int) -> Optional[str]:
+        """Returns which key was already registered ("phone" or "user"), or None."""
+        self._load_deferred()
+        self._catch_up()
+        if self._contains(self._digest("phone", phone)):
+            return "phone"
+        if self._contains(self._digest("user", user_id)):
+            return "user"
+        return None
+
+    def add(self, phone: str, user_id: int) -> None:
+        self._load_deferred()
+        self._recent.add(self._digest("phone", phone))
+        self._recent.add(self._digest("user", user_id))
+
+# ----------------------- Registrant search -----------------------
+CRM_FILTERS = ("phone", "name", "course", "section", "from", "to")
+
+def parse_crm_filters(words: List[str]) -> Optional[Dict[str, str]]:
+    """``key=value`` words into search filters; bare words are joined into the name. None if invalid."""
+    filters_: Dict[str, str] = {}
+    name_words: List[str] = []
+    for word in words:
+        key, sep, value = word.partition("=")
+        if not sep:
+            name_words.append(word)
+            continue
+        if key not in CRM_FILTERS or not value:
+            return None
+        filters_[key] = value
+    if name_words:
+        filters_["name"] = " ".join([filters_.get("name", "")] + name_words).strip()
+    if "phone" in filters_:
+        digits = filters_["phone"].lstrip("+").replace("-", "")
+        if not (digits.isascii() and digits.isdigit()):
+            return None
+        filters_["phone"] = "+" + digits if digits.startswith("998") else "+998" + digits
+    for key in ("from", "to"):
+        if key in filters_:
+            try:
+                date.fromisoformat(filters_[key])
+            except ValueError:
+                return None
+    return filters_ if filters_ else None
+
+class RegistrantStore:
+    """SQLite copy of the registration logs for the admin's /find search.
+
+    The CSV logs stay the source of truth: sync() imports what was appended to each log since the
+    byte offset recorded for it, in one write transaction per log, so workers sharing the database
+    never import a row twice. Row ids are the registration time (``seconds << 16`` plus a counter),
+    so results are newest first by id, a date range is an id range, and every other filter has an
+    index that yields rows in id order: pages are keyset-paginated and a later one costs what the
+    first does. Names go through an FTS5 trigram index (3+ characters; shorter ones use LIKE).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS registrants (
+            id INTEGER PRIMARY KEY, ts TEXT NOT NULL, user_id INTEGER, username TEXT, course_key TEXT,
+            level_key TEXT, section_key TEXT, full_name TEXT, age INTEGER, phone TEXT
+        );
+        CREATE INDEX IF NOT EXISTS registrants_phone ON registrants (phone);
+        CREATE INDEX IF NOT EXISTS registrants_course ON registrants (course_key);
+        CREATE INDEX IF NOT EXISTS registrants_course_section ON registrants (course_key, section_key);
+        CREATE INDEX IF NOT EXISTS registrants_section ON registrants (section_key);
+        CREATE VIRTUAL TABLE IF NOT EXISTS registrants_fts USING fts5 (
+            full_name, content='registrants', content_rowid='id', tokenize='trigram'
+        );
+        CREATE TRIGGER IF NOT EXISTS registrants_fts_insert AFTER INSERT ON registrants BEGIN
+            INSERT INTO registrants_fts (rowid, full_name) VALUES (new.id, new.full_name);
+        END;
+        CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, offset INTEGER NOT NULL);
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # The initial import runs in a thread (post_init); everything else on the event loop.
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    @staticmethod
+    def time_key(moment: datetime) -> int:
+        return int(moment.timestamp()) << 16
+
+    @classmethod
+    def date_key(cls, day: str) -> int:
+        return cls.time_key(datetime.combine(date.fromisoformat(day), datetime.min.time(), tashkent_tz()))
+
+    def _import(self, rows: List[List[str]]) -> None:
+        conn = self._conn
+        insert = f"INSERT INTO registrants (id, {', '.join(REGISTRATION_FIELDS)}) VALUES ({', '.join('?' * 10)})"
+        pending: List[List[Any]] = []
+        base = next_id = -1
+        for row in rows:
+            row_base = self.time_key(datetime.fromisoformat(row[0]))
+            if row_base != base:
+                if row_base < base:
+                    conn.executemany(insert, pending)  # clock went back: the next lookup must see these
+                    pending.clear()
+                base = row_base
+                top = conn.execute(
+                    "SELECT max(id) FROM registrants WHERE id >= ? AND id < ?", (base, base + (1 << 16))
+                ).fetchone()[0]
+                next_id = base if top is None else top + 1
+            pending.append([next_id] + row)
+            next_id += 1
+        conn.executemany(insert, pending)
+
+    def sync(self, paths: List[str]) -> int:
+        """Imports rows appended to the logs since the last sync; returns how many."""
+        imported = 0
+        conn = self._conn
+        for path in paths:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT offset FROM sources WHERE path = ?", (path,)).fetchone()
+                offset = row[0] if row else 0
+                if os.path.getsize(path) > offset:
+                    with open(path, "rb") as f:
+                        f.seek(offset)
+                        if offset == 0:
+                            offset = len(f.readline())  # header
+                        lines = []
+                        for line in f:
+                            if not line.endswith(b"\n"):
+                                break  # still being written
+                            lines.append(line.decode("utf-8"))
+                            offset += len(line)
+                    rows = list(csv.reader(lines))
+                    self._import(rows)
+                    conn.execute(
+                        "INSERT INTO sources (path, offset) VALUES (?, ?) "
+                        "ON CONFLICT(path) DO UPDATE SET offset = excluded.offset",
+                        (path, offset),
+                    )
+                    imported += len(rows)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if imported:
+            logger.info("Registrant search: imported %d rows", imported)
+        return imported
+
+    def search(
+        self, filters_: Dict[str, str], before: Optional[int] = None, after: Optional[int] = None, limit: int = 10
+    ) -> Tuple[List[sqlite3.Row], bool]:
+        """One page of matches, newest first: older than ``before`` or, paging back, newer than ``after``.
+
+        Returns the rows and whether more exist in the direction paged.
+        """
+        where: List[str] = []
+        params: List[Any] = []
+        source = "registrants r"
+        key = "r.id"
+        name = filters_.get("name", "")
+        if len(name) >= 3:
+            source = "registrants_fts f JOIN registrants r ON r.id = f.rowid"
+            key = "f.rowid"
+            where.append("registrants_fts MATCH ?")
+            params.append('"' + name.replace('"', '""') + '"')
+        elif name:
+            where.append("r.full_name LIKE ? ESCAPE '\\'")
+            params.append("%" + name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if "phone" in filters_:
+            # A prefix as an index range; "\x7f" sorts after every digit.
+            where.append("r.phone >= ? AND r.phone < ?")
+            params += [filters_["phone"], filters_["phone"] + "\x7f"]
+        if "course" in filters_:
+            where.append("r.course_key = ?")
+            params.append(filters_["course"])
+        if "section" in filters_:
+            where.append("r.section_key = ?")
+            params.append(filters_["section"])
+        if "from" in filters_:
+            where.append(f"{key} >= ?")
+            params.append(self.date_key(filters_["from"]))
+        if "to" in filters_:
+            where.append(f"{key} < ?")
+            params.append(self.date_key((date.fromisoformat(filters_["to"]) + timedelta(days=1)).isoformat()))
+        if after is not None:
+            where.append(f"{key} > ?")
+            params.append(after)
+        elif before is not None:
+            where.append(f"{key} < ?")
+            params.append(before)
+        sql = (
+            f"SELECT r.* FROM {source}"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + f" ORDER BY {key} {'ASC' if after is not None else 'DESC'} LIMIT ?"
+        )
+        rows = self._conn.execute(sql, params + [limit + 1]).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if after is not None:
+            rows.reverse()
+        return rows, more
+
+    def close(self) -> None:
+        self._conn.close()
+
+def build_crm_page(rows: List[sqlite3.Row], catalog: Catalog) -> str:
+    if not rows:
+        return "🔎 Hech narsa topilmadi."
+    lines = ["🔎 <b>Topilganlar:</b>"]
+    for row in rows:
+        d = dict(row)
+        d["level_label"] = d["level_key"]
+        course, section, level = labels_html(d, catalog, DEFAULT_LANGUAGE)
+        username = f" · @{row['username']}" if row["username"] else ""
+        lines += [
+            "",
+            f"👤 <b>{esc(row['full_name'])}</b> · {row['age']} yosh · {row['phone']}",
+            f"📚 {course}{' / ' + level if level else ''} / {section}",
+            f"🕒 {esc(row['ts'][:16].replace('T', ' '))} · ID <code>{row['user_id']}</code>{esc(username)}",
+        ]
+    return "\n".join(lines)
+
+def kb_crm_page(search_id: str, rows: List[sqlite3.Row], newer: bool, older: bool) -> Optional[InlineKeyboardMarkup]:
+    buttons = []
+    if rows and newer:
+        buttons.append(InlineKeyboardButton("◀️ Yangiroq", callback_data=f"crm:{search_id}:n:{rows[0]['id']}"))
+    if rows and older:
+        buttons.append(InlineKeyboardButton("Eskiroq ▶️", callback_data=f"crm:{search_id}:o:{rows[-1]['id']}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
 # ----------------------- Flow Helpers -----------------------
+def flow_catalog(context: ContextTypes.DEFAULT_TYPE) -> Catalog:
+    # A flow stays on the catalog version it started with, even if the file is reloaded meanwhile.
+    return context.bot_data["catalogs"].get(context.user_data.get("catalog_version"))
+
+def flow_language(context: ContextTypes.DEFAULT_TYPE, user) -> str:
+    # Picked once per flow from the user's Telegram language, then kept for the rest of it.
+    lang = context.user_data.get("lang")
+    if lang not in LOCALES:
+        lang = context.user_data["lang"] = user_language(user)
+    return lang
+
 async def goto_courses(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = (
-        "📚 Qaysi <b>kurs</b>da o‘qimoqchisiz?\n"
-        "<i>Iltimos, quyidagilardan birini tanlang.</i>"
-    )
+    context.user_data.setdefault("catalog_version", context.bot_data["catalogs"].current.version)
+    catalog = flow_catalog(context)
+    lang = flow_language(context, update.effective_user)
+    text = tr(lang, "choose_course")
     if update.callback_query:
         await update.callback_query.edit_message_text(
-            text, reply_markup=kb_courses(), parse_mode=ParseMode.HTML
+            text, reply_markup=catalog.kb_courses[lang], parse_mode=ParseMode.HTML
         )
     else:
-        await update.message.reply_text(text, reply_markup=kb_courses(), parse_mode=ParseMode.HTML)
+        await update.message.reply_text(text, reply_markup=catalog.kb_courses[lang], parse_mode=ParseMode.HTML)
     context.user_data["step"] = "choose_course"
 
 async def goto_levels(query, context: ContextTypes.DEFAULT_TYPE):
     # query is a CallbackQuery object
+    lang = flow_language(context, query.from_user)
     await query.edit_message_text(
-        "📊 Iltimos, <b>darajangizni</b> tanlang:",
-        reply_markup=kb_levels(),
+        tr(lang, "choose_level"),
+        reply_markup=flow_catalog(context).kb_levels[lang],
         parse_mode=ParseMode.HTML,
     )
     context.user_data["step"] = "choose_level"
 
 async def goto_sections(query, context: ContextTypes.DEFAULT_TYPE):
+    lang = flow_language(context, query.from_user)
     course_key = context.user_data.get("course_key")
+    markup = flow_catalog(context).kb_sections[lang].get(course_key)
+    if markup is None:
+        await query.edit_message_text(tr(lang, "course_missing"))
+        return
     await query.edit_message_text(
-        "🗂 Iltimos, <b>bo‘lim</b>ni tanlang:",
-        reply_markup=kb_sections(course_key),
+        tr(lang, "choose_section"),
+        reply_markup=markup,
         parse_mode=ParseMode.HTML,
     )
     context.user_data["step"] = "choose_section"
 
+def prompt_key(text: str, reply_markup=None) -> str:
+    """A digest of a prompt that stays the same across restarts, since sessions are persisted with it."""
+    markup = json.dumps(reply_markup.to_dict(), sort_keys=True) if reply_markup is not None else ""
+    return hashlib.blake2b((text + "\0" + markup).encode(), digest_size=8).hexdigest()
+
+async def show_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup=None) -> None:
+    """Shows the next step of the flow, editing the bot's current prompt instead of sending if it can.
+
+    A tap edits the tapped message; a typed answer edits the tracked prompt (``prompt_id``) when it
+    is still on screen just above. An edit that would not change the prompt is skipped. Anything
+    else, or an edit Telegram refuses, is sent as a new message that becomes the prompt.
+    """
+    ud = context.user_data
+    chat = update.effective_chat
+    message = update.effective_message
+    key = prompt_key(text, reply_markup)
+    target = None
+    if update.callback_query and message:
+        target = message.message_id
+    elif ud.get("prompt_id") and message and message.message_id - ud["prompt_id"] <= PROMPT_EDIT_DISTANCE:
+        target = ud["prompt_id"]
+    if target is not None:
+        if target == ud.get("prompt_id") and key == ud.get("prompt_key"):
+            return
+        try:
+            await context.bot.edit_message_text(
+                text, chat_id=chat.id, message_id=target, reply_markup=reply_markup, parse_mode=ParseMode.HTML
+            )
+        except BadRequest as e:
+            if "not modified" not in e.message.lower():
+                logger.debug("Editing prompt %s failed (%s), sending instead", target, e)
+                target = None
+    if target is None:
+        sent = await chat.send_message(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        target = sent.message_id
+    ud["prompt_id"] = target
+    ud["prompt_key"] = key
+
 async def ask_full_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    msg = (
-        "✍️ <b>Iltimos, to‘liq ism-familiyangizni kiriting.</b>\n"
-        "<i>Masalan: Ziyodulla Egamberdiyev</i>"
-    )
-    await update.effective_chat.send_message(msg, parse_mode=ParseMode.HTML, reply_markup=ReplyKeyboardRemove())
+    lang = flow_language(context, update.effective_user)
+    if context.user_data.get("reply_keyboard"):
+        # Only a new message can take the share-phone keyboard away.
+        sent = await update.effective_chat.send_message(
+            tr(lang, "ask_name"), parse_mode=ParseMode.HTML, reply_markup=ReplyKeyboardRemove()
+        )
+        context.user_data["reply_keyboard"] = False
+        context.user_data["prompt_id"] = sent.message_id
+        context.user_data.pop("prompt_key", None)
+    else:
+        await show_prompt(update, context, tr(lang, "ask_name"))
     context.user_data["step"] = "ask_name"
 
 async def ask_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.effective_chat.send_message("🎂 <b>Yoshingizni kiriting:</b>", parse_mode=ParseMode.HTML)
+    lang = flow_language(context, update.effective_user)
+    await show_prompt(update, context, tr(lang, "ask_age"))
     context.user_data["step"] = "ask_age"
 
+async def send_phone_keyboard(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, lang: str) -> None:
+    # A reply keyboard can only come with a new message, and Telegram will not put inline buttons on
+    # it later, so the prompt is not tracked for editing.
+    await update.effective_chat.send_message(text, parse_mode=ParseMode.HTML, reply_markup=kb_share_phone(lang))
+    context.user_data["reply_keyboard"] = True
+    context.user_data.pop("prompt_id", None)
+    context.user_data.pop("prompt_key", None)
+
 async def ask_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    kb = ReplyKeyboardMarkup(
-        [[KeyboardButton("📱 Raqamni ulashish", request_contact=True)]],
-        resize_keyboard=True,
-        one_time_keyboard=True,
-    )
-    await update.effective_chat.send_message(
-        "📞 <b>Telefon raqamingizni kiriting</b> (format: <code>+998XXXXXXXXX</code>) yoki pastdagi tugma orqali yuboring.",
-        parse_mode=ParseMode.HTML,
-        reply_markup=kb,
-    )
+    lang = flow_language(context, update.effective_user)
+    await send_phone_keyboard(update, context, tr(lang, "ask_phone"), lang)
     context.user_data["step"] = "ask_phone"
 
 async def show_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = build_review_text(context.user_data)
-    if update.callback_query:
-        await update.callback_query.edit_message_text(text, reply_markup=kb_review(), parse_mode=ParseMode.HTML)
-    else:
-        await update.effective_chat.send_message(text, reply_markup=kb_review(), parse_mode=ParseMode.HTML)
+    lang = flow_language(context, update.effective_user)
+    text = build_review_text(context.user_data, flow_catalog(context), lang)
+    await show_prompt(update, context, text, kb_review(lang))
     context.user_data["step"] = "review"
 
-# ----------------------- Handlers -----------------------
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    welcome = (
-        "Assalomu alaykum!\n"
-        "<b>Welcome to ITeach Academy</b> 🎓\n\n"
-        "Bizning o‘quv jamoamizga qo‘shilish va ro‘yxatdan o‘tish uchun pastdagi tugmani bosing."
-    )
-    await update.message.reply_text(welcome, reply_markup=kb_register(), parse_mode=ParseMode.HTML)
+# ----------------------- Callback routing -----------------------
+class Callback(NamedTuple):
+    """A parsed ``reg:<action>[:<arg>]`` callback; ``key`` is ``<action>[:<arg>]``."""
+
+    key: str
+    action: str
+    arg: str
+
+def parse_callback(data: str) -> Optional[Callback]:
+    ns, _, key = data.partition(":")
+    if ns != "reg":
+        return None
+    action, _, arg = key.partition(":")
+    return Callback(key, action, arg)
+
+CallbackRoute = Callable[[Update, ContextTypes.DEFAULT_TYPE, CallbackQuery, Callback], Awaitable[None]]
+
+# Exact keys ("back:courses") win over action-wide routes ("course" for every "course:<key>").
+CALLBACK_ROUTES: Dict[str, CallbackRoute] = {}
+
+def callback_route(*keys: str):
+    def register(fn: CallbackRoute) -> CallbackRoute:
+        for key in keys:
+            CALLBACK_ROUTES[key] = fn
+        return fn
+    return register
+
+def resolve_callback(data: str) -> Tuple[Optional[CallbackRoute], Optional[Callback]]:
+    cb = parse_callback(data)
+    if cb is None:
+        return None, None
+    return CALLBACK_ROUTES.get(cb.key) or CALLBACK_ROUTES.get(cb.action), cb
+
+@callback_route("cancel")
+async def on_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    lang = flow_language(context, query.from_user)
     context.user_data.clear()
+    await query.edit_message_text(tr(lang, "cancelled"))
+
+@callback_route("start")
+async def on_start(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    await goto_courses(update, context)
+
+@callback_route("back:courses")
+async def on_back_courses(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    context.user_data.pop("level_key", None)
+    context.user_data.pop("level_label", None)
+    context.user_data.pop("section_key", None)
+    context.user_data.pop("section_label", None)
+    await goto_courses(update, context)
+
+@callback_route("back:levels")
+async def on_back_levels(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    context.user_data.pop("section_key", None)
+    context.user_data.pop("section_label", None)
+    await goto_levels(query, context)
+
+@callback_route("back:review")
+async def on_back_review(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    await show_review(update, context)
 
-async def cb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    data = query.data or ""
-    await query.answer()
-    logger.info("Callback data: %s", data)
-
-    if data == "reg:cancel":
-        context.user_data.clear()
-        await query.edit_message_text("❌ Ro‘yxatdan o‘tish bekor qilindi.")
-        return
-
-    if data == "reg:start":
-        await goto_courses(update, context)
-        return
-
-    if data == "reg:back:courses":
-        context.user_data.pop("level_key", None)
-        context.user_data.pop("level_label", None)
-        context.user_data.pop("section_key", None)
-        context.user_data.pop("section_label", None)
-        await goto_courses(update, context)
+@callback_route("course")
+async def on_course(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    catalog = flow_catalog(context)
+    course_key = cb.arg
+    if course_key not in catalog.courses:
+        await query.edit_message_text(tr(flow_language(context, query.from_user), "bad_course"))
         return
-
-    if data == "reg:back:levels":
-        context.user_data.pop("section_key", None)
-        context.user_data.pop("section_label", None)
+    context.user_data["course_key"] = course_key
+    context.user_data["course_label"] = catalog.courses[course_key]
+    context.user_data.pop("level_key", None)
+    context.user_data.pop("level_label", None)
+    context.user_data.pop("section_key", None)
+    context.user_data.pop("section_label", None)
+
+    if course_key in catalog.courses_with_level:
         await goto_levels(query, context)
-        return
+    else:
+        await goto_sections(query, context)
 
-    if data == "reg:back:review":
-        await show_review(update, context)
+@callback_route("level")
+async def on_level(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    levels = flow_catalog(context).levels
+    level_key = cb.arg
+    if level_key not in levels:
+        await query.edit_message_text(tr(flow_language(context, query.from_user), "bad_level"))
         return
+    context.user_data["level_key"] = level_key
+    context.user_data["level_label"] = levels[level_key]
+    await goto_sections(query, context)
 
-    if data.startswith("reg:course:"):
-        course_key = data.split(":")[2]
-        if course_key not in COURSES:
-            await query.edit_message_text("Noto‘g‘ri kurs tanlandi. Qaytadan urinib ko‘ring.")
-            return
-        context.user_data["course_key"] = course_key
-        context.user_data["course_label"] = COURSES[course_key]
-        context.user_data.pop("level_key", None)
-        context.user_data.pop("level_label", None)
-        context.user_data.pop("section_key", None)
-        context.user_data.pop("section_label", None)
-
-        if course_key in COURSES_WITH_LEVEL:
-            await goto_levels(query, context)
-        else:
-            await goto_sections(query, context)
+@callback_route("section")
+async def on_section(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    section_key = cb.arg
+    course_key = context.user_data.get("course_key")
+    valid_keys = flow_catalog(context).sections.get(course_key, {})
+    if section_key not in valid_keys:
+        await query.edit_message_text(tr(flow_language(context, query.from_user), "bad_section"))
         return
-
-    if data.startswith("reg:level:"):
-        level_key = data.split(":")[2]
-        if level_key not in LEVELS:
-            await query.edit_message_text("Noto‘g‘ri daraja tanlandi. Qaytadan urinib ko‘ring.")
-            return
-        context.user_data["level_key"] = level_key
-        context.user_data["level_label"] = LEVELS[level_key]
-        await goto_sections(query, context)
+    context.user_data["section_key"] = section_key
+    context.user_data["section_label"] = valid_keys[section_key]
+    await ask_full_name(update, context)
+
+@callback_route("confirm")
+async def on_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    catalog = flow_catalog(context)
+    lang = flow_language(context, query.from_user)
+    required = ["course_key", "course_label", "section_label", "full_name", "age", "phone"]
+    if context.user_data.get("course_key") in catalog.courses_with_level:
+        required.append("level_label")
+    missing = [k for k in required if not context.user_data.get(k)]
+    if missing:
+        await query.edit_message_text(tr(lang, "incomplete"))
+        context.user_data.clear()
         return
 
-    if data.startswith("reg:section:"):
-        section_key = data.split(":")[2]
-        course_key = context.user_data.get("course_key")
-        valid_keys = (
-            SECTIONS_ENGLISH
-            if course_key == "english"
-            else SECTIONS_GERMAN
-            if course_key == "german"
-            else SECTIONS_OTHERS
-        )
-        if section_key not in valid_keys:
-            await query.edit_message_text("Noto‘g‘ri bo‘lim tanlandi. Qaytadan urinib ko‘ring.")
-            return
-        context.user_data["section_key"] = section_key
-        context.user_data["section_label"] = valid_keys[section_key]
-        await ask_full_name(update, context)
+    user = update.effective_user
+    index: RegistrationIndex = context.bot_data["registered"]
+    duplicate = index.check(context.user_data["phone"], user.id)
+    if duplicate and DUPLICATE_POLICY == "reject":
+        await query.edit_message_text(tr(lang, "already_registered"))
+        context.user_data.clear()
         return
 
-    if data == "reg:confirm":
-        required = ["course_key", "course_label", "section_label", "full_name", "age", "phone"]
-        if context.user_data.get("course_key") in COURSES_WITH_LEVEL:
-            required.append("level_label")
-        missing = [k for k in required if not context.user_data.get(k)]
-        if missing:
-            await query.edit_message_text(
-                "Ma’lumotlar yetarli emas. Iltimos, /start buyrug‘i bilan qaytadan boshlang."
-            )
-            context.user_data.clear()
-            return
+    # Notify user
+    await query.edit_message_text(tr(lang, "registered"), parse_mode=ParseMode.HTML)
+
+    # Notify admins (no DB): queued on disk per sink, delivered by the outbox dispatchers
+    admin_text = build_admin_text(context.user_data, user, catalog)
+    if duplicate:
+        reason = tr(DEFAULT_LANGUAGE, "admin_duplicate_" + duplicate)
+        admin_text = tr(DEFAULT_LANGUAGE, "admin_duplicate", reason=reason) + admin_text
+    record = registration_row(context.user_data, user)
+    record.update(
+        course=context.user_data.get("course_label", ""),
+        level=context.user_data.get("level_label", ""),
+        section=context.user_data.get("section_label", ""),
+        duplicate=duplicate or "",
+    )
+    context.bot_data["outbox"].publish(admin_text, record)
+    metrics.inc("iteach_funnel_step_total", (("step", "confirmed"),))
+    context.bot_data["registrations"].append(context.user_data, user)
+    index.add(context.user_data["phone"], user.id)
 
-        # Notify user
-        await query.edit_message_text(
-            "🎉 <b>Tabriklaymiz!</b> Siz ro‘yxatdan o‘tdingiz.\nTez orada siz bilan telefon raqamingiz orqali bog‘lanamiz.",
-            parse_mode=ParseMode.HTML,
-        )
+    context.user_data.clear()
 
-        # Notify admin (no DB)
-        try:
-            user = update.effective_user
-            admin_text = build_admin_text(context.user_data, user)
-            await context.bot.send_message(chat_id=ADMIN_ID, text=admin_text, parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logger.warning("Failed to notify admin: %s", e)
+@callback_route("edit")
+async def on_edit(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    catalog = flow_catalog(context)
+    lang = flow_language(context, query.from_user)
+    course_key = context.user_data.get("course_key", "")
+    await query.edit_message_text(
+        tr(lang, "edit_menu"),
+        reply_markup=catalog.kb_edit_menu[lang].get(course_key, catalog.kb_edit_menu_default[lang]),
+        parse_mode=ParseMode.HTML,
+    )
+    context.user_data["step"] = "edit_menu"
+
+@callback_route("edit:course")
+async def on_edit_course(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    context.user_data["edit_field"] = "course"
+    await goto_courses(update, context)
+
+@callback_route("edit:level")
+async def on_edit_level(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    context.user_data["edit_field"] = "level"
+    await goto_levels(query, context)
+
+@callback_route("edit:section")
+async def on_edit_section(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    context.user_data["edit_field"] = "section"
+    await goto_sections(query, context)
+
+@callback_route("edit:name")
+async def on_edit_name(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    context.user_data["edit_field"] = "name"
+    await show_prompt(update, context, tr(flow_language(context, query.from_user), "edit_name"))
+    context.user_data["step"] = "ask_name"
 
-        context.user_data.clear()
-        return
+@callback_route("edit:age")
+async def on_edit_age(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    context.user_data["edit_field"] = "age"
+    await show_prompt(update, context, tr(flow_language(context, query.from_user), "edit_age"))
+    context.user_data["step"] = "ask_age"
 
-    if data == "reg:edit":
-        course_key = context.user_data.get("course_key", "")
-        await query.edit_message_text(
-            "Qaysi <b>bo‘limni</b> o‘zgartiramiz?",
-            reply_markup=kb_edit_menu(course_key),
-            parse_mode=ParseMode.HTML,
-        )
-        context.user_data["step"] = "edit_menu"
-        return
+@callback_route("edit:phone")
+async def on_edit_phone(update: Update, context: ContextTypes.DEFAULT_TYPE, query: CallbackQuery, cb: Callback):
+    context.user_data["edit_field"] = "phone"
+    lang = flow_language(context, query.from_user)
+    await query.edit_message_text(tr(lang, "edit_phone"), parse_mode=ParseMode.HTML)
+    await send_phone_keyboard(update, context, tr(lang, "send_phone"), lang)
+    context.user_data["step"] = "ask_phone"
 
-    if data.startswith("reg:edit:"):
-        field = data.split(":")[2]
-        context.user_data["edit_field"] = field
+# ----------------------- Handlers -----------------------
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # A new flow re-reads the user's Telegram language.
+    lang = user_language(update.effective_user)
+    await update.message.reply_text(tr(lang, "welcome"), reply_markup=kb_register(lang), parse_mode=ParseMode.HTML)
+    context.user_data.clear()
 
-        if field == "course":
-            await goto_courses(update, context)
-            return
-        if field == "level":
-            await goto_levels(query, context)
-            return
-        if field == "section":
-            await goto_sections(query, context)
-            return
-        if field == "name":
-            await query.edit_message_text("✍️ Yangi <b>ism-familiya</b>ni kiriting:", parse_mode=ParseMode.HTML)
-            context.user_data["step"] = "ask_name"
-            return
-        if field == "age":
-            await query.edit_message_text("🎂 Yangi <b>yosh</b>ni kiriting:", parse_mode=ParseMode.HTML)
-            context.user_data["step"] = "ask_age"
-            return
-        if field == "phone":
-            kb = ReplyKeyboardMarkup(
-                [[KeyboardButton("📱 Raqamni ulashish", request_contact=True)]],
-                resize_keyboard=True,
-                one_time_keyboard=True,
-            )
-            await query.edit_message_text(
-                "📞 Yangi <b>telefon</b>ni kiriting (format: <code>+998XXXXXXXXX</code>) yoki pastdagi tugma orqali yuboring.",
-                parse_mode=ParseMode.HTML,
-            )
-            await update.effective_chat.send_message("Telefonni yuboring:", reply_markup=kb)
-            context.user_data["step"] = "ask_phone"
-            return
+async def cb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data or ""
+    await query.answer()
+    logger.debug("Callback data: %s", data)
+
+    route, cb = resolve_callback(data)
+    if route:
+        await route(update, context, query, cb)
 
 async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     step = context.user_data.get("step")
     text = (update.message.text or "").strip()
 
-    if step == "ask_name":
-        if not valid_full_name(text):
-            await update.message.reply_text(
-                "❌ To‘liq ism-familiya kiriting.\nMasalan: <i>Ziyodulla Egamberdiyev</i>",
-                parse_mode=ParseMode.HTML,
-            )
+    checks = {"ask_name": check_full_name, "ask_age": check_age, "ask_phone": check_phone}
+    if step in checks:
+        value, error = checks[step](text)
+        if error:
+            lang = flow_language(context, update.effective_user)
+            await show_prompt(update, context, tr(lang, "err_" + error))
             return
-        context.user_data["full_name"] = text
+
+    if step == "ask_name":
+        context.user_data["full_name"] = value
         await ask_age(update, context)
         return
 
     if step == "ask_age":
-        if not valid_age(text):
-            await update.message.reply_text("❌ Yosh faqat 3–100 oralig‘ida bo‘lishi kerak. Qayta kiriting:")
-            return
-        context.user_data["age"] = int(text)
+        context.user_data["age"] = value
         await ask_phone(update, context)
         return
 
     if step == "ask_phone":
-        normalized = normalize_phone(text)
-        if not normalized:
-            await update.message.reply_text(
-                "❌ Noto‘g‘ri format. Iltimos, <code>+998XXXXXXXXX</code> shaklida kiriting yoki pastdagi tugmadan foydalaning.",
-                parse_mode=ParseMode.HTML,
-            )
-            return
-        context.user_data["phone"] = normalized
+        context.user_data["phone"] = value
         await show_review(update, context)
         return
 
-    await update.message.reply_text(
-        "Iltimos, /start buyrug‘i bilan boshlang yoki jarayon tugmalaridan foydalaning."
-    )
+    await update.message.reply_text(tr(user_language(update.effective_user), "fallback"))
 
 async def contact_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     step = context.user_data.get("step")
@@ -531,40 +2606,538 @@ async def contact_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     phone = contact.phone_number if contact else None
     if step != "ask_phone" or not phone:
         return
-    normalized = normalize_phone(phone)
-    if not normalized:
-        await update.message.reply_text(
-            "❌ Telefon raqamingiz <code>+998XXXXXXXXX</code> formatida bo‘lishi kerak. Qayta yuboring.",
-            parse_mode=ParseMode.HTML,
-        )
+    lang = flow_language(context, update.effective_user)
+    normalized, error = check_phone(phone)
+    if error:
+        await show_prompt(update, context, tr(lang, "contact_invalid"))
         return
     context.user_data["phone"] = normalized
-    await update.message.reply_text("✔️ Qabul qilindi.", reply_markup=ReplyKeyboardRemove())
+    # The share-phone keyboard is one-time, so the client has already hidden it: no separate
+    # "received" message just to remove it. reply_keyboard stays set for a later name edit.
     await show_review(update, context)
 
 async def cancel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = flow_language(context, update.effective_user)
     context.user_data.clear()
+    await update.message.reply_text(tr(lang, "cancel_cmd"), reply_markup=ReplyKeyboardRemove())
+
+# ----------------------- Admin commands -----------------------
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    catalog = context.bot_data["catalogs"].current
+    await update.message.reply_text(build_stats_text(merged_stats(), catalog), parse_mode=ParseMode.HTML)
+
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    broadcast: Broadcast = context.bot_data["broadcast"]
+    args = update.message.text.partition(" ")[2].strip()
+    if args in ("status", "stop"):
+        if not broadcast.state:
+            await update.message.reply_text(tr(DEFAULT_LANGUAGE, "broadcast_idle"))
+            return
+        state = broadcast.state
+        if args == "stop":
+            broadcast.cancel()
+        await update.message.reply_text(
+            tr(
+                DEFAULT_LANGUAGE, "broadcast_stopped" if args == "stop" else "broadcast_progress",
+                sent=str(state["sent"]), failed=str(state["failed"]),
+            )
+        )
+        return
+
+    spec, sep, text = args.partition("|")
+    filters_: Dict[str, str] = {}
+    for item in spec.split():
+        name, _, value = item.partition("=")
+        if name not in BROADCAST_FILTERS or not value:
+            sep = ""
+            break
+        filters_[BROADCAST_FILTERS[name]] = value
+    if not sep or not text.strip() or len(text.strip()) > MessageLimit.MAX_TEXT_LENGTH:
+        await update.message.reply_text(tr(DEFAULT_LANGUAGE, "broadcast_usage"), parse_mode=ParseMode.HTML)
+        return
+    if broadcast.running:
+        await update.message.reply_text(tr(DEFAULT_LANGUAGE, "broadcast_busy"))
+        return
+    broadcast.start(context.bot, filters_, text.strip(), update.effective_chat.id)
+    await update.message.reply_text(tr(DEFAULT_LANGUAGE, "broadcast_started"))
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    fmt = (context.args[0].lower() if context.args else "csv")
+    if fmt not in ("csv", "parquet"):
+        await update.message.reply_text("Foydalanish: /export csv yoki /export parquet")
+        return
+    paths = registration_logs()
+    if not paths:
+        await update.message.reply_text("Hozircha ro‘yxatdan o‘tganlar yo‘q.")
+        return
+
+    stamp = datetime.now(tashkent_tz()).strftime("%Y%m%d-%H%M%S")
+    filename = f"registrations-{stamp}.csv.gz" if fmt == "csv" else f"registrations-{stamp}.parquet"
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            exporter = export_csv_gz if fmt == "csv" else export_parquet
+            parts = await asyncio.to_thread(exporter, paths, os.path.join(tmp, filename), int(EXPORT_PART_MB * 1e6))
+        except ImportError:
+            await update.message.reply_text("Parquet eksporti uchun pyarrow o‘rnatilmagan.")
+            return
+        for i, part in enumerate(parts, 1):
+            with open(part, "rb") as f:
+                await update.message.reply_document(
+                    f,
+                    filename=os.path.basename(part),
+                    caption=f"{i}/{len(parts)}-qism" if len(parts) > 1 else None,
+                    write_timeout=EXPORT_PART_MB,  # about a second per MB, for slow links
+                )
+
+async def find_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    filters_ = parse_crm_filters(context.args or [])
+    if filters_ is None:
+        await update.message.reply_text(
+            "Foydalanish: <code>/find [phone=+99890] [name=Ali] [course=english] [section=kids] "
+            "[from=2024-01-01] [to=2024-01-31]</code>\nFiltrsiz so‘zlar ism bo‘yicha qidiriladi.",
+            parse_mode=ParseMode.HTML,
+        )
+        return
+    store: RegistrantStore = context.bot_data["registrants"]
+    store.sync(registration_logs())  # other workers' logs may have grown since
+    searches: "OrderedDict[str, Dict[str, str]]" = context.bot_data["crm_searches"]
+    search_id = secrets.token_hex(4)
+    searches[search_id] = filters_
+    while len(searches) > CRM_SEARCHES:
+        searches.popitem(last=False)
+    rows, older = store.search(filters_, limit=CRM_PAGE)
     await update.message.reply_text(
-        "❌ Jarayon bekor qilindi. Qayta boshlash uchun /start bosing.", reply_markup=ReplyKeyboardRemove()
+        build_crm_page(rows, context.bot_data["catalogs"].current),
+        reply_markup=kb_crm_page(search_id, rows, False, older),
+        parse_mode=ParseMode.HTML,
+    )
+
+async def crm_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pages a /find result: ``crm:<search id>:<o|n>:<row id>`` for older/newer than that row."""
+    query = update.callback_query
+    if query.from_user.id != ADMIN_ID:
+        await query.answer()
+        return
+    _, search_id, direction, cursor = (query.data.split(":") + ["", "", ""])[:4]
+    filters_ = context.bot_data["crm_searches"].get(search_id)
+    if filters_ is None or direction not in ("o", "n") or not cursor.isdigit():
+        await query.answer("Qidiruv eskirgan, /find ni qayta yuboring.", show_alert=True)
+        return
+    await query.answer()
+    store: RegistrantStore = context.bot_data["registrants"]
+    if direction == "o":
+        rows, older = store.search(filters_, before=int(cursor), limit=CRM_PAGE)
+        newer = True
+    else:
+        rows, newer = store.search(filters_, after=int(cursor), limit=CRM_PAGE)
+        older = True
+    await query.edit_message_text(
+        build_crm_page(rows, context.bot_data["catalogs"].current),
+        reply_markup=kb_crm_page(search_id, rows, newer, older),
+        parse_mode=ParseMode.HTML,
     )
 
 # ----------------------- App bootstrap ------------
-def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+async def post_init(app: Application) -> None:
+    app.bot_data["outbox"].start(app.bot)
+    app.bot_data["catalogs"].start(CATALOG_RELOAD_INTERVAL)
+    # The first start after an upgrade imports the whole history; later ones only the tail.
+    await asyncio.to_thread(app.bot_data["registrants"].sync, registration_logs())
+    if app.bot_data["broadcast"].state:
+        logger.info("Resuming interrupted broadcast")
+        app.bot_data["broadcast"].start(app.bot)
+    port = app.bot_data["metrics_port"]
+    if port:
+        app.bot_data["metrics_server"] = await asyncio.start_server(serve_metrics, METRICS_HOST, port)
+        logger.info("Metrics on http://%s:%s/metrics", METRICS_HOST, port)
+
+async def post_stop(app: Application) -> None:
+    server = app.bot_data.pop("metrics_server", None)
+    if server:
+        server.close()
+        await server.wait_closed()
+    await app.bot_data["catalogs"].stop()
+    await app.bot_data["broadcast"].stop()
+    await app.bot_data["outbox"].stop(OUTBOX_DRAIN_TIMEOUT)
+    app.bot_data["registrations"].close()
+    app.bot_data["registrants"].close()
+
+def spill_path(name: str = "") -> str:
+    return os.path.join(DATA_DIR, f"pending_updates{name}.jsonl")
+
+def claim_instance_slot(directory: str) -> Tuple[str, Any]:
+    """Leases a file suffix that no other live process on ``directory`` holds; returns it and the lease.
+
+    Function runtimes start any number of instances on one DATA_DIR, and every append-only file
+    (outboxes, registration log and stats, broadcast state) needs a single writer. The lease is an
+    flock on instance-<n>.lock, dropped by the OS when the process goes away; the next cold start
+    takes the slot over and delivers whatever notifications its last holder left pending.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for n in itertools.count():
+        lease = open(os.path.join(directory, f"instance-{n}.lock"), "a")
+        try:
+            fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lease.close()
+            continue
+        return f"-i{n}", lease
+
+async def stop_gracefully(
+    app: Application, timeout: float, spill_to: str, grace: float = SHUTDOWN_GRACE,
+) -> None:
+    """Application.stop() with a deadline; intake (updater or worker queue) must already be stopped.
+
+    Fetched updates get ``timeout`` seconds to be handled. Those that have not started by then are
+    spilled to ``spill_to`` for requeue_spilled() on the next start; handlers already running get
+    ``grace`` seconds more and are then cancelled, and their updates logged as lost rather than spilled,
+    since running one again could repeat what it already did. Persistence is flushed by stop().
+    """
+    processor = app.update_processor
+    spilled: List[object] = []
+    try:
+        await asyncio.wait_for(app.update_queue.join(), timeout)
+    except asyncio.TimeoutError:
+        while not app.update_queue.empty():  # not even fetched yet
+            item = app.update_queue.get_nowait()
+            app.update_queue.task_done()
+            if isinstance(item, Update):
+                spilled.append(item)
+        if isinstance(processor, UserOrderedUpdateProcessor):
+            processor.hold()
+            try:
+                await asyncio.wait_for(app.update_queue.join(), grace)
+            except asyncio.TimeoutError:
+                running = processor.cancel_running()
+                logger.error("Shutdown grace passed: cancelling %d handlers still running", running)
+    await app.stop()
+    if isinstance(processor, UserOrderedUpdateProcessor):
+        spilled += processor.held
+        if processor.cancelled:
+            logger.error(
+                "Lost %d updates whose handlers were cancelled: %s",
+                len(processor.cancelled), [u.update_id for u in processor.cancelled if isinstance(u, Update)],
+            )
+    spilled = sorted((u for u in spilled if isinstance(u, Update)), key=lambda u: u.update_id)
+    if spilled:
+        with open(spill_to, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(u.to_dict(), ensure_ascii=False) + "\n" for u in spilled)
+        logger.warning("Drain deadline passed: spilled %d unstarted updates to %s", len(spilled), spill_to)
+
+async def requeue_spilled(app: Application) -> int:
+    """Feeds updates spilled by earlier shutdowns (any worker) back into a started application."""
+    count = 0
+    for path in sorted(glob.glob(spill_path("*"))):
+        with open(path, encoding="utf-8") as f:
+            lines = [line for line in f if line.endswith("\n")]
+        os.remove(path)
+        for line in lines:
+            await app.update_queue.put(Update.de_json(json.loads(line), app.bot))
+        count += len(lines)
+    if count:
+        logger.info("Requeued %d updates spilled by the previous shutdown", count)
+    return count
+
+async def serve(app: Application) -> None:
+    """run_webhook()/run_polling() with a bounded, lossless shutdown on SIGINT/SIGTERM.
+
+    Intake stops first; Telegram keeps undelivered updates until the next process sets the webhook
+    or polls again, so a restart delays updates rather than dropping them. Then the update queue is
+    drained (stop_gracefully) and post_stop flushes the notification outboxes.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    if WEBHOOK_URL:
+        await app.updater.start_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    await app.start()
+    try:
+        await requeue_spilled(app)
+        await stopping.wait()
+        logger.info("Shutting down: intake stopped, draining in-flight updates (up to %.0fs)", SHUTDOWN_TIMEOUT)
+    finally:
+        await app.updater.stop()
+        await stop_gracefully(app, SHUTDOWN_TIMEOUT, spill_path())
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+
+async def handle_update_once(app: Application, data: Dict[str, Any]) -> None:
+    """Handles one raw update to completion in an initialized build_application(oneshot=True) app.
+
+    For function runtimes that run a process per webhook call: the update is processed inline, then
+    the session is written back and admin notifications delivered before returning, because the
+    process may be frozen or discarded right after.
+    """
+    app.bot_data["catalogs"].reload_if_changed()
+    await app.process_update(Update.de_json(data, app.bot))
+    await app.update_persistence()
+    app.persistence.commit()
+    await app.bot_data["outbox"].drain(app.bot, OUTBOX_DRAIN_TIMEOUT)
+
+def build_application(
+    worker: int = 0,
+    workers: int = 1,
+    request: Optional[BaseRequest] = None,
+    processor: Optional[BaseUpdateProcessor] = None,
+    oneshot: bool = False,
+) -> Application:
+    # oneshot builds the lean variant for handle_update_once(): no updater, job queue or rate limiter,
+    # sessions read per update and the duplicate index loaded on first use.
+    ring = HashRing(workers) if workers > 1 else None
+    builder = Application.builder()
+    if BOT_API_URL:
+        builder = builder.base_url(f"{BOT_API_URL.rstrip('/')}/bot")
+    if oneshot:
+        builder = builder.updater(None).job_queue(None)
+    else:
+        # Outgoing calls wait for a free slot (and retry on 429) instead of failing when saturated.
+        builder = builder.rate_limiter(AIORateLimiter(overall_max_rate=GLOBAL_RATE / workers, max_retries=3))
+    if request is not None:
+        # Lets tools such as replay.py swap the HTTP layer for an in-process fake.
+        builder = builder.get_updates_request(request)
+    # getUpdates long polls would swamp the API latency histogram, so only the main request is wrapped.
+    main_request = InstrumentedRequest(request or HTTPXRequest(connection_pool_size=256))
+    builder = builder.request(main_request)
+    if oneshot and request is None:
+        # Nothing polls, and every HTTPXRequest builds its own TLS context (~30 ms): share the one.
+        builder = builder.get_updates_request(main_request)
+    app = (
+        builder
+        .token(BOT_TOKEN)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .concurrent_updates(processor if processor is not None else UserOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        .persistence(
+            SQLiteUserDataPersistence(
+                DATA_DIR,
+                shards=STATE_SHARDS,
+                ttl=STATE_TTL,
+                update_interval=STATE_FLUSH_INTERVAL,
+                owns=(lambda user_id: ring.lookup(user_id) == worker) if ring else None,
+                lazy=oneshot,
+            )
+        )
+        .context_types(ContextTypes(user_data=Session))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .build()
+    )
+    if not oneshot:
+        app.job_queue.run_repeating(reap_sessions, interval=REAPER_INTERVAL, first=REAPER_INTERVAL)
+    # Append-only files are per worker (or function instance) so processes never interleave writes.
+    suffix = f"-{worker}" if workers > 1 else ""
+    if oneshot:
+        suffix, app.bot_data["instance_lease"] = claim_instance_slot(DATA_DIR)
+    app.bot_data["outbox"] = NotificationRouter(
+        DATA_DIR,
+        parse_sinks(NOTIFY_SINKS),
+        suffix,
+        legacy=os.path.join(DATA_DIR, f"admin_outbox{suffix}.jsonl"),
+        workers=workers,
+    )
+    app.bot_data["registrations"] = RegistrationLog(
+        os.path.join(DATA_DIR, f"registrations{suffix}.csv"),
+        os.path.join(DATA_DIR, f"registration_stats{suffix}.json"),
+    )
+    app.bot_data["registered"] = RegistrationIndex(registration_logs)
+    if oneshot:
+        app.bot_data["registered"].defer_load()
+    else:
+        app.bot_data["registered"].load()
+    # Shared by all workers (SQLite serializes their imports); searches are per process.
+    app.bot_data["registrants"] = RegistrantStore(os.path.join(DATA_DIR, "registrants.sqlite3"))
+    app.bot_data["crm_searches"] = OrderedDict()
+    app.bot_data["user_limiter"] = UserRateLimiter(USER_RATE, USER_BURST, USER_IDLE_TTL)
+    app.bot_data["catalogs"] = CatalogStore(CATALOG_PATH)
+    app.bot_data["broadcast"] = Broadcast(os.path.join(DATA_DIR, f"broadcast{suffix}.json"))
+    app.bot_data["metrics_port"] = METRICS_PORT + worker if METRICS_PORT else 0
+
+    # Flood control runs before every other handler
+    app.add_handler(TypeHandler(Update, flood_guard), group=-1)
 
     # Commands
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("cancel", cancel_cmd))
+    app.add_handler(CommandHandler("start", instrumented("start", start)))
+    app.add_handler(CommandHandler("cancel", instrumented("cancel", cancel_cmd)))
+
+    # Admin commands
+    admin_only = filters.User(user_id=ADMIN_ID)
+    app.add_handler(CommandHandler("stats", instrumented("stats", stats_cmd), filters=admin_only))
+    app.add_handler(CommandHandler("export", instrumented("export", export_cmd), filters=admin_only))
+    app.add_handler(CommandHandler("broadcast", instrumented("broadcast", broadcast_cmd), filters=admin_only))
+    app.add_handler(CommandHandler("find", instrumented("find", find_cmd), filters=admin_only))
 
     # Callbacks
-    app.add_handler(CallbackQueryHandler(cb_handler))
+    app.add_handler(CallbackQueryHandler(instrumented("crm", crm_cb), pattern=r"^crm:"))
+    app.add_handler(CallbackQueryHandler(instrumented("callback", cb_handler)))
 
     # Messages
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
-    app.add_handler(MessageHandler(filters.CONTACT, contact_handler))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented("text", text_handler)))
+    app.add_handler(MessageHandler(filters.CONTACT, instrumented("contact", contact_handler)))
+    return app
 
-    logger.info("Bot is running...")
-    app.run_polling()
+# ----------------------- Worker pool ------------
+class HashRing:
+    """Consistent hash of user ids onto worker indexes (virtual nodes smooth the distribution)."""
+
+    def __init__(self, nodes: int, replicas: int = 160):
+        points = sorted(
+            (self._hash(f"worker-{node}-{r}"), node) for node in range(nodes) for r in range(replicas)
+        )
+        self._keys = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def lookup(self, user_id: int) -> int:
+        i = bisect.bisect(self._keys, self._hash(str(user_id))) % len(self._keys)
+        return self._nodes[i]
+
+def run_worker(index: int, workers: int, queue) -> None:
+    # The ingress process owns shutdown: it sends a None sentinel once it has stopped intake.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, workers, queue))
+
+async def _worker_loop(index: int, workers: int, queue) -> None:
+    # Spilled updates are requeued by the ingress, which routes them to whichever worker owns the user now.
+    app = build_application(worker=index, workers=workers)
+    loop = asyncio.get_running_loop()
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    logger.info("Worker %d started (pid %d)", index, os.getpid())
+    try:
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        await stop_gracefully(app, SHUTDOWN_TIMEOUT, spill_path(f"-{index}"))
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        logger.info("Worker %d stopped", index)
+
+class WorkerPool:
+    """Starts WORKERS processes, routes updates to them by user id and restarts any that die.
+
+    A worker that dies again within WORKER_MAX_BACKOFF s of starting is restarted after a delay that
+    doubles each time, up to WORKER_MAX_BACKOFF, instead of being respawned on every liveness check.
+    """
+
+    def __init__(self, workers: int):
+        import multiprocessing  # only the pool needs it
+
+        self.ring = HashRing(workers)
+        self._mp = multiprocessing.get_context("spawn")
+        self.queues = [self._mp.Queue() for _ in range(workers)]
+        self.procs: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._started = [0.0] * workers
+        self._crashes = [0] * workers
+        self._restart_at = [0.0] * workers  # 0 until a dead worker has been noticed
+        self._supervisor: Optional[asyncio.Task] = None
+
+    def _spawn(self, index: int) -> None:
+        proc = self._mp.Process(
+            target=run_worker, args=(index, len(self.queues), self.queues[index]), name=f"worker-{index}"
+        )
+        proc.start()
+        self.procs[index] = proc
+        self._started[index] = time.monotonic()
+
+    def route(self, update: Update) -> None:
+        user = update.effective_user
+        chat = update.effective_chat
+        key = user.id if user else chat.id if chat else 0
+        self.queues[self.ring.lookup(key)].put(update.to_dict())
+
+    async def _supervise(self) -> None:
+        while True:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            now = time.monotonic()
+            for index, proc in enumerate(self.procs):
+                if proc is None or proc.is_alive():
+                    continue
+                if not self._restart_at[index]:
+                    healthy = now - self._started[index] > WORKER_MAX_BACKOFF
+                    crashes = self._crashes[index] = 0 if healthy else self._crashes[index] + 1
+                    delay = min(WORKER_MAX_BACKOFF, WORKER_CHECK_INTERVAL * 2 ** crashes) if crashes else 0.0
+                    logger.error("Worker %d exited with code %s, restarting in %gs", index, proc.exitcode, delay)
+                    self._restart_at[index] = now + delay
+                if now >= self._restart_at[index]:
+                    self._restart_at[index] = 0.0
+                    self._spawn(index)
+
+    def start(self) -> None:
+        for index in range(len(self.queues)):
+            self._spawn(index)
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def stop(self) -> None:
+        if self._supervisor:
+            self._supervisor.cancel()
+        for queue in self.queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for index, proc in enumerate(self.procs):
+            await loop.run_in_executor(None, proc.join, WORKER_STOP_TIMEOUT)
+            if proc.is_alive():
+                logger.warning("Worker %d did not drain in time, terminating", index)
+                proc.terminate()
+
+async def forward_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.bot_data["pool"].route(update)
+
+async def ingress_post_init(app: Application) -> None:
+    app.bot_data["pool"].start()
+
+async def ingress_post_stop(app: Application) -> None:
+    await app.bot_data["pool"].stop()
+
+def build_ingress_application(workers: int) -> Application:
+    builder = Application.builder()
+    if BOT_API_URL:
+        builder = builder.base_url(f"{BOT_API_URL.rstrip('/')}/bot")
+    app = (
+        builder
+        .token(BOT_TOKEN)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .post_init(ingress_post_init)
+        .post_stop(ingress_post_stop)
+        .build()
+    )
+    app.bot_data["pool"] = WorkerPool(workers)
+    app.add_handler(TypeHandler(Update, forward_update))
+    return app
+
+def main():
+    app = build_ingress_application(WORKERS) if WORKERS > 1 else build_application()
+    if WEBHOOK_URL:
+        logger.info(
+            "Bot is running (webhook on %s:%s/%s, %d worker(s))...", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WORKERS
+        )
+    else:
+        logger.info("Bot is running (polling, %d worker(s))...", WORKERS)
+    asyncio.run(serve(app))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,2090 @@
+# replay.py
+# Offline replay harness for the ITeach registration bot.
+# Drives the real handlers from main.py with synthetic (or recorded) updates against an in-process
+# fake Bot API, then reports throughput, per-step latency percentiles and outbound API calls.
+# No network access or real token is needed.
+#
+#   python replay.py --users 2000 --concurrency 500
+#   python replay.py --users 100000 --concurrency 100000     # load test: 100k users mid-flow at once
+#   python replay.py --replay updates.jsonl        # one raw Telegram update (JSON) per line
+#   python replay.py --users 2000 --restart-at 0.5 --api-latency 1  # restart mid-stream, check none are lost
+#   python replay.py --users 500 --ordering --api-latency 5   # per-user ordering vs sequential, one user flooding
+#   python replay.py --users 2000 --prompts                   # calls per registration, new prompts vs edited in place
+#   python replay.py --users 300 --spam 100                   # legit users' latency while 100 users flood at 20/s
+#   python replay.py --broadcast 100000                       # /broadcast vs a throttling mock API, with a crash
+#   python replay.py --sessions 1000000                       # memory of 1M abandoned sessions, reaper passes
+#   python replay.py --crm-rows 1000000                       # /find query latency over 1M registrants
+#   python replay.py --export-rows 10000000                   # /export time, peak RSS and 50 MB parts at 10M
+#   python replay.py --validation 100000                      # validator corpus, fuzzing and ns/call vs before
+#   python replay.py --render 100                             # review/admin text cost, old builders vs templates
+#   python replay.py --keyboards 2000                         # markup cost per callback, built each time vs cached
+#   python replay.py --routes 200000                          # callback dispatch cost as routes are added
+#   python replay.py --index-rows 10000000                    # duplicate index load, lookups and memory at 10M
+#   python replay.py --users 500 --webhook-rate 300           # webhook (right/wrong secret) vs polling
+#   python replay.py --users 2000 --workers 4                 # throughput at 1, 2 and 4 worker processes
+#   python replay.py --cold-start 5                           # fresh-process startup and first reply
+#   python replay.py --confirm 300 --api-latency 50           # confirm tap with the admin send inline vs outbox
+#   python replay.py --outbox-recovery                        # outbox restart after a torn write; a rejected batch
+#   python replay.py --users 500 --sinks                      # admin fan-out with a webhook that is down, then slow
+
+import os
+import re
+import csv
+import sys
+import gc
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+import resource
+import socket
+import tracemalloc
+from urllib.parse import parse_qsl
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from itertools import chain, islice, zip_longest
+from typing import Optional, Dict, Any, List, Tuple, NamedTuple, Callable
+
+# Isolate state and lift production limits before main.py reads its config.
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="iteach-replay-"))
+os.environ.setdefault("BOT_TOKEN", "123456:replay")
+os.environ.setdefault("GLOBAL_RATE", "1000000")
+os.environ.setdefault("USER_BURST", "1000000")
+os.environ.setdefault("OUTBOX_CHAT_INTERVAL", "0")
+os.environ.setdefault("OUTBOX_RETRY_DELAY", "0.05")
+os.environ.setdefault("OUTBOX_BREAKER_COOLDOWN", "0.5")
+os.environ.setdefault("METRICS_PORT", "0")
+
+import main  # noqa: E402
+import httpx  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import SimpleUpdateProcessor, TypeHandler  # noqa: E402
+from telegram.request import BaseRequest, RequestData  # noqa: E402
+
+# Spread simulated users over the locales, plus a tag that falls back to the default language.
+LANGUAGE_CODES = ("uz", "ru", "en-US", "de")
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "ITeach", "username": "iteach_replay_bot"}
+
+# ----------------------- Fake Bot API -----------------------
+class FakeBotAPI(BaseRequest):
+    """Answers Bot API calls in-process and counts them per method."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._next_message_id: Counter = Counter()
+        self.last_message_id: Dict[int, int] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def next_message_id(self, chat_id: int) -> int:
+        # Like Telegram, the bot's and the user's messages share one id sequence per private chat.
+        self._next_message_id[chat_id] += 1
+        return self._next_message_id[chat_id]
+
+    def _message(self, chat_id: int, message_id: int, text: str = "") -> Dict[str, Any]:
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    def _result(self, api_method: str, params: Dict[str, Any]) -> Any:
+        if api_method == "getMe":
+            return BOT_USER
+        if api_method in ("sendMessage", "sendDocument"):
+            chat_id = int(params["chat_id"])
+            self.last_message_id[chat_id] = self.next_message_id(chat_id)
+            return self._message(chat_id, self.last_message_id[chat_id], params.get("text", ""))
+        if api_method == "editMessageText":
+            return self._message(int(params["chat_id"]), int(params["message_id"]), params.get("text", ""))
+        return True
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({"ok": True, "result": self._result(api_method, params)}).encode()
+
+class ThrottledBotAPI(FakeBotAPI):
+    """FakeBotAPI that answers sendMessage with 429 past ``rate`` messages a second, as Telegram does."""
+
+    def __init__(self, latency: float, rate: int):
+        super().__init__(latency)
+        self.rate = rate
+        self.throttled = 0
+        self.per_second: Counter = Counter()
+        self.received: Counter = Counter()  # chat id -> messages accepted
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None, **kwargs):
+        if url.endswith("/sendMessage"):
+            second = int(time.monotonic())
+            if self.per_second[second] >= self.rate:
+                self.throttled += 1
+                return 429, json.dumps({
+                    "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }).encode()
+            self.per_second[second] += 1
+            self.received[int(request_data.parameters["chat_id"])] += 1
+        return await super().do_request(url, method, request_data, **kwargs)
+
+# ----------------------- Synthetic updates -----------------------
+class UpdateFactory:
+    def __init__(self, api: FakeBotAPI):
+        self.api = api
+        self._update_id = 0
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    @staticmethod
+    def _user(uid: int) -> Dict[str, Any]:
+        lang = LANGUAGE_CODES[uid % len(LANGUAGE_CODES)]
+        return {"id": uid, "is_bot": False, "first_name": "Sim", "username": f"sim{uid}", "language_code": lang}
+
+    def message(self, uid: int, text: str) -> Dict[str, Any]:
+        update_id = self._next_id()
+        msg = {
+            "message_id": self.api.next_message_id(uid),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": self._user(uid),
+            "text": text,
+        }
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": msg}
+
+    def contact(self, uid: int, phone: str) -> Dict[str, Any]:
+        update_id = self._next_id()
+        msg = {
+            "message_id": self.api.next_message_id(uid),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": self._user(uid),
+            "contact": {"phone_number": phone, "first_name": "Sim", "user_id": uid},
+        }
+        return {"update_id": update_id, "message": msg}
+
+    def callback(self, uid: int, data: str) -> Dict[str, Any]:
+        message = self.api._message(uid, self.api.last_message_id.get(uid, 1))
+        return {
+            "update_id": self._next_id(),
+            "callback_query": {
+                "id": str(self._update_id),
+                "from": self._user(uid),
+                "chat_instance": str(uid),
+                "data": data,
+                "message": message,
+            },
+        }
+
+CATALOG = main.load_catalog(main.CATALOG_PATH)
+
+def funnel(rng: random.Random, uid: int) -> List[Tuple[str, str, str]]:
+    """One user's path through the flow as (step label, kind, payload) tuples."""
+    steps = [("/start", "msg", "/start"), ("start", "cb", "reg:start")]
+    course = rng.choice(list(CATALOG.courses))
+    if rng.random() < 0.15:
+        steps += [("course", "cb", f"reg:course:{course}"), ("back", "cb", "reg:back:courses")]
+        course = rng.choice(list(CATALOG.courses))
+    steps.append(("course", "cb", f"reg:course:{course}"))
+    if course in CATALOG.courses_with_level:
+        steps.append(("level", "cb", f"reg:level:{rng.choice(list(CATALOG.levels))}"))
+    steps.append(("section", "cb", f"reg:section:{rng.choice(list(CATALOG.sections[course]))}"))
+    if rng.random() < 0.05:
+        return steps  # walked away
+    if rng.random() < 0.2:
+        steps.append(("invalid", "msg", "ali"))
+    steps.append(("name", "msg", "Ali Valiyev"))
+    if rng.random() < 0.2:
+        steps.append(("invalid", "msg", "250"))
+    steps.append(("age", "msg", str(rng.randint(6, 60))))
+    phone = f"+99890{uid % 10_000_000:07d}"
+    if rng.random() < 0.2:
+        steps.append(("invalid", "msg", "12345"))
+    if rng.random() < 0.5:
+        steps.append(("phone", "contact", phone[1:]))
+    else:
+        steps.append(("phone", "msg", f"{phone[:4]} {phone[4:6]} {phone[6:9]}-{phone[9:11]}-{phone[11:]}"))
+    if rng.random() < 0.15:
+        steps += [("edit", "cb", "reg:edit"), ("edit", "cb", "reg:edit:name"), ("name", "msg", "Vali Aliyev")]
+        steps += [("age", "msg", "30"), ("phone", "contact", phone)]
+    steps.append(("confirm", "cb", "reg:confirm"))
+    return steps
+
+# ----------------------- Runner -----------------------
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.updates = 0
+        self.completed = 0
+
+    async def process(self, app, label: str, data: Dict[str, Any]) -> None:
+        update = Update.de_json(data, app.bot)
+        t0 = time.perf_counter()
+        await app.process_update(update)
+        self.latencies[label].append(time.perf_counter() - t0)
+        self.updates += 1
+        if label == "confirm":
+            self.completed += 1
+
+async def run_synthetic(app, api: FakeBotAPI, rec: Recorder, users: int, concurrency: int, seed: int) -> None:
+    factory = UpdateFactory(api)
+    rng = random.Random(seed)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run_user(uid: int, steps: List[Tuple[str, str, str]]) -> None:
+        async with sem:
+            for label, kind, payload in steps:
+                if kind == "cb":
+                    data = factory.callback(uid, payload)
+                elif kind == "contact":
+                    data = factory.contact(uid, payload)
+                else:
+                    data = factory.message(uid, payload)
+                await rec.process(app, label, data)
+
+    base = 10_000_000
+    await asyncio.gather(*(run_user(base + i, funnel(rng, base + i)) for i in range(users)))
+
+def label_for(data: Dict[str, Any]) -> str:
+    if "callback_query" in data:
+        cb = main.parse_callback(data["callback_query"].get("data") or "")
+        return cb.action if cb else "callback"
+    msg = data.get("message") or {}
+    if "contact" in msg:
+        return "phone"
+    text = msg.get("text") or ""
+    return text.split()[0] if text.startswith("/") else "text"
+
+async def run_recorded(app, rec: Recorder, path: str) -> None:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                data = json.loads(line)
+                await rec.process(app, label_for(data), data)
+
+def interleaved_stream(api: FakeBotAPI, users: int, seed: int) -> List[Dict[str, Any]]:
+    """Every user's funnel, interleaved as live traffic would be; each user's own updates stay in order."""
+    factory = UpdateFactory(api)
+    rng = random.Random(seed)
+    per_user = []
+    for i in range(users):
+        uid = 10_000_000 + i
+        per_user.append([
+            factory.callback(uid, payload) if kind == "cb"
+            else factory.contact(uid, payload) if kind == "contact"
+            else factory.message(uid, payload)
+            for _, kind, payload in funnel(rng, uid)
+        ])
+    return [data for data in chain.from_iterable(zip_longest(*per_user)) if data is not None]
+
+# ----------------------- Prompts -----------------------
+async def prompt_calls(args, edit_distance: int) -> Tuple[Counter, int]:
+    """Outbound calls by method for the synthetic funnel, with prompts edited up to edit_distance messages up."""
+    main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-prompts-")
+    main.PROMPT_EDIT_DISTANCE = edit_distance
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    app = main.build_application(request=api)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    rec = Recorder()
+    await run_synthetic(app, api, rec, args.users, args.concurrency, args.seed)
+    deadline = time.monotonic() + 10
+    while len(app.bot_data["outbox"]) and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    if app.post_stop:
+        await app.post_stop(app)
+    await app.shutdown()
+    return api.calls, rec.completed
+
+async def run_prompts(args) -> None:
+    """Calls per completed registration when every typed answer gets a new prompt vs when it edits one.
+
+    PROMPT_EDIT_DISTANCE=0 never edits after a typed answer, as the flow did before prompts were edited
+    in place; taps edited the tapped message before too.
+    """
+    configured = main.PROMPT_EDIT_DISTANCE
+    sends, sends_done = await prompt_calls(args, 0)
+    edits, edits_done = await prompt_calls(args, configured)
+    main.PROMPT_EDIT_DISTANCE = configured
+    print(f"completed registrations: {sends_done} and {edits_done}")
+    print(f"\n{'calls per registration':<24}{'new messages':>14}{f'edit (distance {configured})':>22}")
+    for name in sorted((set(sends) | set(edits)) - {"getMe"}, key=lambda n: -sends[n]):
+        print(f"  {name:<22}{sends[name] / max(sends_done, 1):>14.2f}{edits[name] / max(edits_done, 1):>22.2f}")
+    total_sends = sum(sends.values()) / max(sends_done, 1)
+    total_edits = sum(edits.values()) / max(edits_done, 1)
+    print(f"  {'total':<22}{total_sends:>14.2f}{total_edits:>22.2f}")
+    if sends_done != edits_done or total_edits > total_sends:
+        sys.exit(1)
+
+# ----------------------- Restart -----------------------
+async def start_app(api: FakeBotAPI, done: set, processor=None):
+    app = main.build_application(request=api, processor=processor)
+
+    async def record(update: Update, context) -> None:
+        done.add(update.update_id)
+
+    # The last group: an update is counted only once every handler before it has returned.
+    app.add_handler(TypeHandler(Update, record), group=sys.maxsize)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    return app
+
+async def stop_app(app, drain_timeout: float, grace: float = main.SHUTDOWN_GRACE) -> None:
+    await main.stop_gracefully(app, drain_timeout, main.spill_path(), grace)
+    if app.post_stop:
+        await app.post_stop(app)
+    await app.shutdown()
+
+def count_registrations() -> int:
+    with open(os.path.join(main.DATA_DIR, "registrations.csv"), encoding="utf-8") as f:
+        return sum(1 for _ in f) - 1
+
+async def run_restart(args, api: FakeBotAPI) -> None:
+    """Streams every user's updates through the update queue, restarting the application partway.
+
+    The first instance gets --drain-timeout to drain, so part of its backlog is spilled and must be
+    requeued by the second. Updates produced while neither is up wait, as Telegram would hold them.
+    The same stream is first run without the restart; both runs must handle every update to the
+    end and log the same registrations.
+    """
+    main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-restart-baseline-")
+    baseline_api = FakeBotAPI(api.latency)
+    stream = interleaved_stream(baseline_api, args.users, args.seed)
+    baseline_done: set = set()
+    app = await start_app(baseline_api, baseline_done, main.UserOrderedUpdateProcessor(args.concurrency))
+    for data in stream:
+        await app.update_queue.put(Update.de_json(data, app.bot))
+    await stop_app(app, 60)
+    baseline = count_registrations()
+
+    main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-restart-")
+    stream = interleaved_stream(api, args.users, args.seed)
+    cut = int(len(stream) * args.restart_at)
+    done: set = set()
+    t0 = time.perf_counter()
+    app = await start_app(api, done, main.UserOrderedUpdateProcessor(args.concurrency))
+    for data in stream[:cut]:
+        await app.update_queue.put(Update.de_json(data, app.bot))
+    t1 = time.perf_counter()
+    await stop_app(app, args.drain_timeout, args.drain_grace)
+    cancelled = len(app.update_processor.cancelled)
+    app = await start_app(api, done, main.UserOrderedUpdateProcessor(args.concurrency))
+    requeued = await main.requeue_spilled(app)
+    t2 = time.perf_counter()
+    for data in stream[cut:]:
+        await app.update_queue.put(Update.de_json(data, app.bot))
+    await stop_app(app, 60)
+    wall = time.perf_counter() - t0
+
+    ids = {data["update_id"] for data in stream}
+    lost = len(ids - done)
+    registered = count_registrations()
+    print(f"updates: {len(stream)}  restart after: {cut}  requeued from spill: {requeued}  cancelled: {cancelled}")
+    print(f"handled to the end: {len(done & ids)} (without the restart: {len(baseline_done & ids)})  lost: {lost}")
+    print(f"registrations logged: {registered} (without the restart: {baseline})")
+    print(f"restart took {(t2 - t1) * 1000:.0f} ms, wall {wall:.2f}s, outbound API calls: {sum(api.calls.values())}")
+    if lost or done != baseline_done or registered != baseline:
+        sys.exit(1)
+
+# ----------------------- Ordering -----------------------
+class Ordered(NamedTuple):
+    wall: float
+    violations: int  # a user's update started before an earlier one of theirs
+    overlaps: int  # ... or while another of theirs was still running
+    registered: int
+    waits: List[float]  # queue-to-start seconds of every other user's first update
+
+async def run_ordered(api: FakeBotAPI, stream: List[Dict[str, Any]], processor, flooder: int) -> Ordered:
+    """Pushes the stream through the update queue and checks when PTB actually starts each update."""
+    main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-ordering-")
+    app = await start_app(api, set(), processor)
+    last: Dict[int, int] = {}
+    running: Counter = Counter()
+    queued_at: Dict[int, float] = {}
+    waits: List[float] = []
+    violations = overlaps = 0
+    process_update = app.process_update
+
+    async def checked(update) -> None:
+        nonlocal violations, overlaps
+        owner = main.update_owner(update)
+        if owner != flooder and owner not in last:
+            waits.append(time.perf_counter() - queued_at[update.update_id])
+        if owner in last and update.update_id < last[owner]:
+            violations += 1
+        last[owner] = update.update_id
+        running[owner] += 1
+        if running[owner] > 1:
+            overlaps += 1
+        try:
+            await process_update(update)
+        finally:
+            running[owner] -= 1
+
+    app.process_update = checked  # the update fetcher looks this up on the instance
+    t0 = time.perf_counter()
+    for data in stream:
+        queued_at[data["update_id"]] = time.perf_counter()
+        await app.update_queue.put(Update.de_json(data, app.bot))
+    await app.update_queue.join()
+    wall = time.perf_counter() - t0
+    await stop_app(app, 60)
+    with open(os.path.join(main.DATA_DIR, "registrations.csv"), encoding="utf-8") as f:
+        registered = sum(1 for _ in f) - 1
+    return Ordered(wall, violations, overlaps, registered, sorted(waits))
+
+async def run_ordering(args, api: FakeBotAPI) -> None:
+    """Same interleaved stream, handled sequentially, concurrently without ordering, and per-user ordered.
+
+    With --flood N one more user's N reg:start taps are queued ahead of everyone else; how long the
+    other users' first updates wait to start shows whether that backlog holds up anybody but its sender.
+    """
+    stream = interleaved_stream(api, args.users, args.seed)
+    flooder = 9_999_999
+    if args.flood:
+        factory = UpdateFactory(api)
+        factory._update_id = -args.flood  # ids stay unique and in queue order
+        stream = [factory.callback(flooder, "reg:start") for _ in range(args.flood)] + stream
+    modes = [
+        ("sequential", main.UserOrderedUpdateProcessor(1)),
+        ("concurrent", SimpleUpdateProcessor(args.concurrency)),
+        ("per-user", main.UserOrderedUpdateProcessor(args.concurrency)),
+    ]
+    print(f"updates: {len(stream)} from {args.users} users + {args.flood} flood taps, concurrency {args.concurrency}")
+    print(
+        f"\n{'mode':<12}{'wall s':>8}{'updates/s':>11}{'reordered':>11}{'overlaps':>10}{'registered':>12}"
+        f"{'first-update wait p50':>23}{'p99':>8}{'max ms':>8}"
+    )
+    results: Dict[str, Ordered] = {}
+    for name, processor in modes:
+        r = results[name] = await run_ordered(api, stream, processor, flooder)
+        print(
+            f"{name:<12}{r.wall:>8.2f}{len(stream) / r.wall:>11.0f}{r.violations:>11}{r.overlaps:>10}"
+            f"{r.registered:>12}{percentile(r.waits, 0.5) * 1000:>23.1f}{percentile(r.waits, 0.99) * 1000:>8.1f}"
+            f"{r.waits[-1] * 1000:>8.1f}"
+        )
+    ordered = results["per-user"]
+    failed = bool(ordered.violations or ordered.overlaps or results["sequential"].overlaps)
+    failed |= any(len(processor) for _, processor in modes if isinstance(processor, main.UserOrderedUpdateProcessor))
+    # Ordering may cost other users a little queueing, but never the flooder's backlog.
+    failed |= percentile(ordered.waits, 0.99) > 2 * percentile(results["concurrent"].waits, 0.99) + 0.05
+    if failed:
+        sys.exit(1)
+
+# ----------------------- Flood -----------------------
+class Flooded(NamedTuple):
+    latencies: List[float]  # scheduled send to handled, every legitimate update that was handled
+    registered: int
+    throttled_legit: int
+    spam_sent: int
+    spam_handled: int  # spam updates that got past the flood guard
+    api_calls: int  # outbound API calls during the run
+    wall: float
+
+def flood_timeline(
+    api: FakeBotAPI, legit: int, spammers: int, spam_rate: float, pace: float, seed: int
+) -> List[Tuple[float, Dict[str, Any]]]:
+    """(send at, update) for every user: legitimate ones a funnel step per ``pace`` s, spammers ``spam_rate``/s."""
+    factory = UpdateFactory(api)
+    rng = random.Random(seed)
+    timeline = []
+    for i in range(legit):
+        uid = 10_000_000 + i
+        at = rng.random() * pace
+        for _, kind, payload in funnel(rng, uid):
+            data = (
+                factory.callback(uid, payload) if kind == "cb"
+                else factory.contact(uid, payload) if kind == "contact"
+                else factory.message(uid, payload)
+            )
+            timeline.append((at, data))
+            at += pace
+    end = max(at for at, _ in timeline)
+    for i in range(spammers):
+        uid = 9_000_000 + i
+        at = rng.random() / spam_rate
+        while at < end:
+            timeline.append((at, factory.message(uid, "/start") if uid % 2 else factory.callback(uid, "reg:start")))
+            at += 1 / spam_rate
+    timeline.sort(key=lambda item: item[0])
+    return timeline
+
+async def run_flooded(
+    api: FakeBotAPI, timeline: List[Tuple[float, Dict[str, Any]]], guarded: bool
+) -> Flooded:
+    """Feeds the timeline into the update queue on schedule, as Telegram would, whether or not the bot keeps up."""
+    main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-flood-")
+    app = await start_app(api, set())
+    handled: Dict[int, float] = {}
+
+    async def stamp(update: Update, context) -> None:
+        handled[update.update_id] = time.perf_counter()
+
+    # start_app's counter already has the last group, and only one handler per group runs.
+    app.add_handler(TypeHandler(Update, stamp), group=sys.maxsize - 1)
+    limiter = app.bot_data["user_limiter"]
+    if not guarded:
+        limiter.burst = float("inf")
+    denied: Counter = Counter()
+    allow = limiter.allow
+
+    def counting(user_id: int) -> bool:
+        if allow(user_id):
+            return True
+        denied[user_id] += 1
+        return False
+
+    limiter.allow = counting
+    calls_before = sum(api.calls.values())
+    sent_at: Dict[int, float] = {}
+    t0 = time.perf_counter()
+    for at, data in timeline:
+        delay = t0 + at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sent_at[data["update_id"]] = t0 + at
+        await app.update_queue.put(Update.de_json(data, app.bot))
+    await stop_app(app, 600)
+    wall = time.perf_counter() - t0
+    legit = [data["update_id"] for _, data in timeline if (data.get("message") or data.get("callback_query"))["from"]["id"] >= 10_000_000]
+    spam = len(timeline) - len(legit)
+    return Flooded(
+        sorted(handled[i] - sent_at[i] for i in legit if i in handled),
+        count_registrations(),
+        sum(n for uid, n in denied.items() if uid >= 10_000_000),
+        spam,
+        spam - sum(n for uid, n in denied.items() if uid < 10_000_000),
+        sum(api.calls.values()) - calls_before,
+        wall,
+    )
+
+async def run_spam(args, api: FakeBotAPI) -> None:
+    """Legitimate users' latency with --spam users flooding, without and with the per-user flood guard.
+
+    Without the guard every spam update is handled, so once the flood exceeds what the bot can handle the
+    backlog grows and everyone's latency with it; with it, the rejected ones cost next to nothing.
+    """
+    # The production limits; replay lifts them for the other modes.
+    main.USER_RATE, main.USER_BURST = 1.0, 5.0
+    # A step every 1.2 s stays under USER_RATE after the burst, so no legitimate update should be throttled.
+    pace = 1.2 / main.USER_RATE
+    print(
+        f"{args.users} users at one update per {pace:.1f} s, {args.spam} spammers at {args.spam_rate:g}/s each;"
+        f" USER_RATE {main.USER_RATE:g}/s, USER_BURST {main.USER_BURST:g}"
+    )
+    print(
+        f"\n{'run':<16}{'legit p50 ms':>13}{'p99':>9}{'max':>9}{'registered':>12}{'throttled':>11}"
+        f"{'spam sent':>11}{'handled':>9}{'API calls':>11}{'wall s':>8}"
+    )
+    results: Dict[str, Flooded] = {}
+    for name, spammers, guarded in (("quiet", 0, True), ("spam, no guard", args.spam, False), ("spam, guard", args.spam, True)):
+        timeline = flood_timeline(api, args.users, spammers, args.spam_rate, pace, args.seed)
+        r = results[name] = await run_flooded(api, timeline, guarded)
+        print(
+            f"{name:<16}{percentile(r.latencies, 0.5) * 1000:>13.2f}{percentile(r.latencies, 0.99) * 1000:>9.2f}"
+            f"{r.latencies[-1] * 1000:>9.2f}{r.registered:>12}{r.throttled_legit:>11}{r.spam_sent:>11}"
+            f"{r.spam_handled:>9}{r.api_calls:>11}{r.wall:>8.1f}"
+        )
+    quiet, guarded = results["quiet"], results["spam, guard"]
+    # Rejecting spam is not free (a throttled tap is still answered), but it must not build a backlog:
+    # legitimate users' tail may grow by a bounded amount, however long the flood lasts.
+    if guarded.throttled_legit or guarded.registered < quiet.registered:
+        sys.exit(1)
+    if percentile(guarded.latencies, 0.99) > percentile(quiet.latencies, 0.99) + 0.5:
+        sys.exit(1)
+
+# ----------------------- Broadcast -----------------------
+async def run_broadcast(args) -> None:
+    """/broadcast to --broadcast past registrants through a mock API that throttles like Telegram.
+
+    The bot's own limiter is set to the mock's rate. Partway through, the broadcast is stopped as a
+    crash would stop it, another worker appends registrations, and a fresh Broadcast resumes from the
+    checkpoint. Every original registrant must get the message, repeats are bounded by one page,
+    and the newcomers get nothing.
+    """
+    main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-broadcast-")
+    main.GLOBAL_RATE = args.broadcast_rate
+    n, first = args.broadcast, 20_000_000
+    logs = [os.path.join(main.DATA_DIR, f"registrations-{i}.csv") for i in range(2)]
+    write_registrations(logs[0], n // 2, args.seed, first)
+    write_registrations(logs[1], n - n // 2, args.seed + 1, first + n // 2)
+    api = ThrottledBotAPI(args.api_latency / 1000, args.broadcast_rate)
+    app = main.build_application(request=api)
+    await app.initialize()
+    path = os.path.join(main.DATA_DIR, "broadcast.json")
+
+    t0 = time.perf_counter()
+    broadcast = main.Broadcast(path)
+    broadcast.start(app.bot, {}, "Yangi guruh ochildi!", main.ADMIN_ID)
+    while sum(api.received.values()) < n * 0.4:
+        await asyncio.sleep(0.01)
+    await broadcast.stop()  # only the checkpoint on disk survives
+    crashed_at = sum(api.received.values())
+    newcomers = os.path.join(main.DATA_DIR, "newcomers.csv")
+    write_registrations(newcomers, 1000, args.seed + 2, 30_000_000)
+    with open(newcomers, encoding="utf-8") as src, open(logs[0], "a", encoding="utf-8") as dst:
+        dst.writelines(islice(src, 1, None))
+    resumed = main.Broadcast(path)
+    resumed.start(app.bot)
+    await resumed._task
+    wall = time.perf_counter() - t0
+    await app.shutdown()
+
+    received = {chat: count for chat, count in api.received.items() if chat != main.ADMIN_ID}
+    expected = range(first, first + n)
+    missing = sum(1 for chat in expected if chat not in received)
+    extra = sum(1 for chat in received if chat not in expected)
+    repeats = sum(count - 1 for count in received.values())
+    busiest = max(api.per_second.values())
+    print(f"recipients: {n} in 2 logs  mock API limit: {args.broadcast_rate} msg/s  stopped after: {crashed_at}")
+    print(f"wall {wall:.1f}s  {sum(received.values()) / wall:.0f} msg/s  busiest second: {busiest}  429s: {api.throttled}")
+    left = os.path.exists(path)
+    print(f"missing: {missing}  repeated: {repeats} (page {main.BROADCAST_PAGE})  sent to newcomers: {extra}")
+    print(f"admin report: {api.received[main.ADMIN_ID]}  checkpoint left: {'yes' if left else 'no'}")
+    if missing or extra or repeats > main.BROADCAST_PAGE or left or api.received[main.ADMIN_ID] != 1:
+        sys.exit(1)
+
+# ----------------------- Abandoned sessions -----------------------
+async def abandoned_sessions(app, api: FakeBotAPI, users: int, seed: int) -> List[Any]:
+    """Runs ``users`` real funnels up to a random step short of confirming; returns their sessions."""
+    factory = UpdateFactory(api)
+    rng = random.Random(seed)
+    sessions = []
+    for i in range(users):
+        uid = 10_000_000 + i
+        steps = funnel(rng, uid)
+        for _, kind, payload in steps[:rng.randrange(2, len(steps))]:
+            data = (
+                factory.callback(uid, payload) if kind == "cb"
+                else factory.contact(uid, payload) if kind == "contact"
+                else factory.message(uid, payload)
+            )
+            await app.process_update(Update.de_json(data, app.bot))
+        sessions.append(app.user_data[uid])
+    return sessions
+
+def traced_mb() -> float:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] / 1e6
+
+async def run_sessions(args, api: FakeBotAPI) -> None:
+    """Memory of --sessions abandoned sessions as Session slots vs. plain dicts, then reaper passes over them.
+
+    A sample of real half-finished flows is copied to every simulated user. "season" spreads their last
+    activity over 30 days (the TTL drops most, the rest get a reminder); "burst" puts it all in the last
+    few minutes, so only the SESSION_MAX cap applies.
+    """
+    main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-sessions-")
+    app = main.build_application(request=api)
+    await app.initialize()
+    sample = await abandoned_sessions(app, api, min(args.sessions, 1000), args.seed)
+    templates = [{k: getattr(s, k) for k in main.Session.FIELDS if getattr(s, k) is not None} for s in sample]
+    for uid in list(app.user_data):
+        app.drop_user_data(uid)
+    await app.update_persistence()
+    n = args.sessions
+    base = 20_000_000
+    print(f"sessions: {n}, copied from {len(templates)} real abandoned flows")
+    print(f"TTL {main.SESSION_TTL / 3600:g} h, reminder after {main.SESSION_REMIND_AFTER / 3600:g} h, cap {main.SESSION_MAX}")
+
+    tracemalloc.start()
+    print(f"\n{'held as':<18}{'MB':>8}{'bytes/session':>15}")
+    before = traced_mb()
+    dicts = {base + i: dict(templates[i % len(templates)]) for i in range(n)}
+    as_dicts = traced_mb() - before
+    del dicts
+    print(f"{'dict':<18}{as_dicts:>8.1f}{as_dicts * 1e6 / n:>15.0f}")
+
+    rng = random.Random(args.seed)
+    failed = False
+    for scenario, spread in (("season", 30 * 86400), ("burst", 300)):
+        before = traced_mb()
+        now = time.time()
+        for i in range(n):
+            session = main.Session.from_dict(templates[i % len(templates)])
+            session.last_seen = now - rng.uniform(0, spread)
+            app._user_data[base + i] = session  # what PTB's defaultdict does on first access
+        held = traced_mb() - before
+        if scenario == "season":
+            print(f"{'Session (slots)':<18}{held:>8.1f}{held * 1e6 / n:>15.0f}")
+            print(f"\n{'reaper pass':<12}{'seconds':>9}{'flush s':>9}{'dropped':>9}{'reminded':>10}{'left':>8}{'MB left':>9}")
+        reminders = api.calls["sendMessage"]
+        t0 = time.perf_counter()
+        await main.reap_sessions(SimpleNamespace(application=app, bot=app.bot))
+        t1 = time.perf_counter()
+        await app.update_persistence()
+        await asyncio.sleep(0.1)  # the persistence commit is scheduled for the next loop iteration
+        t2 = time.perf_counter()
+        left = len(app.user_data)
+        print(
+            f"{scenario:<12}{t1 - t0:>9.2f}{t2 - t1:>9.2f}{n - left:>9}{api.calls['sendMessage'] - reminders:>10}"
+            f"{left:>8}{traced_mb() - before:>9.1f}"
+        )
+        failed |= left > main.SESSION_MAX
+        for uid in list(app.user_data):
+            app.drop_user_data(uid)
+        await app.update_persistence()
+        await asyncio.sleep(0.1)
+    tracemalloc.stop()
+    await app.shutdown()
+    if failed:
+        sys.exit(1)
+
+# ----------------------- Validation -----------------------
+# The validators check_full_name/check_age/check_phone replaced, kept for comparison.
+def baseline_valid_full_name(s: str) -> bool:
+    s = s.strip()
+    parts = s.split()
+    if not (2 <= len(parts) <= 5):
+        return False
+    for p in parts:
+        letters = [ch for ch in p if ch.isalpha()]
+        if len(letters) < 2:
+            return False
+    return True
+
+def baseline_valid_age(s: str) -> bool:
+    if not s.isdigit():
+        return False
+    n = int(s)
+    return 3 <= n <= 100
+
+BASELINE_PHONE_REGEX = re.compile(r"^\+998\d{9}$")
+
+def baseline_normalize_phone(text: str) -> Optional[str]:
+    t = text.strip()
+    if t.startswith("+"):
+        t = "+" + re.sub(r"[^\d]", "", t[1:])
+    else:
+        t = re.sub(r"[^\d]", "", t)
+    if t.startswith("998") and len(t) == 12:
+        t = "+" + t
+    if BASELINE_PHONE_REGEX.match(t):
+        return t
+    return None
+
+# (input, normalized value or rejection reason)
+NAME_CORPUS = (
+    ("Ali Valiyev", "Ali Valiyev"),
+    ("  Gʻayrat   Oʻrinov ", "Gʻayrat Oʻrinov"),
+    ("O'tkir Hoshimov", "O'tkir Hoshimov"),
+    ("Sa’dulla Karimov", "Sa’dulla Karimov"),
+    ("Abdul-Aziz Karimov", "Abdul-Aziz Karimov"),
+    ("Ўткир Ҳошимов", "Ўткир Ҳошимов"),
+    ("Ольга Иванова-Петрова", "Ольга Иванова-Петрова"),
+    ("Jürgen Müller", "Jürgen Müller"),
+    ("Ju\u0308rgen Mu\u0308ller", "Jürgen Müller"),
+    ("Әлихан Нұрланов", "Әлихан Нұрланов"),
+    ("Ali", "name_words"),
+    ("a b c d e f", "name_words"),
+    ("Ali 123", "name_chars"),
+    ("Ali V", "name_chars"),
+    ("ʻʻ Ali", "name_chars"),
+    ("Ali-- Vali", "name_chars"),
+    ("Ali_Vali Karim", "name_chars"),
+    ("<b>Ali</b> Vali", "name_chars"),
+    ("Ali 😀Vali", "name_chars"),
+    ("Ali " + "Valiyev" * 20, "name_length"),
+)
+AGE_CORPUS = (
+    ("25", 25), (" 7 ", 7), ("3", 3), ("100", 100), ("2", "age_range"), ("101", "age_range"),
+    ("0025", "age_format"), ("٢٥", "age_format"), ("25 yosh", "age_format"), ("-5", "age_format"), ("", "age_format"),
+)
+PHONE_CORPUS = (
+    ("+998 90 123-45-67", "+998901234567"),
+    ("998901234567", "+998901234567"),
+    ("901234567", "+998901234567"),
+    ("8 90 123 45 67", "+998901234567"),
+    ("(90) 123-45-67", "+998901234567"),
+    ("+998.90.123.45.67", "+998901234567"),
+    ("+7 912 345 67 89", "phone_country"),
+    ("+99890123456", "phone_length"),
+    ("12345", "phone_length"),
+    ("+998 90 abc 45 67", "phone_chars"),
+    ("+998９０1234567", "phone_chars"),
+    ("٩٩٨٩٠١٢٣٤٥٦٧", "phone_chars"),
+)
+FUZZ_ALPHABET = "abzAZÜüöʻʼ'’‘`-  .()+0123456789٣９АяЁўқғҳӘәұ_\t\u0308😀<>&"
+PHONE_RESULT = re.compile(r"\+998[0-9]{9}")
+
+def fuzz_inputs(rng: random.Random, seeds: List[str], n: int):
+    """Random strings over FUZZ_ALPHABET, and corpus entries with one character inserted, dropped or replaced."""
+    for i in range(n):
+        if i % 2:
+            yield "".join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(0, 24)))
+            continue
+        s = rng.choice(seeds)
+        pos = rng.randint(0, len(s))
+        op = rng.randrange(3)
+        c = rng.choice(FUZZ_ALPHABET)
+        yield s[:pos] + c + s[pos:] if op == 0 else s[:pos] + s[pos + 1:] if op == 1 else s[:pos] + c + s[pos + 1:]
+
+def check_properties(kind: str, text: str, value: Any, reason: Optional[str]) -> Optional[str]:
+    """What is wrong with a validator's (value, reason) for ``text``, or None."""
+    if (value is None) == (reason is None):
+        return "value and reason both set or both missing"
+    if value is None:
+        return None if f"err_{reason}" in main.LOCALES[main.DEFAULT_LANGUAGE] else f"unknown reason {reason}"
+    if kind == "phone" and not PHONE_RESULT.fullmatch(value):
+        return f"accepted as {value!r}"
+    if kind == "age" and not 3 <= value <= 100:
+        return f"accepted as {value!r}"
+    if kind == "name" and (
+        value != " ".join(value.split()) or not 2 <= len(value.split()) <= 5 or len(value) > main.NAME_MAX_LENGTH
+        or any(ch.isdigit() or ch in "_<>&" for ch in value)
+    ):
+        return f"accepted as {value!r}"
+    return None
+
+def ns_per_call(fn: Callable[[str], Any], inputs: List[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(5):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            for s in inputs:
+                fn(s)
+        best = min(best, time.perf_counter() - t0)
+    return best / (repeat * len(inputs)) * 1e9
+
+def run_validation(args) -> None:
+    """The input validators against a fixed corpus, a seeded fuzz run and the functions they replaced."""
+    validators = (
+        ("name", main.check_full_name, baseline_valid_full_name, NAME_CORPUS),
+        ("age", main.check_age, baseline_valid_age, AGE_CORPUS),
+        ("phone", main.check_phone, baseline_normalize_phone, PHONE_CORPUS),
+    )
+    rng = random.Random(args.seed)
+    failures: List[str] = []
+    print(f"fuzz: {args.validation} inputs per validator, seed {args.seed}")
+    print(f"\n{'validator':<10}{'corpus':>8}{'fuzz':>8}{'accepts, was rejected':>23}{'rejects, was accepted':>23}")
+    for kind, check, baseline, corpus in validators:
+        for text, expected in corpus:
+            value, reason = check(text)
+            if (value if value is not None else reason) != expected:
+                failures.append(f"{kind} {text!r}: {value if value is not None else reason!r}, expected {expected!r}")
+        passed = len(corpus) - sum(f.startswith(kind + " ") for f in failures)
+        broken = newly_accepted = newly_rejected = 0
+        examples: Dict[str, str] = {}
+        for text in fuzz_inputs(rng, [text for text, _ in corpus], args.validation):
+            try:
+                value, reason = check(text)
+            except Exception as e:  # noqa: BLE001 - any exception is a finding
+                value, reason, problem = None, None, f"raised {e!r}"
+            else:
+                problem = check_properties(kind, text, value, reason)
+            if problem:
+                broken += 1
+                failures.append(f"{kind} {text!r}: {problem}")
+            was = baseline(text)
+            if value is not None and not was:
+                newly_accepted += 1
+                examples.setdefault("accepts", text)
+            elif value is None and was:
+                newly_rejected += 1
+                examples.setdefault("rejects", text)
+        print(
+            f"{kind:<10}{f'{passed}/{len(corpus)}':>8}{'ok' if not broken else f'{broken} bad':>8}"
+            f"{newly_accepted:>23}{newly_rejected:>23}"
+        )
+        for what, text in examples.items():
+            print(f"    e.g. {what} {text!r} (was {baseline(text)!r})")
+
+    print(f"\n{'validator':<10}{'before ns/call':>16}{'now ns/call':>13}  over the corpus inputs")
+    for kind, check, baseline, corpus in validators:
+        inputs = [text for text, _ in corpus]
+        before = ns_per_call(baseline, inputs, args.validation_repeat)
+        now = ns_per_call(check, inputs, args.validation_repeat)
+        print(f"{kind:<10}{before:>16.0f}{now:>13.0f}")
+    for failure in failures[:20]:
+        print("FAIL", failure)
+    if failures:
+        sys.exit(1)
+
+# ----------------------- Rendering -----------------------
+# The f-string builders the locale templates replaced: every field escaped on every render.
+def baseline_build_review_text(d: Dict[str, Any]) -> str:
+    esc = main.esc
+    course_label = esc(CATALOG.courses.get(d.get("course_key", ""), d.get("course_label", "")))
+    level_label = esc(d.get("level_label", "") or "")
+    section_label = esc(d.get("section_label", ""))
+    full_name = esc(d.get("full_name", ""))
+    age = esc(d.get("age", ""))
+    phone = esc(d.get("phone", ""))
+
+    lines = [
+        "🧾 <b>Ma’lumotlarni ko‘rib chiqing:</b>",
+        f"• 📚 <b>Kurs:</b> {course_label}",
+    ]
+    if d.get("course_key") in CATALOG.courses_with_level and level_label:
+        lines.append(f"• 📊 <b>Daraja:</b> {level_label}")
+    lines += [
+        f"• 🗂 <b>Bo‘lim:</b> {section_label}",
+        f"• 👤 <b>Ism familiya:</b> {full_name}",
+        f"• 🎂 <b>Yosh:</b> {age}",
+        f"• 📱 <b>Telefon:</b> {phone}",
+    ]
+    return "\n".join(lines)
+
+def baseline_build_admin_text(d: Dict[str, Any], u) -> str:
+    esc = main.esc
+    course_label = esc(CATALOG.courses.get(d.get("course_key", ""), d.get("course_label", "")))
+    level_label = esc(d.get("level_label", "") or "")
+    section_label = esc(d.get("section_label", ""))
+    full_name = esc(d.get("full_name", ""))
+    age = esc(d.get("age", ""))
+    phone = esc(d.get("phone", ""))
+
+    username = esc(f"@{u.username}") if getattr(u, "username", None) else esc("@None")
+    tz = main.tashkent_tz()
+    tnow = datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S") if tz else datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+    lines = [
+        "🔔 <b>Yangi o‘quvchi ro‘yxatdan o‘tdi</b>",
+        f"👤 <b>Ism:</b> {full_name}",
+        f"🎂 <b>Yosh:</b> {age}",
+        f"📱 <b>Telefon:</b> {phone}",
+        f"📚 <b>Kurs:</b> {course_label}",
+        f"🗂 <b>Bo‘lim:</b> {section_label}",
+    ]
+    if d.get("course_key") in CATALOG.courses_with_level and level_label:
+        lines.append(f"📊 <b>Daraja:</b> {level_label}")
+
+    lines += [
+        f"🆔 <b>Telegram ID:</b> {esc(getattr(u, 'id', ''))}",
+        f"👤 <b>Username:</b> {username}",
+        f"📅 <b>Sana:</b> {tnow} (Asia/Tashkent)",
+    ]
+    return "\n".join(lines)
+
+def review_sessions(rng: random.Random, n: int) -> List[Dict[str, Any]]:
+    """Completed registrations as the review/confirm steps see them; some names need escaping."""
+    sessions = []
+    for i in range(n):
+        course = rng.choice(list(CATALOG.courses))
+        section = rng.choice(list(CATALOG.sections[course]))
+        d = {
+            "course_key": course, "course_label": CATALOG.courses[course],
+            "section_key": section, "section_label": CATALOG.sections[course][section],
+            "full_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" + (" <b>&" if i % 10 == 0 else ""),
+            "age": rng.randint(6, 60), "phone": f"+99890{rng.randrange(10_000_000):07d}",
+        }
+        if course in CATALOG.courses_with_level:
+            d["level_key"] = rng.choice(list(CATALOG.levels))
+            d["level_label"] = CATALOG.levels[d["level_key"]]
+        sessions.append(d)
+    return sessions
+
+def us_per_render(render: Callable[[Dict[str, Any]], str], sessions: List[Dict[str, Any]], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(5):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            for d in sessions:
+                render(d)
+        best = min(best, time.perf_counter() - t0)
+    return best / (repeat * len(sessions)) * 1e6
+
+def run_render(args) -> None:
+    """Per-message cost of the review and admin texts: the old f-string builders vs. the compiled templates."""
+    sessions = review_sessions(random.Random(args.seed), args.render)
+    user = SimpleNamespace(id=10_000_001, username="sim10000001")
+    no_date = re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d")
+    mismatches = sum(
+        main.build_review_text(d, CATALOG, main.DEFAULT_LANGUAGE) != baseline_build_review_text(d)
+        or no_date.sub("", main.build_admin_text(d, user, CATALOG)) != no_date.sub("", baseline_build_admin_text(d, user))
+        for d in sessions
+    )
+    print(f"sessions: {len(sessions)}, {mismatches} rendered differently from before ({main.DEFAULT_LANGUAGE})")
+    print(f"\n{'message':<16}{'before µs':>11}{'now µs':>9}")
+    for lang in main.LANGUAGES:
+        now = us_per_render(lambda d: main.build_review_text(d, CATALOG, lang), sessions, args.render_repeat)
+        before = us_per_render(baseline_build_review_text, sessions, args.render_repeat) if lang == main.DEFAULT_LANGUAGE else None
+        print(f"{f'review ({lang})':<16}{'-' if before is None else f'{before:.2f}':>11}{now:>9.2f}")
+    # The admin text is always in the default language.
+    before = us_per_render(lambda d: baseline_build_admin_text(d, user), sessions, args.render_repeat)
+    now = us_per_render(lambda d: main.build_admin_text(d, user, CATALOG), sessions, args.render_repeat)
+    print(f"{'admin':<16}{before:>11.2f}{now:>9.2f}")
+    if mismatches:
+        sys.exit(1)
+
+# ----------------------- Keyboards -----------------------
+def keyboard_paths(lang: str, course: str) -> List[Tuple[str, Callable[[], Any], Callable[[], Any]]]:
+    """(callback, markup as it was built per callback before, markup as it is fetched now)."""
+    return [
+        ("/start", lambda: main.kb_register.__wrapped__(lang), lambda: main.kb_register(lang)),
+        ("section", lambda: main.kb_courses(CATALOG, lang), lambda: CATALOG.kb_courses[lang]),
+        ("course", lambda: main.kb_sections(CATALOG, lang, course), lambda: CATALOG.kb_sections[lang].get(course)),
+        ("age", lambda: main.kb_share_phone.__wrapped__(lang), lambda: main.kb_share_phone(lang)),
+        ("phone", lambda: main.kb_review.__wrapped__(lang), lambda: main.kb_review(lang)),
+        (
+            "edit",
+            lambda: main.kb_edit_menu(CATALOG, lang, course),
+            lambda: CATALOG.kb_edit_menu[lang].get(course, CATALOG.kb_edit_menu_default[lang]),
+        ),
+    ]
+
+def per_call(fn: Callable[[], Any], repeat: int) -> Tuple[float, float, float]:
+    """(µs per call, blocks and bytes still allocated per call while the results are held)."""
+    best = float("inf")
+    for _ in range(5):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, time.perf_counter() - t0)
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    blocks, before = sys.getallocatedblocks(), tracemalloc.get_traced_memory()[0]
+    held = [fn() for _ in range(repeat)]
+    blocks, size = sys.getallocatedblocks() - blocks, tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    gc.enable()
+    del held
+    return best / repeat * 1e6, blocks / repeat, size / repeat
+
+def run_keyboards(args) -> None:
+    """Keyboard cost per callback: building the markup each time (before) vs. the cached one (now)."""
+    course = next(k for k in CATALOG.courses if k in CATALOG.courses_with_level)
+    print(f"{args.keyboards} calls per path, course {course!r}; blocks/bytes are what each call leaves allocated")
+    print(f"\n{'callback':<14}{'before µs':>11}{'now µs':>9}{'before blocks':>15}{'now':>6}{'before B':>10}{'now':>6}{'send µs':>9}")
+    for lang in main.LANGUAGES:
+        for step, build, fetch in keyboard_paths(lang, course):
+            if build().to_dict() != fetch().to_dict():
+                sys.exit(f"{step} ({lang}): cached markup differs from a freshly built one")
+            before, now = per_call(build, args.keyboards), per_call(fetch, args.keyboards)
+            # Serializing the markup into the request is paid on every send either way.
+            markup = fetch()
+            send = per_call(lambda: json.dumps(markup.to_dict()), args.keyboards)[0]
+            print(
+                f"{f'{step} ({lang})':<14}{before[0]:>11.2f}{now[0]:>9.2f}{before[1]:>15.1f}{now[1]:>6.1f}"
+                f"{before[2]:>10.0f}{now[2]:>6.0f}{send:>9.2f}"
+            )
+
+# ----------------------- Callback routing -----------------------
+def callback_samples(extra: int) -> List[str]:
+    """One callback_data per route, with ``extra`` dummy routes (half exact, half with an argument)."""
+    samples = []
+    for key in main.CALLBACK_ROUTES:
+        if key in ("course", "level", "section"):
+            samples.append(f"reg:{key}:{next(iter(CATALOG.levels if key == 'level' else CATALOG.courses))}")
+        else:
+            samples.append(f"reg:{key}")
+    samples += [f"reg:x{i}" if i % 2 else f"reg:y{i}:arg" for i in range(extra)]
+    return samples + ["reg:unknown"]
+
+def baseline_router(routes: List[str]) -> Callable[[str], Optional[str]]:
+    """The old cb_handler: one ``if data == ...`` / ``data.startswith(...)`` branch per route, in order."""
+    branches = [
+        (True, f"reg:{key}:") if key in ("course", "level", "section") or key.startswith("y") else (False, f"reg:{key}")
+        for key in routes
+    ]
+    def route(data: str) -> Optional[str]:
+        for prefix, text in branches:
+            if data.startswith(text) if prefix else data == text:
+                return text
+        return None
+    return route
+
+def run_routes(args) -> None:
+    """Callback dispatch cost as routes are added: the routing table vs. the old if/elif chain."""
+    real = dict(main.CALLBACK_ROUTES)
+    print(f"{len(real)} real routes; traffic spread evenly over every route plus one unknown callback")
+    print(f"\n{'routes':>8}{'before ns':>11}{'now ns':>9}")
+    try:
+        for extra in (0, 10, 100, 1000, 10_000):
+            main.CALLBACK_ROUTES.clear()
+            main.CALLBACK_ROUTES.update(real)
+            dummy = main.callback_route(*(f"x{i}" if i % 2 else f"y{i}" for i in range(extra)))(real["cancel"])
+            samples = callback_samples(extra)
+            for data in samples:
+                cb = main.parse_callback(data)
+                expected = dummy if data.startswith(("reg:x", "reg:y")) else real.get(cb.key) or real.get(cb.action)
+                if main.resolve_callback(data)[0] is not expected:
+                    sys.exit(f"{extra} extra routes: {data!r} resolved to the wrong handler")
+            old = baseline_router(list(main.CALLBACK_ROUTES))
+            # Sample at most 1000 callbacks so every size runs in similar time.
+            step = max(1, len(samples) // 1000)
+            probes = samples[::step]
+            before = ns_per_call(old, probes, max(1, args.routes // len(probes)))
+            now = ns_per_call(lambda d: main.resolve_callback(d)[0], probes, max(1, args.routes // len(probes)))
+            print(f"{len(main.CALLBACK_ROUTES):>8}{before:>11.0f}{now:>9.0f}")
+    finally:
+        main.CALLBACK_ROUTES.clear()
+        main.CALLBACK_ROUTES.update(real)
+
+# ----------------------- Registrant search -----------------------
+FIRST_NAMES = ("Ali", "Vali", "Aziz", "Dilnoza", "Gʻayrat", "Madina", "Sardor", "Nodira", "Jasur", "Olga", "Ivan")
+LAST_NAMES = ("Valiyev", "Karimova", "Rahimov", "Yusupova", "Petrov", "Toshmatov", "Saidova", "Abdullayev")
+
+def write_registrations(path: str, rows: int, seed: int, first_user: int = 20_000_000) -> None:
+    """A registration log of ``rows`` synthetic rows spread evenly over two years, oldest first."""
+    rng = random.Random(seed)
+    courses = list(CATALOG.courses)
+    start = datetime(2024, 1, 1, tzinfo=main.tashkent_tz())
+    step = 2 * 365 * 86400 / rows
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(main.REGISTRATION_FIELDS)
+        for i in range(rows):
+            course = rng.choice(courses)
+            writer.writerow([
+                (start + timedelta(seconds=i * step)).isoformat(timespec="seconds"),
+                first_user + i,
+                f"user{i}",
+                course,
+                rng.choice(list(CATALOG.levels)) if course in CATALOG.courses_with_level else "",
+                rng.choice(list(CATALOG.sections[course])),
+                f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                rng.randint(6, 60),
+                f"+99890{rng.randrange(10_000_000):07d}",
+            ])
+
+def time_page(store, filters_: Dict[str, str], page: int, repeat: int) -> Tuple[float, int]:
+    """Median time to fetch page ``page`` (1-based), keyset-paging to it first; (0, 0) if there are fewer."""
+    before = None
+    for _ in range(page - 1):
+        rows, more = store.search(filters_, before=before, limit=main.CRM_PAGE)
+        if not more:
+            return 0.0, 0
+        before = rows[-1]["id"]
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        rows, _ = store.search(filters_, before=before, limit=main.CRM_PAGE)
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return percentile(timings, 0.5), len(rows)
+
+def run_crm(args) -> None:
+    """Imports --crm-rows synthetic registrations and times the first and a later /find page per search."""
+    path = os.path.join(main.DATA_DIR, "registrations.csv")
+    t0 = time.perf_counter()
+    write_registrations(path, args.crm_rows, args.seed)
+    t1 = time.perf_counter()
+    store = main.RegistrantStore(os.path.join(main.DATA_DIR, "registrants.sqlite3"))
+    store.sync([path])
+    t2 = time.perf_counter()
+    print(f"rows: {args.crm_rows}  log written in {t1 - t0:.1f}s, imported in {t2 - t1:.1f}s")
+
+    course = next(iter(CATALOG.courses))
+    section = next(iter(CATALOG.sections[course]))
+    searches = [
+        ("everyone", {}),
+        ("course", {"course": course}),
+        ("course+section", {"course": course, "section": section}),
+        ("section", {"section": section}),
+        ("name 'valiy'", {"name": "valiy"}),
+        ("name 'Ali' +course", {"name": "Ali", "course": course}),
+        ("name 'Al' (LIKE)", {"name": "Al"}),
+        ("phone +9989012", {"phone": "+9989012"}),
+        ("one month", {"from": "2025-03-01", "to": "2025-03-31"}),
+        ("month+course", {"from": "2025-03-01", "to": "2025-03-31", "course": course}),
+    ]
+    deep = args.crm_page
+    print(f"\n{'search':<22}{'page 1 ms':>12}{f'page {deep} ms':>14}{'rows':>6}")
+    for label, filters_ in searches:
+        first, _ = time_page(store, filters_, 1, args.crm_repeat)
+        later, n = time_page(store, filters_, deep, args.crm_repeat)
+        print(f"{label:<22}{first * 1000:>12.3f}{later * 1000:>14.3f}{n:>6}")
+    store.close()
+
+# ----------------------- Export -----------------------
+# Each exporter runs in a fresh process so its peak RSS is its own.
+EXPORT_CHILD = """
+import json, os, resource, sys, time
+import main
+fmt, dest, part_bytes, paths = sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4:]
+t0 = time.perf_counter()
+parts = (main.export_csv_gz if fmt == "csv" else main.export_parquet)(paths, dest, part_bytes)
+print(json.dumps({
+    "seconds": time.perf_counter() - t0,
+    "maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "parts": [os.path.getsize(p) for p in parts],
+}))
+"""
+
+def run_export(args) -> None:
+    """Exports --export-rows synthetic registrations in both formats; reports time, peak RSS and parts."""
+    main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-export-")
+    # Two logs, as a two-worker pool writes them.
+    paths = [os.path.join(main.DATA_DIR, f"registrations-{i}.csv") for i in range(2)]
+    t0 = time.perf_counter()
+    for i, path in enumerate(paths):
+        write_registrations(path, args.export_rows // 2 + (args.export_rows % 2 if i == 0 else 0), args.seed + i)
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f"rows: {args.export_rows}  logs: {size / 1e6:.0f} MB, written in {time.perf_counter() - t0:.1f}s")
+    part_bytes = int(args.export_part_mb * 1e6)
+    print(f"part limit: {args.export_part_mb:g} MB\n")
+    print(f"{'format':<10}{'seconds':>9}{'peak RSS MB':>13}{'parts':>7}{'largest MB':>12}{'total MB':>10}")
+    failed = False
+    for fmt, ext in (("csv", "csv.gz"), ("parquet", "parquet")):
+        dest = os.path.join(main.DATA_DIR, f"export.{ext}")
+        proc = subprocess.run(
+            [sys.executable, "-c", EXPORT_CHILD, fmt, dest, str(part_bytes), *paths],
+            capture_output=True, text=True, env=os.environ | {"DATA_DIR": main.DATA_DIR},
+        )
+        if proc.returncode:
+            print(f"{fmt:<10}failed: {proc.stderr.strip().splitlines()[-1]}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        parts = result["parts"]
+        print(
+            f"{fmt:<10}{result['seconds']:>9.1f}{maxrss_mb(result['maxrss']):>13.0f}{len(parts):>7}"
+            f"{max(parts) / 1e6:>12.1f}{sum(parts) / 1e6:>10.1f}"
+        )
+        failed |= max(parts) > part_bytes
+    if failed:
+        sys.exit(1)
+
+# ----------------------- Duplicate index -----------------------
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+def maxrss_mb(maxrss: int) -> float:
+    return maxrss * 1024 / 1e6  # ru_maxrss is in KiB
+
+def peak_rss_mb() -> float:
+    return maxrss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def time_checks(index, probes: List[Tuple[str, int]]) -> Tuple[float, float]:
+    """p50 and p99 of index.check() over ``probes``, in microseconds."""
+    times = []
+    for phone, user_id in probes:
+        t0 = time.perf_counter()
+        index.check(phone, user_id)
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return times[len(times) // 2] * 1e6, times[int(len(times) * 0.99)] * 1e6
+
+def run_index(args) -> None:
+    """Builds the duplicate index over --index-rows registrations, then times loads, lookups and memory."""
+    main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-index-")
+    path = os.path.join(main.DATA_DIR, "registrations-0.csv")
+    t0 = time.perf_counter()
+    write_registrations(path, args.index_rows, args.seed)
+    print(f"rows: {args.index_rows}  log written in {time.perf_counter() - t0:.1f}s")
+
+    print(f"\n{'load':<28}{'seconds':>9}{'held MB':>9}{'peak RSS MB':>13}")
+    for label in ("first (digests the log)", "restart (digest file)"):
+        before = rss_mb()
+        t0 = time.perf_counter()
+        index = main.RegistrationIndex(main.registration_logs)
+        index.load()
+        print(f"{label:<28}{time.perf_counter() - t0:>9.2f}{rss_mb() - before:>9.1f}{peak_rss_mb():>13.0f}")
+        if label.startswith("first"):
+            del index
+
+    rng = random.Random(args.seed)
+    picked = set(rng.sample(range(args.index_rows), min(args.index_lookups, args.index_rows)))
+    with open(path, encoding="utf-8") as f:
+        hits = [(row[8], int(row[1])) for i, row in enumerate(islice(csv.reader(f), 1, None)) if i in picked]
+    rng.shuffle(hits)
+    misses = [(f"+99899{rng.randrange(10_000_000):07d}", 90_000_000 + i) for i in range(args.index_lookups)]
+    print(f"\n{'check()':<28}{'p50 µs':>9}{'p99 µs':>9}")
+    for label, probes in (("registered", hits), ("new", misses)):
+        p50, p99 = time_checks(index, probes)
+        print(f"{label:<28}{p50:>9.1f}{p99:>9.1f}")
+
+    # Another worker registers someone: this index must see it without a restart.
+    other = main.RegistrationLog(
+        os.path.join(main.DATA_DIR, "registrations-1.csv"), os.path.join(main.DATA_DIR, "registration_stats-1.json")
+    )
+    user = SimpleNamespace(id=90_000_000, username="other")
+    other.append({"course_key": "c", "section_key": "s", "full_name": "A B", "age": 20, "phone": "+998990000000"}, user)
+    other.close()
+    seen = index.check("+998990000000", 1)
+    print(f"\nrepeat registered by another worker: {'caught' if seen == 'phone' else 'MISSED'}")
+    if seen != "phone" or any(index.check(phone, user_id) is None for phone, user_id in hits):
+        sys.exit(1)
+
+# ----------------------- Cold start -----------------------
+# Each child is a fresh interpreter handling one /start; it prints when it began and finished importing.
+COLD_START_CHILDREN = {
+    "serverless": """
+import time; t0 = time.time()
+import json, os, sys
+import serverless
+t1 = time.time()
+serverless.handle(os.environ["COLD_START_UPDATE"].encode(), {"X-Telegram-Bot-Api-Secret-Token": os.environ["WEBHOOK_SECRET"]})
+print(json.dumps({"start": t0, "imported": t1}))
+""",
+    # What main() does before its first update: build, post_init, webhook server, start.
+    "long-running": """
+import time; t0 = time.time()
+import asyncio, json, os, sys
+import main
+from telegram import Update
+t1 = time.time()
+
+async def go():
+    app = main.build_application()
+    await app.initialize()
+    await app.post_init(app)
+    await app.updater.start_webhook(
+        listen="127.0.0.1", port=int(os.environ["COLD_START_PORT"]), url_path="hook",
+        webhook_url="https://example.invalid/hook", secret_token=main.WEBHOOK_SECRET,
+    )
+    await app.start()
+    await app.update_queue.put(Update.de_json(json.loads(os.environ["COLD_START_UPDATE"]), app.bot))
+    await app.update_queue.join()
+    await app.updater.stop()
+    await app.stop()
+    await app.post_stop(app)
+    await app.shutdown()
+
+asyncio.run(go())
+print(json.dumps({"start": t0, "imported": t1}))
+""",
+}
+
+class StubHTTPServer:
+    """Minimal keep-alive HTTP/1.1 server on localhost; subclasses answer in ``respond``."""
+
+    async def respond(self, path: str, body: bytes) -> Tuple[int, bytes]:
+        raise NotImplementedError
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                path = lines[0].split(" ")[1]
+                length = 0
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self.respond(path, body)
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n".encode()
+                    + b"Content-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+class StubBotAPIServer(StubHTTPServer):
+    """Bot API over real HTTP on localhost, answering like FakeBotAPI and noting when calls arrive."""
+
+    def __init__(self, api: FakeBotAPI):
+        self.api = api
+        self.arrivals: List[Tuple[float, str]] = []
+        self.sent_to: Dict[str, List[float]] = defaultdict(list)  # chat_id -> sendMessage arrival times
+
+    async def respond(self, path: str, body: bytes) -> Tuple[int, bytes]:
+        method = path.rstrip("/").rsplit("/", 1)[-1]
+        self.arrivals.append((time.time(), method))
+        self.api.calls[method] += 1
+        params = dict(parse_qsl(body.decode()))
+        if method == "sendMessage":
+            self.sent_to[params["chat_id"]].append(time.monotonic())
+        return 200, json.dumps({"ok": True, "result": self.api._result(method, params)}).encode()
+
+class StubWebhook(StubHTTPServer):
+    """Lead webhook that answers 503 until ``down_until`` (monotonic), then takes ``delay`` s per request."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.down_until = 0.0
+        self.received: List[Dict[str, Any]] = []
+        self.refused = 0
+
+    async def respond(self, path: str, body: bytes) -> Tuple[int, bytes]:
+        if time.monotonic() < self.down_until:
+            self.refused += 1
+            return 503, b"{}"
+        await asyncio.sleep(self.delay)
+        self.received.append(json.loads(body))
+        return 200, b"{}"
+
+def import_times(stderr: str, names: Tuple[str, ...]) -> Dict[str, float]:
+    """Cumulative -X importtime milliseconds of the given top-level imports."""
+    result: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if name.strip() in names and not name.startswith("  "):
+                result[name.strip()] = result.get(name.strip(), 0) + int(cumulative) / 1000
+    return result
+
+async def run_cold_start(args) -> None:
+    """Times fresh processes from spawn to the first reply reaching a local Bot API stub."""
+    api = FakeBotAPI()
+    stub = StubBotAPIServer(api)
+    url = await stub.start()
+    update = json.dumps(UpdateFactory(api).message(777, "/start"))
+    tracked = ("main", "telegram", "telegram.ext", "serverless")
+    print(f"{'entry point':<14}{'spawn→ready ms':>16}{'first reply ms':>16}{'imports ms':>12}   top-level imports (ms)")
+    for mode, code in COLD_START_CHILDREN.items():
+        ready, first_reply, imports, detail = [], [], [], Counter()
+        for _ in range(args.cold_start):
+            env = dict(
+                os.environ,
+                DATA_DIR=tempfile.mkdtemp(prefix="iteach-cold-"),
+                BOT_API_URL=url,
+                WEBHOOK_SECRET="cold-start",
+                COLD_START_UPDATE=update,
+                COLD_START_PORT=str(20000 + random.randrange(20000)),
+            )
+            stub.arrivals.clear()
+            spawned = time.time()
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, "-X", "importtime", "-c", code,
+                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            )
+            out, err = await proc.communicate()
+            if proc.returncode:
+                sys.exit(f"{mode} child failed:\n{err.decode()[-2000:]}")
+            marks = json.loads(out.decode().strip().splitlines()[-1])
+            reply = next(t for t, method in stub.arrivals if method == "sendMessage")
+            ready.append((marks["imported"] - spawned) * 1000)
+            first_reply.append((reply - spawned) * 1000)
+            imports.append((marks["imported"] - marks["start"]) * 1000)
+            detail.update(import_times(err.decode(), tracked))
+        top = ", ".join(f"{name} {ms / args.cold_start:.0f}" for name, ms in detail.most_common())
+        print(
+            f"{mode:<14}{statistics.median(ready):>16.0f}{statistics.median(first_reply):>16.0f}"
+            f"{statistics.median(imports):>12.0f}   {top}"
+        )
+    await stub.stop()
+
+# ----------------------- Webhook vs polling -----------------------
+class PollingStub(StubBotAPIServer):
+    """StubBotAPIServer that also serves getUpdates from ``pending``, long polling like Telegram."""
+
+    def __init__(self, api: FakeBotAPI):
+        super().__init__(api)
+        self.pending: List[Dict[str, Any]] = []
+        self._arrived = asyncio.Event()
+
+    def push(self, data: Dict[str, Any]) -> None:
+        self.pending.append(data)
+        self._arrived.set()
+
+    async def respond(self, path: str, body: bytes) -> Tuple[int, bytes]:
+        if not path.endswith("/getUpdates"):
+            return await super().respond(path, body)
+        params = dict(parse_qsl(body.decode()))
+        offset = int(params.get("offset", 0))
+        # Everything below the offset has been confirmed.
+        self.pending = [data for data in self.pending if data["update_id"] >= offset]
+        if not self.pending:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), float(params.get("timeout", 0)))
+            except asyncio.TimeoutError:
+                pass
+        batch = self.pending[: int(params.get("limit", 100))]
+        return 200, json.dumps({"ok": True, "result": batch}).encode()
+
+    async def stop(self) -> None:
+        self._arrived.set()  # answer a poll still waiting
+        await super().stop()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class Delivered(NamedTuple):
+    latencies: List[float]  # scheduled send to handled, seconds
+    handled: int
+    wall: float  # first scheduled send to last update handled
+    refused: Counter  # wrong-secret POSTs by HTTP status
+    accepted_wrong: int  # wrong-secret updates that were handled anyway
+
+async def run_delivery(stub: PollingStub, stream: List[Dict[str, Any]], webhook: bool, rate: float) -> Delivered:
+    """Delivers ``stream`` at ``rate`` updates/s by webhook POSTs (plus wrong-secret ones) or getUpdates."""
+    main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-delivery-")
+    app = main.build_application()
+    handled: Dict[int, float] = {}
+
+    async def stamp(update: Update, context) -> None:
+        handled[update.update_id] = time.perf_counter()
+
+    app.add_handler(TypeHandler(Update, stamp), group=sys.maxsize)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    port = free_port()
+    if webhook:
+        await app.updater.start_webhook(
+            listen="127.0.0.1", port=port, url_path="hook", webhook_url="https://example.invalid/hook",
+            secret_token=main.WEBHOOK_SECRET, max_connections=main.WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+    await app.start()
+
+    refused: Counter = Counter()
+    wrong_ids = set()
+    client = httpx.AsyncClient(limits=httpx.Limits(max_connections=main.WEBHOOK_MAX_CONNECTIONS))
+    # Telegram opens at most max_connections at once; the rest wait their turn.
+    connections = asyncio.Semaphore(main.WEBHOOK_MAX_CONNECTIONS)
+
+    async def post(data: Dict[str, Any], secret: str) -> int:
+        async with connections:
+            response = await client.post(
+                f"http://127.0.0.1:{port}/hook", json=data, headers={"X-Telegram-Bot-Api-Secret-Token": secret}
+            )
+        return response.status_code
+
+    async def post_wrong(data: Dict[str, Any]) -> None:
+        refused[await post(data, "not-" + main.WEBHOOK_SECRET)] += 1
+
+    tasks = []
+    sent_at: Dict[int, float] = {}
+    t0 = time.perf_counter()
+    for i, data in enumerate(stream):
+        delay = t0 + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sent_at[data["update_id"]] = t0 + i / rate
+        if not webhook:
+            stub.push(data)
+            continue
+        tasks.append(asyncio.create_task(post(data, main.WEBHOOK_SECRET)))
+        if i % 10 == 0:
+            # A forged copy under an id nothing else uses; it must be refused and never handled.
+            forged = dict(data, update_id=data["update_id"] + 1_000_000_000)
+            wrong_ids.add(forged["update_id"])
+            tasks.append(asyncio.create_task(post_wrong(forged)))
+    statuses = Counter(await asyncio.gather(*tasks)) if tasks else Counter()
+    deadline = time.perf_counter() + 60
+    while len(sent_at.keys() & handled.keys()) < len(stream) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    await client.aclose()
+    await app.updater.stop()
+    await stop_app(app, 60)
+    done = [handled[i] - at for i, at in sent_at.items() if i in handled]
+    statuses.pop(None, None)
+    if webhook and set(statuses) != {200}:
+        sys.exit(f"webhook answered {dict(statuses)} to correctly signed updates")
+    return Delivered(
+        sorted(done),
+        len(done),
+        max(handled[i] for i in sent_at if i in handled) - t0,
+        refused,
+        len(wrong_ids & handled.keys()),
+    )
+
+async def run_webhook(args) -> None:
+    """The same stream by webhook and by long polling, at --webhook-rate updates/s, over local HTTP.
+
+    Both modes reply through the same Bot API stub. Every tenth update is also POSTed with a wrong
+    secret token; each of those must be refused with 403 and never reach a handler.
+    """
+    api = FakeBotAPI()
+    stub = PollingStub(api)
+    main.BOT_API_URL = await stub.start()
+    stream = interleaved_stream(api, args.users, args.seed)
+    # Telegram numbers updates in the order they arrive, and getUpdates confirms everything below its offset.
+    for update_id, data in enumerate(stream, 1):
+        data["update_id"] = update_id
+    print(f"updates: {len(stream)} from {args.users} users at {args.webhook_rate:g}/s")
+    print(f"\n{'mode':<10}{'handled':>9}{'updates/s':>11}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}   wrong secret")
+    failed = False
+    for name, webhook in (("polling", False), ("webhook", True)):
+        r = await run_delivery(stub, stream, webhook, args.webhook_rate)
+        wrong = (
+            f"{sum(r.refused.values())} sent, " + ", ".join(f"{n} × HTTP {code}" for code, n in sorted(r.refused.items()))
+            + f", {r.accepted_wrong} handled"
+            if webhook else "-"
+        )
+        print(
+            f"{name:<10}{r.handled:>9}{r.handled / r.wall:>11.0f}{percentile(r.latencies, 0.5) * 1000:>9.2f}"
+            f"{percentile(r.latencies, 0.99) * 1000:>9.2f}{r.latencies[-1] * 1000:>9.2f}   {wrong}"
+        )
+        failed |= r.handled != len(stream) or r.accepted_wrong > 0 or bool(set(r.refused) - {403})
+    await stub.stop()
+    if failed:
+        sys.exit(1)
+
+# ----------------------- Worker pool -----------------------
+def max_per_second(times: List[float]) -> int:
+    """Most events in any one-second window."""
+    times = sorted(times)
+    most = start = 0
+    for end, t in enumerate(times):
+        while t - times[start] >= 1:
+            start += 1
+        most = max(most, end - start + 1)
+    return most
+
+async def run_workers(args) -> None:
+    """Throughput of the WORKERS pool at 1, 2, 4, ... processes, against a local Bot API stub.
+
+    The same interleaved stream is routed through WorkerPool as the ingress process would, and timed
+    until every registration in it is written. Admin notifications are spaced by the production
+    OUTBOX_CHAT_INTERVAL, so the admin chat must get at most one message per interval however many
+    workers there are.
+    """
+    api = FakeBotAPI()
+    stub = StubBotAPIServer(api)
+    url = await stub.start()
+    stream = interleaved_stream(api, args.users, args.seed)
+    expected = sum(1 for data in stream if (data.get("callback_query") or {}).get("data") == "reg:confirm")
+    counts = [1]
+    while counts[-1] * 2 <= args.workers:
+        counts.append(counts[-1] * 2)
+    print(f"updates: {len(stream)} from {args.users} users, {expected} registrations; {os.cpu_count()} CPU(s)")
+    print(f"\n{'workers':>8}{'wall s':>9}{'updates/s':>11}{'speedup':>9}{'registered':>12}{'admin msgs/s max':>18}")
+    failed, single = False, None
+    for workers in counts:
+        directory = tempfile.mkdtemp(prefix="iteach-workers-")
+        # Spawned workers read their config from the environment.
+        os.environ.update(DATA_DIR=directory, BOT_API_URL=url, OUTBOX_CHAT_INTERVAL="1")
+        stub.sent_to.clear()
+        ready = api.calls["getMe"] + workers
+        pool = main.WorkerPool(workers)
+        pool.start()
+        while api.calls["getMe"] < ready:
+            await asyncio.sleep(0.05)
+        t0 = time.perf_counter()
+        for data in stream:
+            pool.route(Update.de_json(data, None))
+        registered = 0
+        while registered < expected and time.perf_counter() - t0 < 600:
+            await asyncio.sleep(0.05)
+            registered = sum(
+                sum(1 for _ in open(os.path.join(directory, name), encoding="utf-8")) - 1
+                for name in os.listdir(directory)
+                if name.startswith("registrations") and name.endswith(".csv")
+            )
+        wall = time.perf_counter() - t0
+        await pool.stop()
+        single = single or wall
+        admin = max_per_second(stub.sent_to[str(main.ADMIN_ID)])
+        print(
+            f"{workers:>8}{wall:>9.2f}{len(stream) / wall:>11.0f}{single / wall:>9.2f}{registered:>12}{admin:>18}"
+        )
+        failed |= registered != expected or admin > 2  # one a second, plus one on a window's edge
+    await stub.stop()
+    if failed:
+        sys.exit(1)
+
+# ----------------------- Admin notifications -----------------------
+class ChatLimitedBotAPI(FakeBotAPI):
+    """FakeBotAPI that answers sendMessage to ``chat_id`` with 429 past one message a second, as Telegram does."""
+
+    def __init__(self, latency: float, chat_id: int):
+        super().__init__(latency)
+        self.chat_id = chat_id
+        self.last_sent = 0.0
+        self.throttled = 0
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None, **kwargs):
+        if url.endswith("/sendMessage") and int(request_data.parameters["chat_id"]) == self.chat_id:
+            now = time.monotonic()
+            if now - self.last_sent < 1:
+                self.throttled += 1
+                return 429, json.dumps({
+                    "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }).encode()
+            self.last_sent = now
+        return await super().do_request(url, method, request_data, **kwargs)
+
+def notify_inline(app) -> None:
+    """Makes the confirm handler await the admin message itself, as it did before the outbox."""
+    texts: List[str] = []
+    app.bot_data["outbox"].publish = lambda text, record: texts.append(text)
+    confirm = main.CALLBACK_ROUTES["confirm"]
+
+    async def confirm_inline(update: Update, context, query, cb) -> None:
+        await confirm(update, context, query, cb)
+        while texts:
+            try:
+                await context.bot.send_message(chat_id=main.ADMIN_ID, text=texts.pop(), parse_mode="HTML")
+            except Exception as e:
+                main.logger.warning("Failed to notify admin: %s", e)
+
+    main.CALLBACK_ROUTES["confirm"] = confirm_inline
+
+async def run_confirm(args) -> None:
+    """Latency of the confirm tap with the admin message sent inline (before) vs. queued in the outbox."""
+    latency = args.api_latency / 1000
+    scenarios = (
+        (f"API {args.api_latency:g} ms", lambda: FakeBotAPI(latency)),
+        ("admin chat 1/s", lambda: ChatLimitedBotAPI(latency, main.ADMIN_ID)),
+    )
+    confirm = main.CALLBACK_ROUTES["confirm"]
+    print(f"{args.confirm} users, concurrency {args.concurrency}")
+    print(
+        f"\n{'scenario':<18}{'admin message':<15}{'confirms':>9}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        f"{'admin msgs':>12}{'left queued':>13}"
+    )
+    for scenario, make_api in scenarios:
+        for mode in ("inline", "outbox"):
+            main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-confirm-")
+            api = make_api()
+            app = main.build_application(request=api)
+            await app.initialize()
+            if app.post_init:
+                await app.post_init(app)
+            if mode == "inline":
+                notify_inline(app)
+            rec = Recorder()
+            try:
+                await run_synthetic(app, api, rec, args.confirm, args.concurrency, args.seed)
+            finally:
+                main.CALLBACK_ROUTES["confirm"] = confirm
+            # Admin messages still queued go out in post_stop, after the users have their answers.
+            if app.post_stop:
+                await app.post_stop(app)
+            queued = len(app.bot_data["outbox"])  # kept on disk for the next start
+            await app.shutdown()
+            values = sorted(rec.latencies["confirm"])
+            print(
+                f"{scenario:<18}{mode:<15}{len(values):>9}{percentile(values, 0.5) * 1000:>9.1f}"
+                f"{percentile(values, 0.99) * 1000:>9.1f}{values[-1] * 1000:>9.1f}"
+                f"{api._next_message_id[main.ADMIN_ID]:>12}{queued:>13}"
+            )
+
+class RecordingSink(main.Sink):
+    """Sink that keeps what it is given, for checking what an outbox delivers."""
+
+    kind = "replay"
+
+    def __init__(self, target: str = "recorder", batch_max: int = 1):
+        super().__init__(target)
+        self.batch_max = batch_max
+        self.delivered: List[str] = []
+
+    async def deliver(self, notes: List[Dict[str, Any]]) -> None:
+        if any(note["text"] == "rejected" for note in notes):
+            raise ValueError("rejected")  # as Telegram refuses a whole message over one bad entry
+        self.delivered += [note["text"] for note in notes]
+
+    def permanent(self, exc: Exception) -> bool:
+        return isinstance(exc, ValueError)
+
+async def delivered_after_restart(path: str) -> List[str]:
+    """Opens the outbox as a fresh process would and lets it deliver everything pending."""
+    sink = RecordingSink()
+    outbox = main.Outbox(path, sink)
+    outbox.start(None)
+    await outbox.stop(timeout=5)
+    return sink.delivered
+
+async def run_outbox_recovery(args) -> None:
+    """An outbox restarted after a crash left a torn write and a corrupt line, and a batch with a rejected note."""
+    failed = False
+    print(f"{'case':<40}{'delivered':<32}ok")
+
+    def report(case: str, delivered: List[str], expected: List[str]) -> None:
+        nonlocal failed
+        ok = delivered == expected
+        failed |= not ok
+        print(f"{case:<40}{','.join(delivered) or '-':<32}{'yes' if ok else f'no, expected {expected}'}")
+
+    def note(text: str) -> Dict[str, Any]:
+        return {"text": text, "record": {}}
+
+    path = os.path.join(tempfile.mkdtemp(prefix="iteach-outbox-"), "outbox.jsonl")
+    outbox = main.Outbox(path, RecordingSink())
+    outbox.append(note("a"))
+    outbox.append(note("b"))
+    await outbox.stop()
+    with open(path, "ab") as f:
+        f.write(b"not json\n")  # a complete but unreadable line
+        f.write(b'{"text": "tor')  # the process died mid-write
+    # The restart that finds the torn write publishes before anything is delivered.
+    outbox = main.Outbox(path, RecordingSink())
+    outbox.append(note("c"))
+    await outbox.stop()
+    report("torn write, publish, restart", await delivered_after_restart(path), ["a", "b", "c"])
+
+    # Crash between compacting the log and saving the offset: the saved offset is past the end.
+    path = os.path.join(tempfile.mkdtemp(prefix="iteach-outbox-"), "outbox.jsonl")
+    with open(path + ".offset", "w") as f:
+        f.write("4096")
+    open(path, "wb").close()
+    outbox = main.Outbox(path, RecordingSink())
+    outbox.append(note("d"))
+    await outbox.stop()
+    report("offset past the end, publish, restart", await delivered_after_restart(path), ["d"])
+
+    # A batch with one note the sink rejects: the others still go out.
+    path = os.path.join(tempfile.mkdtemp(prefix="iteach-outbox-"), "outbox.jsonl")
+    sink = RecordingSink(batch_max=10)
+    outbox = main.Outbox(path, sink)
+    for text in ("e", "rejected", "f"):
+        outbox.append(note(text))
+    outbox.start(None)
+    await outbox.stop(timeout=5)
+    report("one rejected note in a batch", sink.delivered, ["e", "f"])
+    if failed:
+        sys.exit(1)
+
+def sink_counters(name: str) -> Dict[str, float]:
+    """Current iteach_notify_*_total counters, by sink label."""
+    result: Dict[str, float] = defaultdict(float)
+    for (metric, labels), value in main.metrics.counters.items():
+        if metric == name:
+            result[dict(labels)["sink"]] += value
+    return result
+
+async def run_sinks(args, api: FakeBotAPI) -> None:
+    """Confirm latency and delivery with one admin chat vs. a fan-out whose webhook is down, then slow."""
+    webhook = StubWebhook(args.webhook_delay / 1000)
+    url = await webhook.start()
+    course = next(iter(main.load_catalog(main.CATALOG_PATH).courses))
+    setups = (
+        ("admin chat", f"telegram:{main.ADMIN_ID}"),
+        ("fan-out", f"telegram:{main.ADMIN_ID},telegram:-100200#{course},webhook:{url}/leads,file:leads.jsonl"),
+    )
+    print(f"{'sinks':<12}{'regs':>6}{'wall s':>8}{'confirm p50':>13}{'p99 ms':>8}{'delivered after s':>19}")
+    for label, spec in setups:
+        main.DATA_DIR = tempfile.mkdtemp(prefix="iteach-sinks-")
+        main.NOTIFY_SINKS = spec
+        webhook.received.clear()
+        webhook.refused = 0
+        webhook.down_until = time.monotonic() + args.webhook_down
+        before = {m: sink_counters(m) for m in ("iteach_notify_sent_total", "iteach_notify_failures_total")}
+        app = main.build_application(request=api)
+        await app.initialize()
+        await app.post_init(app)
+        rec = Recorder()
+        t0 = time.perf_counter()
+        await run_synthetic(app, api, rec, args.users, args.concurrency, args.seed)
+        wall = time.perf_counter() - t0
+        outbox = app.bot_data["outbox"]
+        deadline = time.monotonic() + 120
+        while len(outbox) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        settled = time.perf_counter() - t0
+        confirm = sorted(rec.latencies["confirm"])
+        print(
+            f"{label:<12}{rec.completed:>6}{wall:>8.2f}{percentile(confirm, 0.5) * 1000:>13.3f}"
+            f"{percentile(confirm, 0.99) * 1000:>8.3f}{settled:>19.2f}"
+        )
+        sent = sink_counters("iteach_notify_sent_total")
+        failures = sink_counters("iteach_notify_failures_total")
+        for outbox_ in outbox.outboxes:
+            name = outbox_.sink.name
+            print(
+                f"    {name:<48} sent {sent[name] - before['iteach_notify_sent_total'].get(name, 0):>6.0f}"
+                f"  failed {failures[name] - before['iteach_notify_failures_total'].get(name, 0):>4.0f}"
+                f"  pending {len(outbox_):>4}"
+            )
+        if "webhook" in spec:
+            with open(os.path.join(main.DATA_DIR, "leads.jsonl"), encoding="utf-8") as f:
+                lines = sum(1 for _ in f)
+            leads = {(r["user_id"], r["ts"]) for r in webhook.received}
+            print(
+                f"    webhook: {len(leads)} distinct leads, {webhook.refused} requests refused while down;"
+                f" file sink: {lines} lines"
+            )
+        await app.post_stop(app)
+        await app.shutdown()
+    await webhook.stop()
+
+async def run(args) -> None:
+    if args.cold_start:
+        await run_cold_start(args)
+        return
+    if args.crm_rows:
+        run_crm(args)
+        return
+    if args.validation:
+        run_validation(args)
+        return
+    if args.render:
+        run_render(args)
+        return
+    if args.keyboards:
+        run_keyboards(args)
+        return
+    if args.routes:
+        run_routes(args)
+        return
+    if args.index_rows:
+        run_index(args)
+        return
+    if args.export_rows:
+        run_export(args)
+        return
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    if args.restart_at is not None:
+        await run_restart(args, api)
+        return
+    if args.ordering:
+        await run_ordering(args, api)
+        return
+    if args.sinks:
+        await run_sinks(args, api)
+        return
+    if args.confirm:
+        await run_confirm(args)
+        return
+    if args.outbox_recovery:
+        await run_outbox_recovery(args)
+        return
+    if args.broadcast:
+        await run_broadcast(args)
+        return
+    if args.workers:
+        await run_workers(args)
+        return
+    if args.webhook_rate:
+        await run_webhook(args)
+        return
+    if args.sessions:
+        await run_sessions(args, api)
+        return
+    if args.spam:
+        await run_spam(args, api)
+        return
+    if args.prompts:
+        await run_prompts(args)
+        return
+    app = main.build_application(request=api)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+
+    rec = Recorder()
+    rss_before = rss_mb()
+    if args.tracemalloc:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    if args.replay:
+        await run_recorded(app, rec, args.replay)
+    else:
+        await run_synthetic(app, api, rec, args.users, args.concurrency, args.seed)
+    wall = time.perf_counter() - t0
+    rss_after, sessions = rss_mb(), len(app.user_data)
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    # Let the admin outbox deliver so its sends are counted too.
+    deadline = time.monotonic() + 10
+    while len(app.bot_data["outbox"]) and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    if app.post_stop:
+        await app.post_stop(app)
+    await app.shutdown()
+
+    print(f"updates: {rec.updates}  completed registrations: {rec.completed}  wall: {wall:.2f}s")
+    print(f"throughput: {rec.updates / wall:.0f} updates/s, {rec.completed / wall:.1f} registrations/s")
+    print(f"\n{'step':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, values in sorted(rec.latencies.items()):
+        values.sort()
+        print(
+            f"{label:<12}{len(values):>8}{percentile(values, 0.5) * 1000:>10.3f}"
+            f"{percentile(values, 0.95) * 1000:>10.3f}{percentile(values, 0.99) * 1000:>10.3f}"
+        )
+    total_calls = sum(api.calls.values())
+    print(f"\noutbound API calls: {total_calls}")
+    for name, n in api.calls.most_common():
+        print(f"  {name:<24}{n:>8}")
+    if rec.completed:
+        print(f"calls per completed registration: {total_calls / rec.completed:.2f}")
+    if args.tracemalloc:
+        print(f"\nallocations: peak {peak / 1e6:.1f} MB, {peak / max(rec.updates, 1) / 1e3:.1f} kB per update at peak")
+    print(
+        f"\nresident memory: {rss_before:.0f} MB before, {rss_after:.0f} MB after ({sessions} sessions held),"
+        f" peak {peak_rss_mb():.0f} MB"
+    )
+
+def parse_args(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Replay updates through the bot against a fake Bot API.")
+    parser.add_argument("--users", type=int, default=1000, help="simulated users (synthetic mode)")
+    parser.add_argument("--concurrency", type=int, default=200, help="users in flight at once")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency in ms")
+    parser.add_argument("--replay", help="JSONL file of recorded updates to replay instead")
+    parser.add_argument("--tracemalloc", action="store_true", help="report allocation peak (slower)")
+    parser.add_argument("--restart-at", type=float, help="restart the application after this fraction of updates")
+    parser.add_argument(
+        "--ordering", action="store_true", help="compare sequential, unordered and per-user ordered handling"
+    )
+    parser.add_argument("--flood", type=int, default=600, help="taps one user queues ahead of the rest (--ordering)")
+    parser.add_argument("--confirm", type=int, help="time the confirm tap for this many users, inline vs outbox")
+    parser.add_argument("--webhook-rate", type=float, help="compare webhook and polling at this many updates/s")
+    parser.add_argument("--workers", type=int, help="benchmark the worker pool at 1, 2, 4, ... up to this many")
+    parser.add_argument("--prompts", action="store_true", help="calls per registration, new prompts vs edits")
+    parser.add_argument("--spam", type=int, help="users flooding the bot while --users register")
+    parser.add_argument("--spam-rate", type=float, default=20, help="updates/s each spammer sends")
+    parser.add_argument("--broadcast", type=int, help="/broadcast to this many registrants, stopped and resumed")
+    parser.add_argument("--broadcast-rate", type=int, default=2000, help="messages/s the mock API accepts")
+    parser.add_argument("--sessions", type=int, help="memory and reaper benchmark over this many abandoned sessions")
+    parser.add_argument("--outbox-recovery", action="store_true", help="restart an outbox after a torn write")
+    parser.add_argument("--sinks", action="store_true", help="admin notification fan-out to several sinks")
+    parser.add_argument("--webhook-down", type=float, default=4.0, help="seconds the stub webhook refuses requests")
+    parser.add_argument("--webhook-delay", type=float, default=20.0, help="stub webhook response time in ms")
+    parser.add_argument("--cold-start", type=int, help="time this many fresh processes per entry point")
+    parser.add_argument("--crm-rows", type=int, help="benchmark /find search over this many registrants")
+    parser.add_argument("--crm-page", type=int, default=100, help="the later /find page to time")
+    parser.add_argument("--crm-repeat", type=int, default=20, help="timed runs per search (median is shown)")
+    parser.add_argument("--export-rows", type=int, help="benchmark /export over this many registrations")
+    parser.add_argument("--export-part-mb", type=float, default=main.EXPORT_PART_MB, help="export part size limit")
+    parser.add_argument("--validation", type=int, help="fuzz the input validators with this many inputs each")
+    parser.add_argument("--validation-repeat", type=int, default=2000, help="timed passes over the corpus")
+    parser.add_argument("--render", type=int, help="time the review/admin texts over this many sessions")
+    parser.add_argument("--render-repeat", type=int, default=200, help="timed passes over the sessions")
+    parser.add_argument("--keyboards", type=int, help="time each keyboard path over this many calls")
+    parser.add_argument("--routes", type=int, help="time this many callback dispatches per routing-table size")
+    parser.add_argument("--index-rows", type=int, help="benchmark the duplicate index over this many registrations")
+    parser.add_argument("--index-lookups", type=int, default=10_000, help="timed check() calls per kind")
+    parser.add_argument(
+        "--drain-timeout", type=float, default=0.05, help="drain deadline for the restarted instance, seconds"
+    )
+    parser.add_argument(
+        "--drain-grace", type=float, default=main.SHUTDOWN_GRACE, help="time running handlers get after it, seconds"
+    )
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args(sys.argv[1:])))
@@ -0,0 +1,71 @@
+# serverless.py
+# Entry point for running the bot as a short-lived function per webhook call (AWS Lambda, Cloud Run
+# jobs, Vercel, ...). Importing this module is cheap: main.py and the telegram stack are imported
+# on the first update, and a warm instance reuses the application that call built.
+#
+#   handle(body, headers) -> (status, response body)   # any runtime that hands over the raw request
+#   lambda_handler(event, context)                      # AWS Lambda function URL / API Gateway proxy
+#
+# Register the function URL once with setWebhook, passing WEBHOOK_SECRET as secret_token; the same
+# WEBHOOK_SECRET must be set in the function's environment. Runtimes that freeze the process between
+# calls get no background work: sessions and admin notifications are flushed before each response.
+# Instances may share DATA_DIR; each leases its own set of outbox and registration log files.
+
+import os
+import hmac
+import json
+import base64
+import asyncio
+import logging
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+logger = logging.getLogger("iteach_bot")
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_app = None
+
+async def _application():
+    global _app
+    if _app is None:
+        import main  # the expensive part of a cold start, paid only once a real update arrives
+
+        app = main.build_application(oneshot=True)
+        await app.initialize()
+        _app = app
+    return _app
+
+async def _handle(data: Dict[str, Any]) -> None:
+    import main
+
+    await main.handle_update_once(await _application(), data)
+
+def handle(body: bytes, headers: Mapping[str, str]) -> Tuple[int, str]:
+    """Handles one webhook request; returns the HTTP status and body to answer Telegram with."""
+    global _loop
+    # Checked before anything is imported, so forged requests never pay for a cold start.
+    secret = os.getenv("WEBHOOK_SECRET")
+    sent = next((v for k, v in headers.items() if k.lower() == SECRET_HEADER), None)
+    if not secret or sent is None or not hmac.compare_digest(sent.encode(), secret.encode()):
+        return 403, "forbidden"
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return 400, "bad request"
+    # One loop for the life of the instance: the HTTP client's connections are bound to it.
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+    try:
+        _loop.run_until_complete(_handle(data))
+    except Exception:
+        # Telegram redelivers on errors; a handler bug would then repeat forever, so acknowledge.
+        logger.exception("Update %s failed", data.get("update_id"))
+    return 200, "ok"
+
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+    status, text = handle(body.encode() if isinstance(body, str) else body, event.get("headers") or {})
+    return {"statusCode": status, "body": text}